@@ -1,15 +1,32 @@
 from fastapi import APIRouter, HTTPException
 from fastapi import BackgroundTasks
+from typing import Optional
 from pydantic import BaseModel, Field
-from services.api.database import get_connection, release_connection
+from services.api.database import (
+    get_connection, release_connection,
+    get_async_connection, release_async_connection,
+)
+from services.api.ml_service import DEFAULT_CLAMPS, log_prediction
+from services.api.telemetry_store import SENSOR_FIELDS, fetch_latest_async
+from services.api.kit_registry import is_valid_device, is_valid_device_async
+from services.api.responses import FastJSONResponse, check_format, stream_query
+from services.ml.predictor import predict_from_dict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import asyncio
 import os
 import time
 import httpx
 import logging
 
 # Environment configuration
+# ML_INFERENCE_MODE: "inprocess" calls the predictor directly on a worker pool,
+# "http" posts to ML_PREDICT_URL (use when the model runs out-of-process)
+ML_INFERENCE_MODE = os.getenv("ML_INFERENCE_MODE", "inprocess").lower()
 ML_PREDICT_URL = os.getenv("ML_PREDICT_URL", "http://127.0.0.1:8000/ml/predict")
 # ML_PREDICT_URL = os.getenv("ML_PREDICT_URL", "http://127.0.0.1:9999/invalid")  # Wrong port
+ML_TIMEOUT = float(os.getenv("ML_TIMEOUT", "2.0"))
+ML_WORKERS = int(os.getenv("ML_WORKERS", "4"))
 
 # ANSI Color Codes for professional terminal output
 class Colors:
@@ -69,6 +86,43 @@ CRITICAL_THRESHOLDS = {
     "waterLevel": {"min": 1.0}
 }
 
+# ML INFERENCE
+# Bounded pool so CPU-bound forest inference never runs on the event loop
+_ml_executor = ThreadPoolExecutor(max_workers=ML_WORKERS, thread_name_prefix="ml-infer")
+_ml_http_client = None
+
+
+def _get_ml_http_client():
+    """Shared client for HTTP mode (keeps connections alive between calls)."""
+    global _ml_http_client
+    if _ml_http_client is None or _ml_http_client.is_closed:
+        _ml_http_client = httpx.AsyncClient(timeout=ML_TIMEOUT)
+    return _ml_http_client
+
+
+def _predict_and_log(device_id, payload):
+    result = predict_from_dict(payload, clamp_limits=DEFAULT_CLAMPS)
+    log_prediction(device_id, payload, result)
+    return result
+
+
+async def _ml_predict(device_id: str, payload: dict, timeout: float = ML_TIMEOUT):
+    """
+    Run ML inference for one telemetry payload.
+    Raises asyncio.TimeoutError / httpx errors on failure so callers can fall back.
+    """
+    if ML_INFERENCE_MODE == "http":
+        client = _get_ml_http_client()
+        r = await client.post(ML_PREDICT_URL, json={**payload, "deviceId": device_id}, timeout=timeout)
+        if r.status_code != 200:
+            raise RuntimeError(f"http_status={r.status_code}")
+        return r.json()
+
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_ml_executor, _predict_and_log, device_id, payload)
+    return await asyncio.wait_for(future, timeout=timeout)
+
+
 # MIGRATION
 def run_actuator_migration():
     """
@@ -103,18 +157,6 @@ def run_actuator_migration():
 
 
 # HELPERS
-def is_valid_device(device_id: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT 1 FROM kits WHERE id = %s;", (device_id,))
-        found = cur.fetchone()
-        return found is not None
-    finally:
-        cur.close()
-        release_connection(conn)
-
-
 def is_critical(ph, ppm, water_level):
     """Check if telemetry values are in critical range (bypass cooldown)."""
     critical = False
@@ -139,43 +181,124 @@ def is_critical(ph, ppm, water_level):
     return critical
 
 
-def check_cooldown(device_id, predictions):
+ACTION_TYPES = ["phUp", "phDown", "nutrientAdd", "refill"]
+
+
+class CooldownStore:
+    """
+    actuator_cooldown keyed by (deviceId, actionType), with the database as the
+    authority. Other API workers write the same rows, so memory only remembers
+    cooldowns that are still running: lastTime only ever moves forward, so "still
+    cooling down" cannot go stale, and when every requested action is cooling the
+    DB read is skipped. Anything else is read from the database (all action types
+    of a device in one query). Writes are a single multi-row upsert on the caller's
+    async cursor (committed with the caller's transaction).
+    """
+
+    def __init__(self, cooldown_ms):
+        self.cooldown_ms = cooldown_ms
+        self._last_time = {}   # (deviceId, actionType) -> lastTime (ms), only while cooling down
+        self._lock = Lock()
+
+    def _cooling(self, t, now_ms):
+        return t is not None and now_ms - t < self.cooldown_ms
+
+    async def get(self, cur, device_id, actions=ACTION_TYPES, now_ms=None):
+        """Return {actionType: lastTime or None} covering at least `actions`."""
+        now_ms = now_ms or int(time.time() * 1000)
+        with self._lock:
+            cached = {a: self._last_time.get((device_id, a)) for a in ACTION_TYPES}
+        if all(self._cooling(cached[a], now_ms) for a in actions):
+            return cached
+
+        await cur.execute("""
+            SELECT "actionType", "lastTime" FROM actuator_cooldown
+            WHERE "deviceId" = %s;
+        """, (device_id,))
+        rows = dict(await cur.fetchall())
+
+        with self._lock:
+            for a in ACTION_TYPES:
+                self._keep(device_id, a, rows.get(a), now_ms)
+
+        return {a: rows.get(a) for a in ACTION_TYPES}
+
+    def _keep(self, device_id, action, t, now_ms):
+        # caller holds self._lock
+        key = (device_id, action)
+        if self._cooling(t, now_ms):
+            if t > self._last_time.get(key, t - 1):
+                self._last_time[key] = t
+        else:
+            self._last_time.pop(key, None)
+
+    async def put(self, cur, device_id, values, current_time):
+        """
+        Upsert lastTime/lastValue for every action with a non-zero value and return
+        the written rows. The cache is not touched: pass the rows to remember() once
+        the caller's transaction has committed.
+        """
+        rows = [
+            (device_id, a, current_time, float(values.get(a, 0)))
+            for a in ACTION_TYPES
+            if values.get(a, 0) > 0
+        ]
+        if not rows:
+            return rows
+
+        await cur.execute("""
+            INSERT INTO actuator_cooldown ("deviceId", "actionType", "lastTime", "lastValue")
+            SELECT %s::text, a, %s::bigint, v
+            FROM unnest(%s::text[], %s::float8[]) AS u(a, v)
+            ON CONFLICT ("deviceId", "actionType")
+            DO UPDATE SET "lastTime" = EXCLUDED."lastTime", "lastValue" = EXCLUDED."lastValue";
+        """, (device_id, current_time, [r[1] for r in rows], [r[3] for r in rows]))
+        return rows
+
+    def remember(self, rows):
+        """Cache rows returned by put() after their transaction committed."""
+        now_ms = int(time.time() * 1000)
+        with self._lock:
+            for device_id, a, t, _ in rows:
+                self._keep(device_id, a, t, now_ms)
+
+
+cooldown_store = CooldownStore(COOLDOWN_SECONDS * 1000)
+
+
+async def check_cooldown(device_id, predictions, cur):
     """
     Check if any actions are blocked by cooldown.
     Returns dict with blocked actions set to 0.
+    Uses the caller's cursor; must run before the caller writes anything.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    
     current_time = int(time.time() * 1000)
     result = predictions.copy()
     blocked_actions = []
+
+    # Only check if at least one action was going to be executed
+    if not any(predictions.get(a, 0) > 0 for a in ACTION_TYPES):
+        return result
     
     try:
-        for action_type in ["phUp", "phDown", "nutrientAdd", "refill"]:
-            # Only check if action was going to be executed
-            if predictions.get(action_type, 0) > 0:
-                cur.execute("""
-                    SELECT "lastTime" FROM actuator_cooldown
-                    WHERE "deviceId" = %s AND "actionType" = %s;
-                """, (device_id, action_type))
+        wanted = [a for a in ACTION_TYPES if predictions.get(a, 0) > 0]
+        last_times = await cooldown_store.get(cur, device_id, wanted, current_time)
+
+        for action_type in ACTION_TYPES:
+            last_time = last_times.get(action_type)
+            if predictions.get(action_type, 0) > 0 and last_time is not None:
+                time_diff_sec = (current_time - last_time) / 1000.0
                 
-                row = cur.fetchone()
-                if row:
-                    last_time = row[0]
-                    time_diff_sec = (current_time - last_time) / 1000.0
-                    
-                    if time_diff_sec < COOLDOWN_SECONDS:
-                        # Cooldown still active - block this action
-                        result[action_type] = 0
-                        remaining = int(COOLDOWN_SECONDS - time_diff_sec)
-                        blocked_actions.append(f"{action_type}:{remaining}s")
+                if time_diff_sec < COOLDOWN_SECONDS:
+                    # Cooldown still active - block this action
+                    result[action_type] = 0
+                    remaining = int(COOLDOWN_SECONDS - time_diff_sec)
+                    blocked_actions.append(f"{action_type}:{remaining}s")
     
     except Exception as e:
+        # Nothing has been written yet, so rolling back only clears the aborted read
+        await cur.connection.rollback()
         logger.error(f"COOLDOWN_ERROR | error={str(e)}")
-    finally:
-        cur.close()
-        release_connection(conn)
     
     # Log all blocked actions in one line
     if blocked_actions:
@@ -192,34 +315,20 @@ def check_cooldown(device_id, predictions):
     return result
 
 
-def update_cooldown(device_id, predictions):
-    """Update cooldown timestamps for executed actions."""
-    conn = get_connection()
-    cur = conn.cursor()
-    
+async def update_cooldown(device_id, predictions, cur):
+    """
+    Update cooldown timestamps for executed actions.
+    Uses the caller's cursor; the caller commits and then passes the returned
+    rows to cooldown_store.remember().
+    """
     current_time = int(time.time() * 1000)
     
     try:
-        for action_type in ["phUp", "phDown", "nutrientAdd", "refill"]:
-            action_value = predictions.get(action_type, 0)
-            
-            # Only update if action was executed (non-zero)
-            if action_value > 0:
-                cur.execute("""
-                    INSERT INTO actuator_cooldown ("deviceId", "actionType", "lastTime", "lastValue")
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT ("deviceId", "actionType")
-                    DO UPDATE SET "lastTime" = EXCLUDED."lastTime", "lastValue" = EXCLUDED."lastValue";
-                """, (device_id, action_type, current_time, float(action_value)))
-        
-        conn.commit()
-    
+        return await cooldown_store.put(cur, device_id, predictions, current_time)
     except Exception as e:
-        conn.rollback()
+        await cur.connection.rollback()
         logger.error(f"COOLDOWN_UPDATE_ERROR | error={str(e)}")
-    finally:
-        cur.close()
-        release_connection(conn)
+        return []
 
 
 # PAYLOAD MODEL
@@ -245,32 +354,34 @@ class ActuatorEvent(BaseModel):
 # INSERT ACTUATOR EVENT
 @router.post("/event")
 async def insert_event(deviceId: str, data: ActuatorEvent, background_tasks: BackgroundTasks, userId: str = None):
+    return await execute_event(deviceId, data, userId)
+
+
+async def execute_event(deviceId: str, data: ActuatorEvent, userId: str = None):
+    """
+    Core actuator logic shared by the HTTP route and the auto mode scheduler.
+    Raises HTTPException on invalid device or database errors.
+    """
     deviceId = deviceId.strip()
     source = "rule"  # Local variable instead of global
 
-    if not is_valid_device(deviceId):
+    if not await is_valid_device_async(deviceId):
         raise HTTPException(400, "Invalid deviceId. Register device using /kits.")
 
-    conn = get_connection()
+    conn = await get_async_connection()
     cur = conn.cursor()
 
     ingestTime = int(time.time() * 1000)
+    cooldown_updates = None
 
     try:
         # AUTO MODE
         if data.auto == 1:
             # Ambil telemetry terbaru
-            cur.execute("""
-                SELECT ppm, ph, "tempC", humidity, "waterTemp", "waterLevel"
-                FROM telemetry
-                WHERE "deviceId" = %s
-                ORDER BY "ingestTime" DESC
-                LIMIT 1;
-            """, (deviceId,))
-            t = cur.fetchone()
-
-            if t:
-                ppm, ph, tempC, humidity, waterTemp, wl = t
+            latest = await fetch_latest_async(cur, deviceId)
+
+            if latest:
+                ppm, ph, tempC, humidity, waterTemp, wl = (latest[1][k] for k in SENSOR_FIELDS)
                 logger.info(f"AUTO_MODE | pH={ph:.2f} PPM={ppm:.1f} temp={tempC:.1f}C water_level={wl:.1f}")
             else:
                 ppm, ph, tempC, humidity, waterTemp, wl = (0, 0, 0, 0, 0, 0)
@@ -288,11 +399,9 @@ async def insert_event(deviceId: str, data: ActuatorEvent, background_tasks: Bac
                     "waterLevel": wl
                 }
                 
-                async with httpx.AsyncClient(timeout=2.0) as client:
-                    r = await client.post(ML_PREDICT_URL, json=ml_payload)
-                
-                if r.status_code == 200:
-                    ml = r.json()
+                ml = await _ml_predict(deviceId, ml_payload)
+
+                if ml:
                     data.phUp = int(ml.get("phUp", 0))
                     data.phDown = int(ml.get("phDown", 0))
                     data.nutrientAdd = int(ml.get("nutrientAdd", 0))
@@ -339,10 +448,8 @@ async def insert_event(deviceId: str, data: ActuatorEvent, background_tasks: Bac
                     
                     # Log FINAL values (after constraints applied)
                     logger.info(f"ML_PREDICT | phUp={data.phUp}s phDown={data.phDown}s nutrient={data.nutrientAdd}s refill={data.refill}s")
-                else:
-                    logger.warning(f"ML_ERROR | http_status={r.status_code}")
                     
-            except (httpx.TimeoutException, httpx.ConnectError):
+            except (asyncio.TimeoutError, httpx.TimeoutException, httpx.ConnectError):
                 logger.warning(f"ML_TIMEOUT | fallback=rule_based")
             except Exception as e:
                 logger.error(f"ML_ERROR | error={str(e)}")
@@ -419,7 +526,7 @@ async def insert_event(deviceId: str, data: ActuatorEvent, background_tasks: Bac
                 }
                 
                 # Check cooldown and get filtered predictions
-                filtered = check_cooldown(deviceId, predictions)
+                filtered = await check_cooldown(deviceId, predictions, cur)
                 
                 # Update data with filtered values
                 data.phUp = int(filtered["phUp"])
@@ -429,14 +536,13 @@ async def insert_event(deviceId: str, data: ActuatorEvent, background_tasks: Bac
                 data.valueS = float(filtered["valueS"])
             # No need to log bypass here, already logged in is_critical()
 
-            # Update cooldown timestamps for executed actions
+            # Cooldown timestamps for executed actions (written with the event below)
             cooldown_updates = {
                 "phUp": data.phUp,
                 "phDown": data.phDown,
                 "nutrientAdd": data.nutrientAdd,
                 "refill": data.refill
             }
-            update_cooldown(deviceId, cooldown_updates)
 
 
         # INSERT FINAL ACTUATOR EVENT
@@ -444,7 +550,11 @@ async def insert_event(deviceId: str, data: ActuatorEvent, background_tasks: Bac
         max_retries = 2
         for attempt in range(max_retries):
             try:
-                cur.execute("""
+                cooldown_rows = []
+                if cooldown_updates:
+                    cooldown_rows = await update_cooldown(deviceId, cooldown_updates, cur)
+
+                await cur.execute("""
                     INSERT INTO actuator_event
                         ("deviceId", "ingestTime",
                          "phUp", "phDown", "nutrientAdd", "valueS",
@@ -457,8 +567,9 @@ async def insert_event(deviceId: str, data: ActuatorEvent, background_tasks: Bac
                     int(data.manual), int(data.auto), int(data.refill)
                 ))
 
-                new_id = cur.fetchone()[0]
-                conn.commit()
+                new_id = (await cur.fetchone())[0]
+                await conn.commit()
+                cooldown_store.remember(cooldown_rows)
                 
                 # Log final result with source  
                 if data.auto == 1:
@@ -486,21 +597,21 @@ async def insert_event(deviceId: str, data: ActuatorEvent, background_tasks: Bac
                 if "UniqueViolation" in str(type(insert_error).__name__) or "duplicate key" in str(insert_error):
                     if attempt < max_retries - 1:
                         logger.debug(f"[DB] Sequence issue - retrying (attempt {attempt + 1}/{max_retries})")
-                        conn.rollback()
+                        await conn.rollback()
                         
                         # Fix the sequence
                         try:
-                            cur.execute("""
+                            await cur.execute("""
                                 SELECT setval(
                                     pg_get_serial_sequence('actuator_event', 'id'),
                                     COALESCE((SELECT MAX(id) FROM actuator_event), 0) + 1,
                                     false
                                 );
                             """)
-                            conn.commit()
+                            await conn.commit()
                         except Exception as seq_error:
                             logger.error(f"[DB] Sequence reset failed: {seq_error}")
-                            conn.rollback()
+                            await conn.rollback()
                         
                         # Retry the insert
                         continue
@@ -512,13 +623,13 @@ async def insert_event(deviceId: str, data: ActuatorEvent, background_tasks: Bac
                     raise insert_error
 
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         logger.error(f"[DB] Insert failed for {deviceId}: {type(e).__name__}: {str(e)}")
         raise HTTPException(500, f"Database error: {str(e)}")
 
     finally:
-        cur.close()
-        release_connection(conn)
+        await cur.close()
+        await release_async_connection(conn)
 
 
 # BACKGROUND TASK: Try ML prediction and update event if successful
@@ -541,11 +652,9 @@ async def try_ml_prediction_and_update(deviceId: str, ppm: float, ph: float,
         }
 
         # Increased timeout since this is non-blocking now
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            r = await client.post(ML_PREDICT_URL, json=ml_payload)
+        ml = await _ml_predict(deviceId, ml_payload, timeout=5.0)
 
-        if r.status_code == 200:
-            ml = r.json()
+        if ml:
             ml_phUp = ml.get("phUp", 0)
             ml_phDown = ml.get("phDown", 0)
             ml_nutrientAdd = ml.get("nutrientAdd", 0)
@@ -553,11 +662,11 @@ async def try_ml_prediction_and_update(deviceId: str, ppm: float, ph: float,
             ml_valueS = float(max(ml_phUp, ml_phDown, ml_nutrientAdd, ml_refill))
 
             # Update the most recent actuator event with ML results
-            conn = get_connection()
+            conn = await get_async_connection()
             cur = conn.cursor()
             
             try:
-                cur.execute("""
+                await cur.execute("""
                     UPDATE actuator_event
                     SET "phUp" = %s, "phDown" = %s, "nutrientAdd" = %s, 
                         "refill" = %s, "valueS" = %s
@@ -567,35 +676,35 @@ async def try_ml_prediction_and_update(deviceId: str, ppm: float, ph: float,
                     int(ml_refill), float(ml_valueS),
                     deviceId, ingestTime
                 ))
-                conn.commit()
+                await conn.commit()
                 
                 logger.debug(f"[ML] Background update completed for {deviceId}")
                 
             except Exception as e:
-                conn.rollback()
+                await conn.rollback()
                 logger.error(f"[ML] Background update failed for {deviceId}: {e}")
             finally:
-                cur.close()
-                release_connection(conn)
+                await cur.close()
+                await release_async_connection(conn)
 
-    except (httpx.TimeoutException, httpx.ConnectError):
+    except (asyncio.TimeoutError, httpx.TimeoutException, httpx.ConnectError):
         logger.debug(f"[ML] Background connection timeout for {deviceId}")
     except Exception as e:
         logger.error(f"[ML] Background error for {deviceId}: {e}")
 
 # GET LATEST ACTUATOR EVENT
 @router.get("/latest")
-def get_latest_event(deviceId: str):
+async def get_latest_event(deviceId: str):
     deviceId = deviceId.strip()
 
-    if not is_valid_device(deviceId):
+    if not await is_valid_device_async(deviceId):
         raise HTTPException(400, "Invalid deviceId.")
 
-    conn = get_connection()
+    conn = await get_async_connection()
     cur = conn.cursor()
 
     try:
-        cur.execute("""
+        await cur.execute("""
             SELECT id, "deviceId", "ingestTime",
             "phUp", "phDown", "nutrientAdd", "valueS",
             "manual", "auto", "refill"
@@ -605,7 +714,7 @@ def get_latest_event(deviceId: str):
             LIMIT 1;
         """, (deviceId,))
 
-        row = cur.fetchone()
+        row = await cur.fetchone()
         if not row:
             return {"message": "no event"}
 
@@ -626,25 +735,25 @@ def get_latest_event(deviceId: str):
         raise HTTPException(500, str(e))
 
     finally:
-        cur.close()
-        release_connection(conn)
+        await cur.close()
+        await release_async_connection(conn)
 
 
 # GET HISTORY
 @router.get("/history")
-def get_event_history(deviceId: str, limit: int = 50):
+async def get_event_history(deviceId: str, limit: int = 50):
     deviceId = deviceId.strip()
 
-    if not is_valid_device(deviceId):
+    if not await is_valid_device_async(deviceId):
         raise HTTPException(400, "Invalid deviceId.")
 
     limit = max(1, min(limit, 500))
 
-    conn = get_connection()
+    conn = await get_async_connection()
     cur = conn.cursor()
 
     try:
-        cur.execute("""
+        await cur.execute("""
             SELECT id, "deviceId", "ingestTime",
             "phUp", "phDown", "nutrientAdd", "valueS",
             "manual", "auto", "refill"
@@ -654,7 +763,7 @@ def get_event_history(deviceId: str, limit: int = 50):
             LIMIT %s;
         """, (deviceId, limit))
 
-        rows = cur.fetchall()
+        rows = await cur.fetchall()
         return [
             {
                 "id": r[0], "deviceId": r[1], "ingestTime": r[2],
@@ -668,40 +777,71 @@ def get_event_history(deviceId: str, limit: int = 50):
         raise HTTPException(500, str(e))
 
     finally:
-        cur.close()
-        release_connection(conn)
+        await cur.close()
+        await release_async_connection(conn)
 
 
 # GET ALL
+ACTUATOR_ALL_MAX_LIMIT = 10000
+_EVENT_COLUMNS = ["id", "deviceId", "ingestTime", "phUp", "phDown", "nutrientAdd",
+                  "valueS", "manual", "auto", "refill"]
+
+
 @router.get("/all")
-def get_all_events(deviceId: str):
+def get_all_events(
+    deviceId: str,
+    limit: Optional[int] = None,
+    before: Optional[str] = None,
+    format: str = "json",
+):
+    """
+    All events of a device, newest first.
+    - without `limit`: every event (json array, ndjson or csv), streamed from a
+      server-side cursor
+    - json with `limit`: one page of up to `limit` events (max ACTUATOR_ALL_MAX_LIMIT);
+      when more remain, the X-Next-Cursor header holds the value to pass as `before`
+    """
     deviceId = deviceId.strip()
+    format = check_format(format)
 
     if not is_valid_device(deviceId):
         raise HTTPException(400, "Invalid deviceId.")
 
+    cursor_time, cursor_id = 2 ** 62, 0
+    if before:
+        ts, _, event_id = before.partition(":")
+        try:
+            cursor_time, cursor_id = int(ts), int(event_id or 0)
+        except ValueError:
+            raise HTTPException(400, "Invalid cursor")
+
+    query = """
+        SELECT id, "deviceId", "ingestTime",
+        "phUp", "phDown", "nutrientAdd", "valueS",
+        "manual", "auto", "refill"
+        FROM actuator_event
+        WHERE "deviceId" = %s AND ("ingestTime", id) < (%s, %s)
+        ORDER BY "ingestTime" DESC, id DESC
+    """
+
+    if format != "json" or limit is None:
+        return stream_query(query + ";", (deviceId, cursor_time, cursor_id),
+                            _EVENT_COLUMNS, format, f"actuator-{deviceId}")
+
+    limit = max(1, min(limit, ACTUATOR_ALL_MAX_LIMIT))
+
     conn = get_connection()
     cur = conn.cursor()
 
     try:
-        cur.execute("""
-            SELECT id, "deviceId", "ingestTime",
-            "phUp", "phDown", "nutrientAdd", "valueS",
-            "manual", "auto", "refill"
-            FROM actuator_event
-            WHERE "deviceId" = %s
-            ORDER BY "ingestTime" DESC;
-        """, (deviceId,))
+        cur.execute(query + " LIMIT %s;", (deviceId, cursor_time, cursor_id, limit))
 
         rows = cur.fetchall()
-        return [
-            {
-                "id": r[0], "deviceId": r[1], "ingestTime": r[2],
-                "phUp": r[3], "phDown": r[4], "nutrientAdd": r[5],
-                "valueS": r[6], "manual": r[7], "auto": r[8], "refill": r[9]
-            }
-            for r in rows
-        ]
+        headers = {}
+        if len(rows) == limit:
+            headers["X-Next-Cursor"] = f"{rows[-1][2]}:{rows[-1][0]}"
+
+        return FastJSONResponse([dict(zip(_EVENT_COLUMNS, r)) for r in rows], headers=headers)
 
     except Exception as e:
         raise HTTPException(500, str(e))
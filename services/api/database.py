@@ -1,6 +1,13 @@
 import psycopg2
 import psycopg2.pool
+import psycopg
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
 import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import logging
 
@@ -18,15 +25,182 @@ DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "")
 DB_PORT = int(os.getenv("DB_PORT", "5432"))
 
+# Async pool (psycopg 3) used by the async request handlers
+DB_ASYNC_POOL_MIN = int(os.getenv("DB_ASYNC_POOL_MIN", "2"))
+DB_ASYNC_POOL_MAX = int(os.getenv("DB_ASYNC_POOL_MAX", "20"))
+
+# Sync pool: callers block up to DB_POOL_TIMEOUT seconds for a free connection
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "5"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "50"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# Connections idle longer than this are pinged (SELECT 1) before being handed out
+DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "30"))
+# Checkouts held longer than this are reported as suspected leaks
+DB_POOL_LEAK_SECONDS = float(os.getenv("DB_POOL_LEAK_SECONDS", "30"))
+
 _pool = None
+_async_pool = None
+
+
+class PoolTimeoutError(Exception):
+    """No connection became free within DB_POOL_TIMEOUT."""
+
+
+class InstrumentedPool:
+    """
+    Thread-safe wrapper around ThreadedConnectionPool.
+
+    - getconn() blocks (up to timeout) instead of failing when all connections are out
+    - connections idle for a while are health-checked before checkout; dead ones are replaced
+    - every checkout records who took it and when, so long-held connections show up as leaks
+    - stats() reports in-use/idle counts, wait times and checkout durations
+    """
+
+    def __init__(self, minconn, maxconn, timeout, **kwargs):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._checked_out = {}   # id(conn) -> (checkoutAt, origin)
+        self._returned_at = {}   # id(conn) -> monotonic time of last putconn
+        self._waiting = 0
+        self._counters = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "healthCheckFailures": 0,
+            "leakWarnings": 0,
+            "waitSecondsTotal": 0.0,
+            "waitSecondsMax": 0.0,
+            "heldSecondsTotal": 0.0,
+            "heldSecondsMax": 0.0,
+        }
+
+    @staticmethod
+    def _origin():
+        # Nearest frame outside this module, e.g. "main.py:412 insert_telemetry"
+        for frame in reversed(traceback.extract_stack(limit=8)[:-2]):
+            if frame.filename != __file__:
+                return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}"
+        return "unknown"
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        idle_since = self._returned_at.get(id(conn))
+        if idle_since is None or time.monotonic() - idle_since < DB_POOL_CHECK_IDLE:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        start = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        waited = time.monotonic() - start
+
+        if not acquired:
+            with self._lock:
+                self._counters["timeouts"] += 1
+                in_use = len(self._checked_out)
+            logger.warning(f"[DB] Pool exhausted: no connection after {waited:.2f}s ({in_use}/{self.maxconn} in use)")
+            raise PoolTimeoutError(f"no database connection available within {self.timeout}s")
+
+        try:
+            conn = self._pool.getconn()
+            while not self._healthy(conn):
+                with self._lock:
+                    self._counters["healthCheckFailures"] += 1
+                logger.warning("[DB] Discarding broken pooled connection")
+                self._returned_at.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._checked_out[id(conn)] = (time.monotonic(), self._origin())
+            self._counters["checkouts"] += 1
+            self._counters["waitSecondsTotal"] += waited
+            self._counters["waitSecondsMax"] = max(self._counters["waitSecondsMax"], waited)
+        return conn
+
+    def putconn(self, conn):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._checked_out.pop(id(conn), None)
+        if entry is None:
+            raise psycopg2.pool.PoolError("connection was not checked out from this pool")
+
+        held = now - entry[0]
+        with self._lock:
+            self._counters["heldSecondsTotal"] += held
+            self._counters["heldSecondsMax"] = max(self._counters["heldSecondsMax"], held)
+            if held > DB_POOL_LEAK_SECONDS:
+                self._counters["leakWarnings"] += 1
+        if held > DB_POOL_LEAK_SECONDS:
+            logger.warning(f"[DB] Connection held {held:.1f}s by {entry[1]}")
+
+        try:
+            if conn.closed:
+                self._returned_at.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+            else:
+                self._returned_at[id(conn)] = now
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            c = dict(self._counters)
+            in_use = len(self._checked_out)
+            leaks = [
+                {"origin": origin, "heldSeconds": round(now - since, 1)}
+                for since, origin in self._checked_out.values()
+                if now - since > DB_POOL_LEAK_SECONDS
+            ]
+            waiting = self._waiting
+        checkouts = c["checkouts"] or 1
+        return {
+            "max": self.maxconn,
+            "inUse": in_use,
+            "available": self.maxconn - in_use,
+            "waiting": waiting,
+            "checkouts": c["checkouts"],
+            "timeouts": c["timeouts"],
+            "healthCheckFailures": c["healthCheckFailures"],
+            "leakWarnings": c["leakWarnings"],
+            "waitMsAvg": round(c["waitSecondsTotal"] / checkouts * 1000, 2),
+            "waitMsMax": round(c["waitSecondsMax"] * 1000, 2),
+            "heldMsAvg": round(c["heldSecondsTotal"] / checkouts * 1000, 2),
+            "heldMsMax": round(c["heldSecondsMax"] * 1000, 2),
+            "suspectedLeaks": leaks,
+        }
 
 
 def init_pool():
     global _pool
     if _pool is None:
-        _pool = psycopg2.pool.SimpleConnectionPool(
-            minconn=5,
-            maxconn=50,
+        _pool = InstrumentedPool(
+            minconn=DB_POOL_MIN,
+            maxconn=DB_POOL_MAX,
+            timeout=DB_POOL_TIMEOUT,
             host=DB_HOST,
             database=DB_NAME,
             user=DB_USER,
@@ -34,10 +208,11 @@ def init_pool():
             port=DB_PORT,
         )
         
-        logger.info(f"[DB] Pool → {DB_HOST}:{DB_PORT}/{DB_NAME} (max connections: 50)")
+        logger.info(f"[DB] Pool → {DB_HOST}:{DB_PORT}/{DB_NAME} (max connections: {DB_POOL_MAX}, acquire timeout: {DB_POOL_TIMEOUT}s)")
 
 
 def get_connection():
+    """Check out a connection, waiting up to DB_POOL_TIMEOUT. Raises PoolTimeoutError."""
     if _pool is None:
         init_pool()
     return _pool.getconn()
@@ -51,152 +226,90 @@ def release_connection(conn):
             logger.warning(f"[DB] Warning: Failed to release connection: {e}")
 
 
-def run_migrations():
+@contextmanager
+def connection():
     """
-    Fresh, clean schema:
-      - kits
-      - telemetry (camelCase)
-      - actuator_event (camelCase)
-      - actuator_cooldown (for cooldown tracking)
-      - ml_prediction_log (for ML predictions)
+    with connection() as conn: ...
+    Rolls back on error and always returns the connection to the pool.
+    Callers still commit explicitly.
     """
     conn = get_connection()
-    cur = conn.cursor()
-
-    # KITS TABLE
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS kits (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            "createdAt" TIMESTAMPTZ DEFAULT NOW()
-        );
-    """)
-
-    # TELEMETRY TABLE
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS telemetry (
-            "rowId" TEXT PRIMARY KEY,
-            "deviceId" TEXT NOT NULL,
-            "ingestTime" BIGINT NOT NULL,
-            "payloadJson" JSONB NOT NULL,
-            ppm FLOAT,
-            ph FLOAT,
-            "tempC" FLOAT,
-            humidity FLOAT,
-            "waterTemp" FLOAT,
-            "waterLevel" FLOAT,
-            "payloadHash" TEXT UNIQUE
-        );
-    """)
-
-    # ACTUATOR TABLE
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS actuator_event (
-            id SERIAL PRIMARY KEY,
-            "deviceId" TEXT NOT NULL,
-            "ingestTime" BIGINT NOT NULL,
-            "phUp" INT DEFAULT 0,
-            "phDown" INT DEFAULT 0,
-            "nutrientAdd" INT DEFAULT 0,
-            "valueS" FLOAT DEFAULT 0,
-            "manual" INT DEFAULT 0,
-            "auto" INT DEFAULT 0,
-            "refill" INT DEFAULT 0
-        );
-    """)
-
-    # ACTUATOR COOLDOWN TABLE
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS actuator_cooldown (
-            id SERIAL PRIMARY KEY,
-            "deviceId" TEXT NOT NULL,
-            "actionType" TEXT NOT NULL,
-            "lastTime" BIGINT NOT NULL,
-            "lastValue" FLOAT DEFAULT 0,
-            UNIQUE ("deviceId", "actionType")
-        );
-    """)
-
-    # ML PREDICTION LOG TABLE
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS ml_prediction_log (
-            id SERIAL PRIMARY KEY,
-            "deviceId" TEXT NOT NULL,
-            "predictTime" BIGINT NOT NULL,
-            "payloadJson" JSONB NOT NULL,
-            "predictJson" JSONB NOT NULL
-        );
-    """)
-
-    # DEVICE MODE TABLE (per-user, per-device auto/manual tracking)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS device_mode (
-            id SERIAL PRIMARY KEY,
-            "userId" TEXT NOT NULL,
-            "deviceId" TEXT NOT NULL,
-            "autoMode" BOOLEAN DEFAULT FALSE,
-            "updatedAt" TIMESTAMPTZ DEFAULT NOW(),
-            UNIQUE ("userId", "deviceId"),
-            CHECK (LENGTH("userId") >= 8),
-            CHECK (LENGTH("deviceId") >= 5),
-            CHECK ("userId" != ''),
-            CHECK ("deviceId" != '')
-        );
-    """)
-
-    # USER PREFERENCE TABLE (selected kit per user)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS user_preference (
-            id SERIAL PRIMARY KEY,
-            "userId" TEXT UNIQUE NOT NULL,
-            "selectedKitId" TEXT,
-            "updatedAt" TIMESTAMPTZ DEFAULT NOW()
-        );
-    """)
-
-    # NOTIFICATIONS TABLE (backend-persisted notifications)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS notifications (
-            id SERIAL PRIMARY KEY,
-            "userId" TEXT NOT NULL,
-            "deviceId" TEXT NOT NULL,
-            level TEXT NOT NULL,
-            title TEXT NOT NULL,
-            message TEXT NOT NULL,
-            "isRead" BOOLEAN DEFAULT FALSE,
-            "createdAt" TIMESTAMPTZ DEFAULT NOW()
-        );
-    """)
-    
-    cur.execute("""
-        CREATE INDEX IF NOT EXISTS idx_notif_user ON notifications("userId");
-    """)
-    cur.execute("""
-        CREATE INDEX IF NOT EXISTS idx_notif_time ON notifications("createdAt" DESC);
-    """)
-
-    # USER_KITS JUNCTION TABLE (many-to-many: user <-> kit)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS user_kits (
-            "userId" TEXT NOT NULL,
-            "kitId" TEXT NOT NULL REFERENCES kits(id) ON DELETE CASCADE,
-            "addedAt" TIMESTAMPTZ DEFAULT NOW(),
-            PRIMARY KEY ("userId", "kitId"),
-            CHECK (LENGTH("userId") >= 8),
-            CHECK (LENGTH("kitId") >= 5)
-        );
-    """)
-    
-    # Indexes for user_kits
-    cur.execute("""
-        CREATE INDEX IF NOT EXISTS idx_user_kits_user ON user_kits("userId");
-    """)
-    cur.execute("""
-        CREATE INDEX IF NOT EXISTS idx_user_kits_kit ON user_kits("kitId");
-    """)
-
-    conn.commit()
-    cur.close()
-    release_connection(conn)
-
-    logger.info("[DB] Migrations executed.")
+    try:
+        yield conn
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        release_connection(conn)
+
+
+def pool_stats():
+    """Sync pool metrics plus the async pool's own counters (if started)."""
+    stats = {"sync": _pool.stats() if _pool else None, "async": None}
+    if _async_pool is not None:
+        stats["async"] = _async_pool.get_stats()
+    return stats
+
+
+async def init_async_pool():
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = AsyncConnectionPool(
+            make_conninfo(
+                host=DB_HOST,
+                dbname=DB_NAME,
+                user=DB_USER,
+                password=DB_PASSWORD,
+                port=DB_PORT,
+            ),
+            min_size=DB_ASYNC_POOL_MIN,
+            max_size=DB_ASYNC_POOL_MAX,
+            timeout=DB_POOL_TIMEOUT,
+            open=False,
+        )
+        await _async_pool.open()
+
+        logger.info(f"[DB] Async pool → {DB_HOST}:{DB_PORT}/{DB_NAME} (max connections: {DB_ASYNC_POOL_MAX})")
+
+
+async def close_async_pool():
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+
+
+async def get_async_connection():
+    """Async counterpart of get_connection(); waits on the pool instead of blocking a thread."""
+    if _async_pool is None:
+        await init_async_pool()
+    return await _async_pool.getconn()
+
+
+async def release_async_connection(conn):
+    if _async_pool and conn:
+        try:
+            # Read-only handlers never commit; end their transaction before reuse
+            if conn.info.transaction_status in (
+                psycopg.pq.TransactionStatus.INTRANS,
+                psycopg.pq.TransactionStatus.INERROR,
+            ):
+                await conn.rollback()
+        except Exception:
+            pass  # broken connections are discarded by putconn
+        try:
+            await _async_pool.putconn(conn)
+        except Exception as e:
+            logger.warning(f"[DB] Warning: Failed to release async connection: {e}")
+
+
+def run_migrations():
+    """
+    Apply pending schema migrations (see services/api/migrations.py).
+    Cheap when the database is already current: one query, no DDL.
+    """
+    from services.api.migrations import apply_migrations
+    return apply_migrations()
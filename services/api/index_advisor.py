@@ -0,0 +1,276 @@
+"""
+Index advisor: EXPLAIN (ANALYZE, BUFFERS) over the query behind each hot endpoint.
+
+Seeds a synthetic dataset (kits, user_kits, telemetry, actuator events, device
+modes, notifications, prediction log), runs ANALYZE, explains every query and
+flags sequential scans. Everything happens in one transaction that is rolled
+back, so it is safe against a dev database (seeded rows never become visible;
+note that ANALYZE statistics are rolled back too).
+
+    python -m services.api.index_advisor                # seed + explain
+    python -m services.api.index_advisor --no-seed      # explain against existing data
+    python -m services.api.index_advisor --devices 500 --readings 2000 --verbose
+
+Exits with status 1 when a sequential scan is found on a table larger than
+--min-rows, so it can gate CI after a migration change.
+"""
+import argparse
+import json
+import sys
+import time
+from services.api.database import get_connection, release_connection, init_pool
+
+# format() patterns for seeded ids (SQL format() and Python % share the %s syntax)
+SEED_USER = "advisor-user-%s"
+SEED_KIT = "advisor-kit-%s"
+
+
+def seed(cur, devices, readings, events, users, notifications):
+    """Insert synthetic rows shaped like production traffic (in the caller's transaction)."""
+    now_ms = int(time.time() * 1000)
+
+    cur.execute("""
+        INSERT INTO kits (id, name)
+        SELECT format(%s, g), 'Advisor kit ' || g FROM generate_series(1, %s) g
+        ON CONFLICT (id) DO NOTHING;
+    """, (SEED_KIT, devices))
+
+    # Each user owns devices / users kits
+    cur.execute("""
+        INSERT INTO user_kits ("userId", "kitId")
+        SELECT format(%s, 1 + (g %% %s)), format(%s, g) FROM generate_series(1, %s) g
+        ON CONFLICT DO NOTHING;
+    """, (SEED_USER, users, SEED_KIT, devices))
+
+    # One reading per device per minute, ending now
+    cur.execute("""
+        INSERT INTO telemetry (
+            "rowId", "deviceId", "ingestTime",
+            ppm, ph, "tempC", humidity, "waterTemp", "waterLevel", "payloadHash"
+        )
+        SELECT md5(d || ':' || r), format(%s, d), %s - r * 60000,
+               800 + random() * 400, 5.5 + random(), 20 + random() * 8,
+               50 + random() * 30, 18 + random() * 6, random() * 100, md5(d || ':' || r)
+        FROM generate_series(1, %s) d, generate_series(0, %s - 1) r;
+    """, (SEED_KIT, now_ms, devices, readings))
+
+    cur.execute("""
+        INSERT INTO telemetry_latest ("deviceId", "ingestTime", ppm, ph, "tempC", humidity, "waterTemp", "waterLevel")
+        SELECT format(%s, d), %s, 1000, 6, 24, 60, 21, 50 FROM generate_series(1, %s) d
+        ON CONFLICT ("deviceId") DO NOTHING;
+    """, (SEED_KIT, now_ms, devices))
+
+    cur.execute("""
+        INSERT INTO actuator_event ("deviceId", "ingestTime", "phUp", "phDown", "nutrientAdd", "valueS", "auto")
+        SELECT format(%s, d), %s - e * 300000, (e %% 3 = 0)::int, (e %% 3 = 1)::int, (e %% 3 = 2)::int, 2.5, 1
+        FROM generate_series(1, %s) d, generate_series(0, %s - 1) e;
+    """, (SEED_KIT, now_ms, devices, events))
+
+    # Auto mode is on for roughly one device in ten
+    cur.execute("""
+        INSERT INTO device_mode ("userId", "deviceId", "autoMode")
+        SELECT format(%s, 1 + (g %% %s)), format(%s, g), g %% 10 = 0 FROM generate_series(1, %s) g
+        ON CONFLICT ("userId", "deviceId") DO NOTHING;
+    """, (SEED_USER, users, SEED_KIT, devices))
+
+    cur.execute("""
+        INSERT INTO notifications ("userId", "deviceId", level, title, message, "createdAt")
+        SELECT format(%s, u), format(%s, 1 + (n %% %s)),
+               (ARRAY['info', 'warning', 'urgent'])[1 + n %% 3], 'Advisor', 'Seeded notification',
+               NOW() - n * INTERVAL '1 hour'
+        FROM generate_series(1, %s) u, generate_series(0, %s - 1) n;
+    """, (SEED_USER, SEED_KIT, devices, users, notifications))
+
+    cur.execute("""
+        INSERT INTO ml_prediction_log ("deviceId", "predictTime", "payloadJson", "predictJson")
+        SELECT format(%s, d), %s - e * 300000, '{}'::jsonb, '{}'::jsonb
+        FROM generate_series(1, %s) d, generate_series(0, %s - 1) e;
+    """, (SEED_KIT, now_ms, devices, events))
+
+    for table in ("kits", "user_kits", "telemetry", "telemetry_latest", "actuator_event",
+                  "device_mode", "notifications", "ml_prediction_log"):
+        cur.execute(f"ANALYZE {table};")
+
+
+def endpoint_queries(device_id, user_id):
+    """(endpoint, sql, params) for each hot read path, mirroring the route handlers."""
+    now_ms = int(time.time() * 1000)
+    day_ago = now_ms - 24 * 60 * 60 * 1000
+
+    return [
+        ("GET /telemetry/history", """
+            SELECT "rowId", "ingestTime", ppm, ph, "tempC", humidity, "waterTemp", "waterLevel"
+            FROM telemetry
+            WHERE "deviceId" = %s AND "ingestTime" >= %s
+            ORDER BY "ingestTime" DESC, "rowId" DESC
+            LIMIT 1000;
+        """, (device_id, day_ago)),
+        ("GET /telemetry/latest", """
+            SELECT "ingestTime", ppm, ph, "tempC", humidity, "waterTemp", "waterLevel"
+            FROM telemetry_latest WHERE "deviceId" = %s;
+        """, (device_id,)),
+        ("GET /kits", """
+            SELECT k.id, k.name, k."createdAt"
+            FROM kits k
+            JOIN user_kits uk ON k.id = uk."kitId"
+            WHERE uk."userId" = %s
+            ORDER BY uk."addedAt" DESC;
+        """, (user_id,)),
+        ("GET /kits/with-latest", """
+            SELECT k.id, k.name, k."createdAt",
+                   tl."ingestTime", tl.ppm, tl.ph, tl."tempC",
+                   tl.humidity, tl."waterTemp", tl."waterLevel"
+            FROM kits k
+            JOIN user_kits uk ON k.id = uk."kitId"
+            LEFT JOIN telemetry_latest tl ON tl."deviceId" = k.id
+            WHERE uk."userId" = %s
+            ORDER BY uk."addedAt" DESC;
+        """, (user_id,)),
+        ("GET /actuator/latest", """
+            SELECT id, "deviceId", "ingestTime", "phUp", "phDown", "nutrientAdd", "valueS",
+                   "manual", "auto", "refill"
+            FROM actuator_event
+            WHERE "deviceId" = %s
+            ORDER BY "ingestTime" DESC
+            LIMIT 1;
+        """, (device_id,)),
+        ("GET /actuator/history", """
+            SELECT id, "deviceId", "ingestTime", "phUp", "phDown", "nutrientAdd", "valueS",
+                   "manual", "auto", "refill"
+            FROM actuator_event
+            WHERE "deviceId" = %s
+            ORDER BY "ingestTime" DESC
+            LIMIT 50;
+        """, (device_id,)),
+        ("GET /actuator/all", """
+            SELECT id, "deviceId", "ingestTime", "phUp", "phDown", "nutrientAdd", "valueS",
+                   "manual", "auto", "refill"
+            FROM actuator_event
+            WHERE "deviceId" = %s AND ("ingestTime", id) < (%s, %s)
+            ORDER BY "ingestTime" DESC, id DESC
+            LIMIT 1000;
+        """, (device_id, 2 ** 62, 2 ** 31 - 1)),
+        ("actuator cooldown lookup", """
+            SELECT "actionType", "lastTime" FROM actuator_cooldown WHERE "deviceId" = %s;
+        """, (device_id,)),
+        ("GET /device/auto-enabled", """
+            SELECT "deviceId", "userId" FROM device_mode WHERE "autoMode" = TRUE;
+        """, ()),
+        ("GET /device/mode", """
+            SELECT "autoMode" FROM device_mode WHERE "userId" = %s AND "deviceId" = %s;
+        """, (user_id, device_id)),
+        ("GET /notifications", """
+            SELECT id, "deviceId", level, title, message, "isRead", "createdAt"
+            FROM notifications
+            WHERE "userId" = %s
+            AND "createdAt" >= NOW() - INTERVAL '%s days'
+            ORDER BY "createdAt" DESC LIMIT %s;
+        """, (user_id, 7, 100)),
+        ("prediction log by device", """
+            SELECT "predictTime", "predictJson" FROM ml_prediction_log
+            WHERE "deviceId" = %s
+            ORDER BY "predictTime" DESC
+            LIMIT 50;
+        """, (device_id,)),
+    ]
+
+
+def _walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+
+def _table_rows(cur, table):
+    """Estimated rows of a table, summed over its partitions."""
+    cur.execute("""
+        SELECT COALESCE(SUM(c.reltuples), 0)::bigint FROM pg_class c
+        WHERE c.oid = to_regclass(%s)
+           OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s));
+    """, (table, table))
+    return max(cur.fetchone()[0], 0)
+
+
+def explain(cur, sql, params):
+    """Return (plan dict, [(relation, rows removed by filter)] for Seq Scan nodes)."""
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]
+    seq_scans = [
+        (node.get("Relation Name"), node.get("Rows Removed by Filter", 0))
+        for node in _walk(root["Plan"])
+        if node["Node Type"] == "Seq Scan"
+    ]
+    return root, seq_scans
+
+
+def _buffers(node):
+    # Buffer counts of the top node already include its children
+    return node.get("Shared Hit Blocks", 0) + node.get("Shared Read Blocks", 0)
+
+
+def run(args):
+    conn = get_connection()
+    cur = conn.cursor()
+    flagged = 0
+
+    try:
+        if args.seed:
+            started = time.time()
+            seed(cur, args.devices, args.readings, args.events, args.users, args.notifications)
+            print(f"Seeded in {time.time() - started:.1f}s "
+                  f"({args.devices} devices x {args.readings} readings, {args.users} users)")
+            device_id, user_id = SEED_KIT % 1, SEED_USER % 2
+        else:
+            device_id, user_id = args.device, args.user
+
+        print(f"Explaining with deviceId={device_id} userId={user_id}\n")
+        for endpoint, sql, params in endpoint_queries(device_id, user_id):
+            root, seq_scans = explain(cur, sql, params)
+            plan = root["Plan"]
+            flags = []
+            for relation, removed in seq_scans:
+                rows = _table_rows(cur, relation) if relation else 0
+                if rows >= args.min_rows:
+                    flags.append(f"Seq Scan on {relation} (~{rows} rows, {removed} removed by filter)")
+
+            status = "SEQ SCAN" if flags else "ok"
+            print(f"[{status:>8}] {endpoint:<28} {root['Execution Time']:8.2f} ms  "
+                  f"buffers={_buffers(plan):<6} {plan['Node Type']}")
+            for flag in flags:
+                print(f"{'':12}- {flag}")
+            if args.verbose:
+                print(json.dumps(plan, indent=2))
+            flagged += bool(flags)
+
+        print(f"\n{flagged} quer{'y uses' if flagged == 1 else 'ies use'} a sequential scan")
+        return flagged
+
+    finally:
+        conn.rollback()  # seeded rows are never committed
+        cur.close()
+        release_connection(conn)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EXPLAIN the hot endpoint queries and flag sequential scans.")
+    parser.add_argument("--no-seed", dest="seed", action="store_false", help="use existing data instead of seeding")
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--readings", type=int, default=1440, help="telemetry rows per device (one per minute)")
+    parser.add_argument("--events", type=int, default=500, help="actuator events / predictions per device")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--notifications", type=int, default=200, help="notifications per user")
+    parser.add_argument("--device", default="", help="deviceId to query with --no-seed")
+    parser.add_argument("--user", default="", help="userId to query with --no-seed")
+    parser.add_argument("--min-rows", type=int, default=1000, help="ignore seq scans on tables smaller than this")
+    parser.add_argument("--verbose", action="store_true", help="print the full JSON plans")
+    args = parser.parse_args(argv)
+
+    init_pool()
+    return 1 if run(args) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+In-process registry of known kit IDs.
+
+Telemetry ingest and the actuator routes validate the device on every request;
+this keeps those checks in memory. Known kits are cached for KIT_CACHE_TTL
+seconds, unknown IDs for KIT_NEGATIVE_TTL (short, so a kit registered through
+another API worker is picked up quickly). Entries are evicted LRU beyond
+KIT_CACHE_SIZE. add_kit/delete_kit update the registry explicitly.
+"""
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from services.api.database import (
+    get_connection, release_connection,
+    get_async_connection, release_async_connection,
+)
+
+KIT_CACHE_TTL = float(os.getenv("KIT_CACHE_TTL", "300"))
+KIT_NEGATIVE_TTL = float(os.getenv("KIT_NEGATIVE_TTL", "5"))
+KIT_CACHE_SIZE = int(os.getenv("KIT_CACHE_SIZE", "100000"))
+
+_entries = OrderedDict()  # deviceId -> (exists, expiresAt)
+_lock = Lock()
+
+
+def _get(device_id, now):
+    with _lock:
+        entry = _entries.get(device_id)
+        if entry is None or entry[1] <= now:
+            return None
+        _entries.move_to_end(device_id)
+        return entry[0]
+
+
+def _put(device_id, exists, now):
+    ttl = KIT_CACHE_TTL if exists else KIT_NEGATIVE_TTL
+    with _lock:
+        _entries[device_id] = (exists, now + ttl)
+        _entries.move_to_end(device_id)
+        while len(_entries) > KIT_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+_LOOKUP_SQL = "SELECT id FROM kits WHERE id = ANY(%s);"
+
+
+def _lookup(cur, device_ids):
+    cur.execute(_LOOKUP_SQL, (list(device_ids),))
+    return {r[0] for r in cur.fetchall()}
+
+
+async def _lookup_async(cur, device_ids):
+    await cur.execute(_LOOKUP_SQL, (list(device_ids),))
+    return {r[0] for r in await cur.fetchall()}
+
+
+def _split_cached(device_ids, now):
+    """Return (valid ids known from cache, ids that need a DB lookup)."""
+    valid = set()
+    missing = []
+    for device_id in set(device_ids):
+        cached = _get(device_id, now)
+        if cached is None:
+            missing.append(device_id)
+        elif cached:
+            valid.add(device_id)
+    return valid, missing
+
+
+def _record_lookup(missing, found, now):
+    for device_id in missing:
+        _put(device_id, device_id in found, now)
+
+
+def filter_valid(device_ids, cur=None):
+    """Return the subset of device_ids that are registered kits (one query for all cache misses)."""
+    now = time.monotonic()
+    valid, missing = _split_cached(device_ids, now)
+
+    if missing:
+        if cur is not None:
+            found = _lookup(cur, missing)
+        else:
+            conn = get_connection()
+            own_cur = conn.cursor()
+            try:
+                found = _lookup(own_cur, missing)
+            finally:
+                own_cur.close()
+                release_connection(conn)
+
+        _record_lookup(missing, found, now)
+        valid |= found
+
+    return valid
+
+
+async def filter_valid_async(device_ids, cur=None):
+    """filter_valid for async handlers; cache misses go through the async pool."""
+    now = time.monotonic()
+    valid, missing = _split_cached(device_ids, now)
+
+    if missing:
+        if cur is not None:
+            found = await _lookup_async(cur, missing)
+        else:
+            conn = await get_async_connection()
+            own_cur = conn.cursor()
+            try:
+                found = await _lookup_async(own_cur, missing)
+            finally:
+                await own_cur.close()
+                await release_async_connection(conn)
+
+        _record_lookup(missing, found, now)
+        valid |= found
+
+    return valid
+
+
+def is_valid_device(device_id: str, cur=None):
+    return device_id in filter_valid([device_id], cur)
+
+
+async def is_valid_device_async(device_id: str, cur=None):
+    return device_id in await filter_valid_async([device_id], cur)
+
+
+def mark_valid(device_id: str):
+    """Record a kit that was just registered (clears any negative entry)."""
+    _put(device_id, True, time.monotonic())
+
+
+def invalidate(device_id: str):
+    with _lock:
+        _entries.pop(device_id, None)
@@ -1,21 +1,36 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
+from fastapi.responses import JSONResponse
+from psycopg_pool import PoolTimeout
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
 from pydantic import BaseModel
-from services.api.database import get_connection, release_connection, init_pool, run_migrations
+from psycopg2.extras import execute_values
+from services.api.database import (
+    get_connection, release_connection, init_pool, run_migrations,
+    get_async_connection, release_async_connection, init_async_pool, close_async_pool,
+    PoolTimeoutError, pool_stats,
+)
 from services.api.ml_service import ml_router
+from services.api.prediction_logger import prediction_logger
+from services.ml import predictor
+from services.api.telemetry_store import (
+    SENSOR_FIELDS, fetch_latest_async, upsert_latest_async, upsert_latest_many, remember_latest, forget_latest,
+    payload_json,
+)
 import uuid
 import hashlib
 import time
 import json
-import threading
+import asyncio
 import logging
 import os
 from datetime import datetime
 from services.api import actuator
-
-# Environment configuration
-API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
+from services.api import kit_registry
+from services.api import telemetry_maintenance
+from services.api.responses import FastJSONResponse, check_format, stream_query
+from services.api.kit_registry import is_valid_device_async
 
 # Custom formatter to show level only for ERROR
 class CustomFormatter(logging.Formatter):
@@ -52,7 +67,7 @@ logging.getLogger("uvicorn.access").setLevel(logging.WARNING)  # Hide 200 OK log
 logging.getLogger("httpx").setLevel(logging.WARNING)  # Hide HTTP request logs
 logging.getLogger("httpcore").setLevel(logging.WARNING)  # Hide httpcore logs
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 # CORS middleware for ngrok and mobile app compatibility
 # Configurable origins via environment variable (comma-separated)
@@ -77,76 +92,156 @@ def health_check():
     """Health check endpoint for testing connectivity."""
     return {"status": "ok", "message": "Server is running"}
 
+
+# Pool utilisation above this fraction reports the database as degraded
+DB_POOL_PRESSURE = float(os.getenv("DB_POOL_PRESSURE", "0.8"))
+
+
+@app.get("/health/db")
+def health_db():
+    """Connection pool pressure: in-use, waiters, wait/hold times and suspected leaks."""
+    stats = pool_stats()
+    status = "ok"
+    sync = stats["sync"]
+    if sync and (
+        sync["waiting"] > 0
+        or sync["inUse"] >= sync["max"] * DB_POOL_PRESSURE
+        or sync["suspectedLeaks"]
+    ):
+        status = "degraded"
+    if stats["async"] and stats["async"].get("requests_waiting", 0) > 0:
+        status = "degraded"
+    return {"status": status, **stats}
+
+
+@app.exception_handler(PoolTimeoutError)
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: Exception):
+    """Pool exhaustion is back-pressure, not a server bug: answer 503 so clients retry."""
+    logger.warning(f"[DB] {request.url.path} → 503 pool timeout: {exc}")
+    return JSONResponse(status_code=503, content={"detail": "Database busy, retry shortly"}, headers={"Retry-After": "1"})
+
 # Auto mode scheduler config
-AUTO_MODE_INTERVAL = 30  # seconds
-_auto_mode_running = True
+AUTO_MODE_INTERVAL = int(os.getenv("AUTO_MODE_INTERVAL", "30"))  # seconds
+AUTO_MODE_CONCURRENCY = int(os.getenv("AUTO_MODE_CONCURRENCY", "16"))  # devices in flight per cycle
+AUTO_MODE_DEVICE_TIMEOUT = float(os.getenv("AUTO_MODE_DEVICE_TIMEOUT", "10"))  # seconds per device
+_auto_mode_task = None
+_maintenance_task = None
+
+_auto_mode_stats = {
+    "cycles": 0,
+    "overruns": 0,
+    "lastCycleSeconds": 0.0,
+    "maxCycleSeconds": 0.0,
+    "lastDeviceCount": 0,
+    "lastFailures": 0,
+}
+
+
+async def _fetch_auto_devices():
+    """Return (deviceId, userId) rows with auto mode enabled."""
+    conn = await get_async_connection()
+    cur = conn.cursor()
 
+    try:
+        await cur.execute("""
+            SELECT "deviceId", "userId" FROM device_mode
+            WHERE "autoMode" = TRUE;
+        """)
+        return await cur.fetchall()
+    finally:
+        await cur.close()
+        await release_async_connection(conn)
+
+
+async def _auto_mode_scheduler():
+    """
+    Background task that triggers auto mode for enabled devices every AUTO_MODE_INTERVAL.
+    Devices in a cycle are processed concurrently, bounded by AUTO_MODE_CONCURRENCY.
+    Runs on the event loop: every DB call on this path goes through the async pool and
+    local ML inference runs in the actuator's executor, so nothing here may use the
+    psycopg2 pool directly (wrap such calls in asyncio.to_thread).
+    """
+    logger.info(f"[AUTO MODE] Scheduler started (interval: {AUTO_MODE_INTERVAL}s, concurrency: {AUTO_MODE_CONCURRENCY})")
+    semaphore = asyncio.Semaphore(AUTO_MODE_CONCURRENCY)
+
+    async def run_one(device_id, user_id):
+        async with semaphore:
+            return await _trigger_auto_actuator(device_id, user_id)
+
+    try:
+        while True:
+            cycle_start = time.monotonic()
+            devices = []
+            failures = 0
 
-def _auto_mode_scheduler():
-    """Background thread that triggers auto mode for enabled devices every 30s."""
-    logger.info(f"[AUTO MODE] Scheduler started (interval: {AUTO_MODE_INTERVAL}s)")
-    
-    while _auto_mode_running:
-        cycle_start = time.time()
-        
-        try:
-            # Query devices with auto mode enabled
-            conn = get_connection()
-            cur = conn.cursor()
-            
             try:
-                cur.execute("""
-                    SELECT "deviceId", "userId" FROM device_mode
-                    WHERE "autoMode" = TRUE;
-                """)
-                devices = cur.fetchall()
-            finally:
-                cur.close()
-                release_connection(conn)
-            
+                devices = await _fetch_auto_devices()
+
+                if devices:
+                    results = await asyncio.gather(*(run_one(d, u) for d, u in devices))
+                    failures = results.count(False)
+
+            except Exception as e:
+                logger.error(f"[AUTO MODE] Error in scheduler: {e}", exc_info=True)
+
+            elapsed = time.monotonic() - cycle_start
+            _auto_mode_stats["cycles"] += 1
+            _auto_mode_stats["lastCycleSeconds"] = round(elapsed, 3)
+            _auto_mode_stats["maxCycleSeconds"] = round(max(_auto_mode_stats["maxCycleSeconds"], elapsed), 3)
+            _auto_mode_stats["lastDeviceCount"] = len(devices)
+            _auto_mode_stats["lastFailures"] = failures
+
             if devices:
-                for device_id, user_id in devices:
-                    _trigger_auto_actuator(device_id, user_id)
-                
+                logger.info(f"[AUTO MODE] Cycle done: {len(devices)} devices in {elapsed:.2f}s (failures: {failures})")
                 # Add blank line after each cycle for visual separation
-                logger.info("")  # Blank line between 30-second cycles
-                    
-        except Exception as e:
-            logger.error(f"[AUTO MODE] Error in scheduler: {e}", exc_info=True)
-        
-        # Calculate remaining time to maintain exact interval
-        elapsed = time.time() - cycle_start
-        sleep_time = max(0, AUTO_MODE_INTERVAL - elapsed)
-        
-        # Sleep in small increments for graceful shutdown
-        for _ in range(int(sleep_time * 10)):
-            if not _auto_mode_running:
-                break
-            time.sleep(0.1)
-    
-    logger.info("[AUTO MODE] Scheduler stopped")
+                logger.info("")  # Blank line between cycles
 
+            if elapsed > AUTO_MODE_INTERVAL:
+                _auto_mode_stats["overruns"] += 1
+                logger.warning(f"[AUTO MODE] Cycle overran interval: {elapsed:.2f}s > {AUTO_MODE_INTERVAL}s")
 
-def _trigger_auto_actuator(device_id: str, user_id: str):
-    """Trigger auto mode for a device and create notification."""
-    import requests
-    
+            # Sleep the remaining time to maintain exact interval
+            await asyncio.sleep(max(0, AUTO_MODE_INTERVAL - elapsed))
+
+    except asyncio.CancelledError:
+        logger.info("[AUTO MODE] Scheduler stopped")
+        raise
+
+
+async def _create_auto_notification(user_id: str, device_id: str, msg: str):
+    conn = await get_async_connection()
+    cur = conn.cursor()
     try:
-        # Call actuator endpoint via HTTP
-        payload = {"phUp": 0, "phDown": 0, "nutrientAdd": 0, "valueS": 0, "manual": 0, "auto": 1, "refill": 0}
-        r = requests.post(
-            f"{API_BASE_URL}/actuator/event?deviceId={device_id}&userId={user_id}",
-            json=payload,
-            timeout=10
-        )
-        
-        if r.status_code == 200:
-            result = r.json()
-            data = result.get("data", {})
-        else:
-            logger.warning(f"[AUTO MODE] ✗ {device_id} → Status {r.status_code}: {r.text}")
-            return
-        
+        await cur.execute("""
+            INSERT INTO notifications ("userId", "deviceId", level, title, message, "createdAt")
+            VALUES (%s, %s, %s, %s, %s, NOW());
+        """, (user_id, device_id, "info", "Auto Mode", msg))
+        await conn.commit()
+    except Exception as ne:
+        await conn.rollback()
+        logger.error(f"[AUTO MODE] Failed to create notification: {ne}")
+    finally:
+        await cur.close()
+        await release_async_connection(conn)
+
+
+async def _trigger_auto_actuator(device_id: str, user_id: str):
+    """Trigger auto mode for a device and create notification. Returns True on success."""
+    try:
+        # Call actuator logic directly (no HTTP loopback)
+        event = actuator.ActuatorEvent(auto=1)
+        try:
+            result = await asyncio.wait_for(
+                actuator.execute_event(device_id, event, user_id),
+                timeout=AUTO_MODE_DEVICE_TIMEOUT
+            )
+        except HTTPException as he:
+            logger.warning(f"[AUTO MODE] ✗ {device_id} → Status {he.status_code}: {he.detail}")
+            return False
+
+        data = result.get("data", {})
+
         # Build action summary
         actions = []
         if data.get('phUp', 0) > 0:
@@ -162,37 +257,63 @@ def _trigger_auto_actuator(device_id: str, user_id: str):
         
         # Create notification
         if user_id:
-            conn = get_connection()
-            cur = conn.cursor()
-            try:
-                msg = f"Auto adjustment: {', '.join(actions)}" if actions else "All parameters within safe limits"
-                cur.execute("""
-                    INSERT INTO notifications ("userId", "deviceId", level, title, message, "createdAt")
-                    VALUES (%s, %s, %s, %s, %s, NOW());
-                """, (user_id, device_id, "info", "Auto Mode", msg))
-                conn.commit()
-            except Exception as ne:
-                conn.rollback()
-                logger.error(f"[AUTO MODE] Failed to create notification: {ne}")
-            finally:
-                cur.close()
-                release_connection(conn)
-                
+            msg = f"Auto adjustment: {', '.join(actions)}" if actions else "All parameters within safe limits"
+            await _create_auto_notification(user_id, device_id, msg)
+
+        return True
+
+    except asyncio.TimeoutError:
+        logger.warning(f"[AUTO MODE] ✗ {device_id} → Timed out after {AUTO_MODE_DEVICE_TIMEOUT}s")
+        return False
     except Exception as e:
         logger.error(f"[AUTO MODE] ✗ {device_id} → Error: {e}", exc_info=True)
+        return False
+
+
+@app.get("/auto-mode/stats")
+def get_auto_mode_stats():
+    """Scheduler cycle duration and overrun counters."""
+    return {
+        "interval": AUTO_MODE_INTERVAL,
+        "concurrency": AUTO_MODE_CONCURRENCY,
+        **_auto_mode_stats,
+    }
 
 
 @app.on_event("startup")
 async def startup_event():
-    """Run database migrations and start auto mode scheduler on startup."""
-    init_pool()
-    run_migrations()
+    """Run database migrations and start auto mode scheduler, telemetry maintenance and the model watcher on startup."""
+    global _auto_mode_task, _maintenance_task
+    # psycopg2 work; run_migrations may wait on another replica's migration lock
+    await asyncio.to_thread(init_pool)
+    await asyncio.to_thread(run_migrations)
+    await init_async_pool()
     
-    # Start auto mode scheduler in background thread
-    scheduler_thread = threading.Thread(target=_auto_mode_scheduler, daemon=True)
-    scheduler_thread.start()
+    # Start auto mode scheduler as a background task on the event loop
+    _auto_mode_task = asyncio.create_task(_auto_mode_scheduler())
     logger.info("[STARTUP] Auto mode scheduler started")
 
+    # Day partitions, rollups and retention for telemetry
+    _maintenance_task = asyncio.create_task(telemetry_maintenance.maintenance_loop())
+
+    # Load the model in the background (first request doesn't pay the cold load) and hot-reload new versions
+    predictor.start_watcher()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks, flush buffered prediction logs and close the async pool."""
+    for task in (_auto_mode_task, _maintenance_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    predictor.stop_watcher()
+    await asyncio.to_thread(prediction_logger.stop)
+    await close_async_pool()
+
 class TelemetryPayload(BaseModel):
     ppm: float
     ph: float
@@ -201,6 +322,11 @@ class TelemetryPayload(BaseModel):
     waterTemp: float
     waterLevel: float
 
+class BulkTelemetryRecord(BaseModel):
+    deviceId: str
+    ts: Optional[int] = None  # epoch ms; defaults to server receive time
+    payload: TelemetryPayload
+
 class KitPayload(BaseModel):
     id: str
     name: str
@@ -243,6 +369,7 @@ def add_kit(payload: KitPayload):
         """, (user_id, device_id))
 
         conn.commit()
+        kit_registry.mark_valid(device_id)
         return {"status": "ok"}
 
     except Exception as e:
@@ -289,15 +416,36 @@ def get_kits(userId: str):
 
 
 @app.get("/kits/all")
-def get_all_kits():
-    """Get all kits from global registry (no user filter). For publisher/simulator use."""
+def get_all_kits(response: Response, since: Optional[int] = None):
+    """
+    Get all kits from global registry (no user filter). For publisher/simulator use.
+    - since: optional cursor (epoch ms); only kits created after it are returned
+    The X-Kits-Cursor response header carries the cursor for the next call.
+    """
     conn = get_connection()
     cur = conn.cursor()
 
     try:
-        cur.execute('SELECT id, name, "createdAt" FROM kits ORDER BY "createdAt" DESC;')
+        query = """
+            SELECT id, name, "createdAt",
+                   (EXTRACT(EPOCH FROM "createdAt") * 1000)::BIGINT
+            FROM kits
+        """
+        params = []
+
+        if since is not None:
+            query += ' WHERE "createdAt" > to_timestamp(%s / 1000.0)'
+            params.append(since)
+
+        query += ' ORDER BY "createdAt" DESC;'
+
+        cur.execute(query, params)
         rows = cur.fetchall()
 
+        cursor = max((r[3] for r in rows), default=since)
+        if cursor is not None:
+            response.headers["X-Kits-Cursor"] = str(cursor)
+
         return [
             {"id": r[0], "name": r[1], "createdAt": r[2]}
             for r in rows
@@ -312,51 +460,55 @@ def get_all_kits():
 
 
 @app.get("/kits/with-latest")
-def get_kits_with_latest(userId: str):
-    """Get kits with latest telemetry for a specific user."""
+async def get_kits_with_latest(userId: str, fields: Optional[str] = None):
+    """
+    Get kits with latest telemetry for a specific user.
+    - fields: optional comma-separated sensor names to include in telemetry (e.g. "ph,ppm")
+    """
     user_id = userId.strip()
     
     if not user_id or len(user_id) < 8:
         raise HTTPException(400, "Invalid userId: must be at least 8 characters")
+
+    if fields:
+        selected = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in selected if f not in SENSOR_FIELDS]
+        if unknown:
+            raise HTTPException(400, f"Unknown fields: {', '.join(unknown)}")
+    else:
+        selected = SENSOR_FIELDS
     
-    conn = get_connection()
+    conn = await get_async_connection()
     cur = conn.cursor()
 
     try:
-        cur.execute("""
-            SELECT k.id, k.name, k."createdAt"
+        # One set-based query: kits joined with their latest-telemetry projection row
+        await cur.execute("""
+            SELECT k.id, k.name, k."createdAt",
+                   tl."ingestTime", tl.ppm, tl.ph, tl."tempC",
+                   tl.humidity, tl."waterTemp", tl."waterLevel"
             FROM kits k
             JOIN user_kits uk ON k.id = uk."kitId"
+            LEFT JOIN telemetry_latest tl ON tl."deviceId" = k.id
             WHERE uk."userId" = %s
             ORDER BY uk."addedAt" DESC;
         """, (user_id,))
-        kits = cur.fetchall()
+        rows = await cur.fetchall()
 
         results = []
 
-        for kit in kits:
-            kit_id = kit[0]
-
-            cur.execute("""
-                SELECT "payloadJson", "ingestTime"
-                FROM telemetry
-                WHERE "deviceId" = %s
-                ORDER BY "ingestTime" DESC
-                LIMIT 1;
-            """, (kit_id,))
-
-            row = cur.fetchone()
-
-            if row:
-                telemetry = map_payload(row[0])
-                telemetry["ingestTime"] = row[1]
+        for r in rows:
+            if r[3] is not None:
+                values = dict(zip(SENSOR_FIELDS, r[4:]))
+                telemetry = {f: values[f] for f in selected}
+                telemetry["ingestTime"] = r[3]
             else:
                 telemetry = None
 
             results.append({
-                "id": kit[0],
-                "name": kit[1],
-                "createdAt": kit[2],
+                "id": r[0],
+                "name": r[1],
+                "createdAt": r[2],
                 "telemetry": telemetry
             })
 
@@ -366,8 +518,8 @@ def get_kits_with_latest(userId: str):
         raise HTTPException(500, str(e))
 
     finally:
-        cur.close()
-        release_connection(conn)
+        await cur.close()
+        await release_async_connection(conn)
 
 
 @app.get("/kits/{kit_id}")
@@ -411,6 +563,7 @@ def delete_kit(kit_id: str, userId: str):
             WHERE "userId" = %s AND "kitId" = %s;
         """, (user_id, device_id))
         conn.commit()
+        kit_registry.invalidate(device_id)
 
         return {"status": "deleted"}
 
@@ -423,76 +576,166 @@ def delete_kit(kit_id: str, userId: str):
         release_connection(conn)
 
 # HELPERS
-def is_valid_device(device_id: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM kits WHERE id = %s;", (device_id,))
-    found = cur.fetchone()
-    cur.close()
-    release_connection(conn)
-    return found is not None
-
-
-def map_payload(value):
-    if isinstance(value, dict):
-        p = value
-    else:
-        try:
-            p = json.loads(value)
-        except:
-            return {}
+def _telemetry_hash(device_id: str, payload_dict: dict):
+    # Shared by single and bulk ingest so they dedupe against each other
+    return hashlib.sha1(
+        f"{device_id}-{json.dumps(payload_dict)}".encode()
+    ).hexdigest()
 
-    return {
-        "ppm": p.get("ppm"),
-        "ph": p.get("ph"),
-        "tempC": p.get("tempC"),
-        "humidity": p.get("humidity"),
-        "waterTemp": p.get("waterTemp"),
-        "waterLevel": p.get("waterLevel"),
-    }
 
 # TELEMETRY INSERT
 @app.post("/telemetry")
-def insert_telemetry(deviceId: str, data: TelemetryPayload):
+async def insert_telemetry(deviceId: str, data: TelemetryPayload):
     deviceId = deviceId.strip()
 
-    if not is_valid_device(deviceId):
+    if not await is_valid_device_async(deviceId):
         raise HTTPException(400, "Invalid deviceId. Register it via /kits first.")
 
-    conn = get_connection()
+    conn = await get_async_connection()
     cur = conn.cursor()
 
     rowId = str(uuid.uuid4())
     ingestTime = int(time.time() * 1000)
     payload_dict = data.dict()
 
-    payloadHash = hashlib.sha1(
-        f"{deviceId}-{json.dumps(payload_dict)}".encode()
-    ).hexdigest()
+    payloadHash = _telemetry_hash(deviceId, payload_dict)
 
     try:
-        cur.execute("""
+        # Dedup lives in telemetry_dedup (a partitioned table has no global UNIQUE)
+        await cur.execute("""
+            WITH fresh AS (
+                INSERT INTO telemetry_dedup ("payloadHash", "ingestTime")
+                VALUES (%s, %s)
+                ON CONFLICT ("payloadHash") DO NOTHING
+                RETURNING "payloadHash"
+            )
             INSERT INTO telemetry (
             "rowId", "deviceId", "ingestTime", "payloadJson",
             ppm, ph, "tempC", humidity, "waterTemp", "waterLevel",
             "payloadHash"
             )
-            VALUES (
+            SELECT
                 %s, %s, %s, %s,
                 %s, %s, %s, %s, %s, %s,
-                %s
-            )
-            ON CONFLICT ("payloadHash") DO NOTHING;
+                "payloadHash"
+            FROM fresh;
             """, (
-                rowId, deviceId, ingestTime, json.dumps(payload_dict),
+                payloadHash, ingestTime,
+                rowId, deviceId, ingestTime, payload_json(payload_dict),
                 data.ppm, data.ph, data.tempC, data.humidity,
-                data.waterTemp, data.waterLevel,
-                payloadHash
+                data.waterTemp, data.waterLevel
             ))
 
+        duplicate = cur.rowcount == 0
+        if not duplicate:
+            await upsert_latest_async(cur, deviceId, ingestTime, payload_dict)
+
+        await conn.commit()
+
+        if not duplicate:
+            remember_latest(deviceId, ingestTime, payload_dict)
+
+        return {"status": "ok", "duplicate": duplicate}
+
+    except Exception as e:
+        await conn.rollback()
+        raise HTTPException(500, str(e))
+
+    finally:
+        await cur.close()
+        await release_async_connection(conn)
+
+# TELEMETRY BULK INSERT
+TELEMETRY_BULK_MAX = int(os.getenv("TELEMETRY_BULK_MAX", "5000"))
+
+
+def _write_telemetry_bulk(records: List[BulkTelemetryRecord]):
+    received_at = int(time.time() * 1000)
+    results = [None] * len(records)
+
+    device_ids = {r.deviceId.strip() for r in records}
+
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        valid_ids = kit_registry.filter_valid(device_ids, cur)
+
+        rows = []
+        pending = []  # (index, deviceId, ingestTime, payload, hash)
+        seen_hashes = set()
+
+        for i, rec in enumerate(records):
+            device_id = rec.deviceId.strip()
 
+            if device_id not in valid_ids:
+                results[i] = {"deviceId": device_id, "error": "invalid deviceId"}
+                continue
+
+            payload_dict = rec.payload.dict()
+            payload_hash = _telemetry_hash(device_id, payload_dict)
+
+            # Repeats inside the same batch are duplicates of the first occurrence
+            if payload_hash in seen_hashes:
+                results[i] = {"deviceId": device_id, "duplicate": True}
+                continue
+            seen_hashes.add(payload_hash)
+
+            ingest_time = rec.ts if rec.ts is not None else received_at
+            rows.append((
+                str(uuid.uuid4()), device_id, ingest_time, payload_json(payload_dict),
+                *[payload_dict[k] for k in SENSOR_FIELDS],
+                payload_hash
+            ))
+            pending.append((i, device_id, ingest_time, payload_dict, payload_hash))
+
+        inserted_hashes = set()
+        if rows:
+            # Claim hashes first; only rows whose hash was new go into telemetry
+            claimed = execute_values(cur, """
+                INSERT INTO telemetry_dedup ("payloadHash", "ingestTime")
+                VALUES %s
+                ON CONFLICT ("payloadHash") DO NOTHING
+                RETURNING "payloadHash";
+            """, [(r[-1], r[2]) for r in rows], fetch=True)
+            inserted_hashes = {r[0] for r in claimed}
+
+            fresh_rows = [r for r in rows if r[-1] in inserted_hashes]
+            if fresh_rows:
+                execute_values(cur, """
+                    INSERT INTO telemetry (
+                    "rowId", "deviceId", "ingestTime", "payloadJson",
+                    ppm, ph, "tempC", humidity, "waterTemp", "waterLevel",
+                    "payloadHash"
+                    )
+                    VALUES %s;
+                """, fresh_rows, page_size=1000)
+
+                # Backfilled (ts) readings behind the rollup window get their buckets re-rolled
+                telemetry_maintenance.mark_late_readings(cur, [(r[1], r[2]) for r in fresh_rows], received_at)
+
+        latest_by_device = {}
+        for i, device_id, ingest_time, payload_dict, payload_hash in pending:
+            duplicate = payload_hash not in inserted_hashes
+            results[i] = {"deviceId": device_id, "duplicate": duplicate}
+
+            if not duplicate:
+                current = latest_by_device.get(device_id)
+                if current is None or ingest_time >= current[0]:
+                    latest_by_device[device_id] = (ingest_time, payload_dict)
+
+        upsert_latest_many(cur, latest_by_device)
         conn.commit()
-        return {"status": "ok", "duplicate": cur.rowcount == 0}
+
+        forget_latest(latest_by_device.keys())
+
+        return {
+            "status": "ok",
+            "inserted": len(inserted_hashes),
+            "duplicates": sum(1 for r in results if r.get("duplicate")),
+            "invalid": sum(1 for r in results if "error" in r),
+            "results": results
+        }
 
     except Exception as e:
         conn.rollback()
@@ -502,76 +745,227 @@ def insert_telemetry(deviceId: str, data: TelemetryPayload):
         cur.close()
         release_connection(conn)
 
+
+@app.post("/telemetry/bulk")
+async def insert_telemetry_bulk(request: Request):
+    """
+    Insert many readings in one request.
+    Body: JSON array (or NDJSON with Content-Type application/x-ndjson) of
+    {deviceId, ts, payload}. Returns a per-record duplicate flag, in input order.
+    """
+    body = await request.body()
+
+    try:
+        if "ndjson" in request.headers.get("content-type", ""):
+            raw = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            raw = json.loads(body)
+            if not isinstance(raw, list):
+                raise HTTPException(400, "Expected a JSON array of records")
+
+        records = [BulkTelemetryRecord(**r) for r in raw]
+    except HTTPException:
+        raise
+    except (ValueError, TypeError) as e:
+        raise HTTPException(400, f"Invalid bulk payload: {e}")
+
+    if len(records) > TELEMETRY_BULK_MAX:
+        raise HTTPException(400, f"Too many records: max {TELEMETRY_BULK_MAX}")
+
+    if not records:
+        return {"status": "ok", "inserted": 0, "duplicates": 0, "invalid": 0, "results": []}
+
+    # Database work is blocking; keep it off the event loop
+    return await run_in_threadpool(_write_telemetry_bulk, records)
+
 # TELEMETRY GET LATEST
 @app.get("/telemetry/latest")
-def get_latest(deviceId: str):
-    conn = get_connection()
+async def get_latest(deviceId: str):
+    conn = await get_async_connection()
     cur = conn.cursor()
 
     try:
-        cur.execute("""
-            SELECT "payloadJson", "ingestTime"
-            FROM telemetry
-            WHERE "deviceId" = %s
-            ORDER BY "ingestTime" DESC
-            LIMIT 1;
-        """, (deviceId,))
-
-        row = cur.fetchone()
-        if not row:
+        latest = await fetch_latest_async(cur, deviceId)
+        if not latest:
             return {"message": "no data"}
 
         return {
             "deviceId": deviceId,
-            "ingestTime": row[1],
-            "data": map_payload(row[0])
+            "ingestTime": latest[0],
+            "data": latest[1]
         }
 
     except Exception as e:
         raise HTTPException(500, str(e))
 
     finally:
-        cur.close()
-        release_connection(conn)
+        await cur.close()
+        await release_async_connection(conn)
+
+@app.get("/telemetry/maintenance")
+def get_telemetry_maintenance():
+    """Retention settings and the outcome of the last partition/rollup/retention pass."""
+    return telemetry_maintenance.maintenance_stats()
 
 # TELEMETRY GET HISTORY
+HISTORY_MAX_POINTS = 5000
+# Row cap for format=ndjson/csv exports (streamed, so not bound by the JSON safety cap)
+HISTORY_STREAM_MAX_ROWS = int(os.getenv("HISTORY_STREAM_MAX_ROWS", "1000000"))
+# Bucketed reads come mostly from rollups, so they may look further back than raw reads
+HISTORY_MAX_BUCKET_DAYS = int(os.getenv("HISTORY_MAX_BUCKET_DAYS", "90"))
+_BUCKET_UNITS = {"s": 1000, "m": 60 * 1000, "h": 60 * 60 * 1000, "d": 24 * 60 * 60 * 1000}
+
+
+def _parse_bucket(bucket: str):
+    """Parse "30s" / "5m" / "1h" / "1d" or plain seconds into milliseconds."""
+    value = bucket.strip().lower()
+    try:
+        if value and value[-1] in _BUCKET_UNITS:
+            ms = int(value[:-1]) * _BUCKET_UNITS[value[-1]]
+        else:
+            ms = int(value) * 1000
+    except ValueError:
+        raise HTTPException(400, "Invalid bucket: use e.g. 30s, 5m, 1h, 1d")
+    if ms < 1000:
+        raise HTTPException(400, "Invalid bucket: minimum is 1s")
+    return ms
+
+
+def _bucket_for_points(range_ms: int, points: int):
+    """Smallest bucket (whole seconds, or whole minutes above one minute) giving at most `points` buckets."""
+    ms = -(-range_ms // points)
+    unit = 60 * 1000 if ms > 60 * 1000 else 1000
+    return -(-ms // unit) * unit
+
+
+def _parse_cursor(before: str):
+    """Cursor is "<ingestTime>" or "<ingestTime>:<rowId>" as returned in nextCursor."""
+    ts, _, row_id = before.partition(":")
+    try:
+        return int(ts), row_id or None
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+
+
 @app.get("/telemetry/history")
-def get_history(deviceId: str, days: int = 7, limit: int = 10000):
+def get_history(
+    deviceId: str,
+    days: int = 7,
+    limit: int = 10000,
+    bucket: Optional[str] = None,
+    points: Optional[int] = None,
+    before: Optional[str] = None,
+    format: str = "json",
+):
     """
-    Get telemetry history for a device.
-    - days: How many days back to fetch (max 7)
+    Get telemetry history for a device, newest first.
+    - days: How many days back to fetch (max 7; max HISTORY_MAX_BUCKET_DAYS when bucketed)
     - limit: Max entries to return (default 10000, for safety)
+    - bucket: aggregate into fixed time buckets (e.g. 1m, 15m, 1h); items carry the
+      average in "data" plus "min", "max" and "samples"
+    - points: instead of bucket, pick the bucket size that yields about this many items
+    - before: keyset cursor; pass the previous response's nextCursor to get the next page
+    - format: json (default), or ndjson/csv to stream raw rows as flat records
+      (deviceId, ingestTime, sensors) from a server-side cursor, up to HISTORY_STREAM_MAX_ROWS
     """
-    days = max(1, min(days, 7))
+    format = check_format(format)
+    bucketed = bucket is not None or points is not None
+    if bucketed and format != "json":
+        raise HTTPException(400, "Bucketed history is only available as json")
+    days = max(1, min(days, HISTORY_MAX_BUCKET_DAYS if bucketed else 7))
+    limit_requested = max(1, limit)
     limit = max(1, min(limit, 50000))  # Safety cap
     
     # Calculate timestamp for N days ago
-    cutoff_time = int((time.time() - (days * 24 * 60 * 60)) * 1000)
+    # The "ingestTime" bound also limits the scan to the matching day partitions
+    now_ms = int(time.time() * 1000)
+    cutoff_time = now_ms - days * 24 * 60 * 60 * 1000
+    cursor_time, cursor_row = _parse_cursor(before) if before else (None, None)
+
+    if format != "json":
+        return stream_query("""
+            SELECT "deviceId", "ingestTime", ppm, ph, "tempC", humidity, "waterTemp", "waterLevel"
+            FROM telemetry
+            WHERE "deviceId" = %s AND "ingestTime" >= %s
+              AND ("ingestTime", "rowId") < (%s, %s)
+            ORDER BY "ingestTime" DESC, "rowId" DESC
+            LIMIT %s;
+        """, (
+            deviceId, cutoff_time,
+            cursor_time if cursor_time is not None else 2 ** 62, cursor_row or "",
+            min(limit_requested, HISTORY_STREAM_MAX_ROWS)
+        ), ["deviceId", "ingestTime", *SENSOR_FIELDS], format, f"telemetry-{deviceId}")
 
     conn = get_connection()
     cur = conn.cursor()
 
     try:
-        cur.execute("""
-            SELECT "payloadJson", "ingestTime"
-            FROM telemetry
-            WHERE "deviceId" = %s AND "ingestTime" >= %s
-            ORDER BY "ingestTime" DESC
-            LIMIT %s;
-        """, (deviceId, cutoff_time, limit))
+        if bucketed:
+            if bucket is not None:
+                bucket_ms = _parse_bucket(bucket)
+            else:
+                points = max(1, min(points, HISTORY_MAX_POINTS))
+                bucket_ms = _bucket_for_points((cursor_time or now_ms) - cutoff_time, points)
+
+            # Cursor values are bucket starts; without one, include readings stamped slightly ahead
+            end = cursor_time if cursor_time is not None else now_ms + bucket_ms
+            end -= end % bucket_ms
+            limit = min(limit, HISTORY_MAX_POINTS)
+            rows = telemetry_maintenance.read_buckets(cur, deviceId, cutoff_time, end, bucket_ms, limit)
+
+            items = [
+                {
+                    "ingestTime": t,
+                    "samples": samples,
+                    "data": dict(zip(SENSOR_FIELDS, avgs)),
+                    "min": dict(zip(SENSOR_FIELDS, mins)),
+                    "max": dict(zip(SENSOR_FIELDS, maxs)),
+                }
+                for t, samples, mins, maxs, avgs in rows
+            ]
+            return FastJSONResponse({
+                "deviceId": deviceId,
+                "days": days,
+                "bucket": bucket_ms // 1000,
+                "count": len(items),
+                "items": items,
+                "nextCursor": str(items[-1]["ingestTime"]) if len(items) == limit else None,
+            })
+
+        if cursor_time is None:
+            cur.execute("""
+                SELECT "ingestTime", "rowId", ppm, ph, "tempC", humidity, "waterTemp", "waterLevel"
+                FROM telemetry
+                WHERE "deviceId" = %s AND "ingestTime" >= %s
+                ORDER BY "ingestTime" DESC, "rowId" DESC
+                LIMIT %s;
+            """, (deviceId, cutoff_time, limit))
+        else:
+            cur.execute("""
+                SELECT "ingestTime", "rowId", ppm, ph, "tempC", humidity, "waterTemp", "waterLevel"
+                FROM telemetry
+                WHERE "deviceId" = %s AND "ingestTime" >= %s
+                  AND ("ingestTime", "rowId") < (%s, %s)
+                ORDER BY "ingestTime" DESC, "rowId" DESC
+                LIMIT %s;
+            """, (deviceId, cutoff_time, cursor_time, cursor_row or "", limit))
 
         rows = cur.fetchall()
 
-        return {
+        # Returned as a response object: skips the per-item jsonable_encoder pass
+        return FastJSONResponse({
             "deviceId": deviceId,
             "days": days,
             "count": len(rows),
             "items": [
-                {"ingestTime": r[1], "data": map_payload(r[0])}
+                {"ingestTime": r[0], "data": dict(zip(SENSOR_FIELDS, r[2:]))}
                 for r in rows
-            ]
-        }
+            ],
+            "nextCursor": f"{rows[-1][0]}:{rows[-1][1]}" if len(rows) == limit else None,
+        })
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(500, str(e))
 
@@ -0,0 +1,512 @@
+"""
+Versioned schema migrations.
+
+Every step in MIGRATIONS runs once and is recorded in schema_migrations.
+apply_migrations() (called through database.run_migrations() at startup) first
+reads the recorded versions in a single query; when nothing is pending it
+returns without touching any DDL, so restarts and --reload take no table locks.
+Pending steps are applied in version order under an advisory lock, so several
+API workers booting at once apply each step exactly once.
+
+Regular steps run in a transaction together with their schema_migrations row.
+Index steps (concurrent=True) run in autocommit mode and build with
+CREATE INDEX CONCURRENTLY, so ingest and the API keep writing meanwhile.
+
+For partitioned tables (telemetry) CONCURRENTLY is not available on the parent:
+the index is created ON ONLY the parent (invalid), built concurrently on each
+partition and attached; the parent index becomes valid once every partition has
+its copy, and partitions created later get it automatically.
+
+Schema changes are new entries appended to MIGRATIONS; applied steps are never
+edited or renumbered. Run by hand with:
+    python -m services.api.migrations
+"""
+import logging
+import os
+import re
+import time
+import psycopg2.errors
+from services.api.database import get_connection, release_connection, init_pool
+from services.api.telemetry_maintenance import (
+    DAY_MS, create_partitioned_parent, ensure_default_partition, ensure_partitions, ensure_telemetry_storage
+)
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_LOCK_POLL = float(os.getenv("MIGRATION_LOCK_POLL", "1"))
+# Legacy telemetry conversion: hashes copied to telemetry_dedup per statement, and how
+# long (and how often) the final swap may wait for its table lock
+LEGACY_DEDUP_BATCH = int(os.getenv("LEGACY_DEDUP_BATCH", "10000"))
+LEGACY_SWAP_LOCK_TIMEOUT = os.getenv("LEGACY_SWAP_LOCK_TIMEOUT", "5s")
+LEGACY_SWAP_ATTEMPTS = int(os.getenv("LEGACY_SWAP_ATTEMPTS", "10"))
+
+# Indexes on the telemetry parent (name -> column spec); the legacy conversion
+# re-creates each of them on the new parent
+TELEMETRY_INDEXES = {
+    "idx_telemetry_device_time": '("deviceId", "ingestTime" DESC)',
+    # Rollup passes scan [start, end) of "ingestTime" across all devices; BRIN stays tiny
+    # because rows arrive in roughly "ingestTime" order within each day partition.
+    # autosummarize: block ranges filled after CREATE INDEX are otherwise unsummarized
+    # (always match) until VACUUM, which would turn the scan into a full partition read
+    "idx_telemetry_ingest_time": 'USING brin ("ingestTime") WITH (autosummarize = on)',
+}
+
+
+# INDEX HELPERS
+def _index_state(cur, name):
+    """None if the index does not exist, otherwise its indisvalid flag."""
+    cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s);", (name,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _relkind(cur, name):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (name,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def create_index_concurrently(cur, name, table, columns, where=None):
+    """
+    CREATE INDEX CONCURRENTLY name ON table columns [WHERE ...], on a connection in
+    autocommit mode. An invalid leftover from an interrupted build is dropped first.
+    """
+    predicate = f" WHERE {where}" if where else ""
+
+    if _relkind(cur, table) == "p":
+        if _index_state(cur, name):
+            return
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {columns}{predicate};")
+        cur.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass;
+        """, (table,))
+        for (partition,) in cur.fetchall():
+            child = f"{name}_{partition.replace(table + '_', '', 1)}"[:63]
+            if _index_state(cur, child) is False:
+                cur.execute(f"DROP INDEX CONCURRENTLY {child};")
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition} {columns}{predicate};")
+            cur.execute(f"ALTER INDEX {name} ATTACH PARTITION {child};")
+        return
+
+    if _index_state(cur, name) is False:
+        cur.execute(f"DROP INDEX CONCURRENTLY {name};")
+    cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {columns}{predicate};")
+
+
+# BASELINE
+def _baseline_schema(cur):
+    """
+    Schema as of the first versioned migration (formerly run_migrations()).
+    Every statement is IF NOT EXISTS, so it also adopts databases created before
+    schema_migrations existed.
+      - kits
+      - telemetry (camelCase, day partitions; see telemetry_maintenance)
+      - telemetry_latest (latest reading per device)
+      - actuator_event (camelCase)
+      - actuator_cooldown (for cooldown tracking)
+      - ml_prediction_log (for ML predictions)
+      - device_mode, user_preference, notifications, user_kits
+    """
+    # KITS TABLE
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS kits (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            "createdAt" TIMESTAMPTZ DEFAULT NOW()
+        );
+    """)
+
+    # TELEMETRY TABLE (partitioned by day on "ingestTime", plus dedup and rollup tables)
+    ensure_telemetry_storage(cur)
+
+    # TELEMETRY LATEST (one row per device, kept current by insert_telemetry)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS telemetry_latest (
+            "deviceId" TEXT PRIMARY KEY,
+            "ingestTime" BIGINT NOT NULL,
+            ppm FLOAT,
+            ph FLOAT,
+            "tempC" FLOAT,
+            humidity FLOAT,
+            "waterTemp" FLOAT,
+            "waterLevel" FLOAT
+        );
+    """)
+
+    # Backfill the projection once from existing history (no-op once populated)
+    cur.execute("""
+        INSERT INTO telemetry_latest (
+            "deviceId", "ingestTime",
+            ppm, ph, "tempC", humidity, "waterTemp", "waterLevel"
+        )
+        SELECT DISTINCT ON ("deviceId")
+            "deviceId", "ingestTime",
+            ppm, ph, "tempC", humidity, "waterTemp", "waterLevel"
+        FROM telemetry
+        WHERE NOT EXISTS (SELECT 1 FROM telemetry_latest)
+        ORDER BY "deviceId", "ingestTime" DESC
+        ON CONFLICT ("deviceId") DO NOTHING;
+    """)
+
+    # ACTUATOR TABLE
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS actuator_event (
+            id SERIAL PRIMARY KEY,
+            "deviceId" TEXT NOT NULL,
+            "ingestTime" BIGINT NOT NULL,
+            "phUp" INT DEFAULT 0,
+            "phDown" INT DEFAULT 0,
+            "nutrientAdd" INT DEFAULT 0,
+            "valueS" FLOAT DEFAULT 0,
+            "manual" INT DEFAULT 0,
+            "auto" INT DEFAULT 0,
+            "refill" INT DEFAULT 0
+        );
+    """)
+
+    # ACTUATOR COOLDOWN TABLE
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS actuator_cooldown (
+            id SERIAL PRIMARY KEY,
+            "deviceId" TEXT NOT NULL,
+            "actionType" TEXT NOT NULL,
+            "lastTime" BIGINT NOT NULL,
+            "lastValue" FLOAT DEFAULT 0,
+            UNIQUE ("deviceId", "actionType")
+        );
+    """)
+
+    # ML PREDICTION LOG TABLE
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ml_prediction_log (
+            id SERIAL PRIMARY KEY,
+            "deviceId" TEXT NOT NULL,
+            "predictTime" BIGINT NOT NULL,
+            "payloadJson" JSONB NOT NULL,
+            "predictJson" JSONB NOT NULL
+        );
+    """)
+
+    # DEVICE MODE TABLE (per-user, per-device auto/manual tracking)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS device_mode (
+            id SERIAL PRIMARY KEY,
+            "userId" TEXT NOT NULL,
+            "deviceId" TEXT NOT NULL,
+            "autoMode" BOOLEAN DEFAULT FALSE,
+            "updatedAt" TIMESTAMPTZ DEFAULT NOW(),
+            UNIQUE ("userId", "deviceId"),
+            CHECK (LENGTH("userId") >= 8),
+            CHECK (LENGTH("deviceId") >= 5),
+            CHECK ("userId" != ''),
+            CHECK ("deviceId" != '')
+        );
+    """)
+
+    # USER PREFERENCE TABLE (selected kit per user)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_preference (
+            id SERIAL PRIMARY KEY,
+            "userId" TEXT UNIQUE NOT NULL,
+            "selectedKitId" TEXT,
+            "updatedAt" TIMESTAMPTZ DEFAULT NOW()
+        );
+    """)
+
+    # NOTIFICATIONS TABLE (backend-persisted notifications)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS notifications (
+            id SERIAL PRIMARY KEY,
+            "userId" TEXT NOT NULL,
+            "deviceId" TEXT NOT NULL,
+            level TEXT NOT NULL,
+            title TEXT NOT NULL,
+            message TEXT NOT NULL,
+            "isRead" BOOLEAN DEFAULT FALSE,
+            "createdAt" TIMESTAMPTZ DEFAULT NOW()
+        );
+    """)
+
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_notif_user ON notifications("userId");
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_notif_time ON notifications("createdAt" DESC);
+    """)
+
+    # USER_KITS JUNCTION TABLE (many-to-many: user <-> kit)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_kits (
+            "userId" TEXT NOT NULL,
+            "kitId" TEXT NOT NULL REFERENCES kits(id) ON DELETE CASCADE,
+            "addedAt" TIMESTAMPTZ DEFAULT NOW(),
+            PRIMARY KEY ("userId", "kitId"),
+            CHECK (LENGTH("userId") >= 8),
+            CHECK (LENGTH("kitId") >= 5)
+        );
+    """)
+
+    # Indexes for user_kits
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_kits_user ON user_kits("userId");
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_kits_kit ON user_kits("kitId");
+    """)
+
+
+def _rollup_dirty_table(cur):
+    # (deviceId, minute) buckets that received readings behind the rollup watermark
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS telemetry_rollup_dirty (
+            "deviceId" TEXT NOT NULL,
+            "bucketStart" BIGINT NOT NULL,
+            PRIMARY KEY ("deviceId", "bucketStart")
+        );
+    """)
+
+
+# LEGACY TELEMETRY
+_LEGACY_BOUND = "telemetry_legacy_bound"
+
+
+def _add_legacy_bound(cur):
+    """
+    CHECK ("ingestTime" < boundary) on the legacy heap, validated without blocking
+    writes. ATTACH PARTITION then trusts it instead of scanning the table under an
+    ACCESS EXCLUSIVE lock. The boundary leaves room for the rest of today and tomorrow;
+    it is raised above existing future-dated rows if there are any.
+    """
+    cur.execute("""
+        SELECT convalidated, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = 'telemetry'::regclass AND conname = %s;
+    """, (_LEGACY_BOUND,))
+    row = cur.fetchone()
+    if row and row[0]:
+        return int(re.search(r'"ingestTime" < \'?(\d+)', row[1]).group(1))  # validated by an earlier run
+    if row:
+        cur.execute(f"ALTER TABLE telemetry DROP CONSTRAINT {_LEGACY_BOUND};")
+
+    boundary = (int(time.time() * 1000) // DAY_MS + 2) * DAY_MS
+    while True:
+        cur.execute(f"""
+            ALTER TABLE telemetry ADD CONSTRAINT {_LEGACY_BOUND}
+            CHECK ("ingestTime" IS NOT NULL AND "ingestTime" < {boundary}) NOT VALID;
+        """)
+        try:
+            # SHARE UPDATE EXCLUSIVE: ingest keeps writing while the table is scanned
+            cur.execute(f"ALTER TABLE telemetry VALIDATE CONSTRAINT {_LEGACY_BOUND};")
+            return boundary
+        except psycopg2.errors.CheckViolation:
+            cur.execute(f"ALTER TABLE telemetry DROP CONSTRAINT {_LEGACY_BOUND};")
+            cur.execute('SELECT max("ingestTime") FROM telemetry;')
+            latest = cur.fetchone()[0]
+            boundary = (latest // DAY_MS + 2) * DAY_MS
+            logger.info(f"[DB] Legacy telemetry has rows up to {latest}; bound raised to {boundary}")
+
+
+def _backfill_legacy_dedup(cur):
+    """Copy legacy hashes into telemetry_dedup in keyset batches ("rowId" is the legacy key)."""
+    last, total = "", 0
+    while True:
+        cur.execute("""
+            WITH batch AS (
+                SELECT "rowId", "payloadHash", "ingestTime" FROM telemetry
+                WHERE "rowId" > %s ORDER BY "rowId" LIMIT %s
+            ), copied AS (
+                INSERT INTO telemetry_dedup ("payloadHash", "ingestTime")
+                SELECT "payloadHash", "ingestTime" FROM batch WHERE "payloadHash" IS NOT NULL
+                ON CONFLICT ("payloadHash") DO NOTHING
+            )
+            SELECT max("rowId"), count(*) FROM batch;
+        """, (last, LEGACY_DEDUP_BATCH))
+        last, n = cur.fetchone()
+        total += n
+        if n < LEGACY_DEDUP_BATCH:
+            return total
+
+
+def _swap_legacy_telemetry(cur, boundary):
+    """
+    One short transaction: rename the heap to telemetry_legacy, create the partitioned
+    parent, attach the heap (no validation scan thanks to the CHECK) and re-create the
+    parent's indexes from the ones already built on the heap.
+    """
+    conn = cur.connection
+    conn.autocommit = False
+    try:
+        cur.execute("SET LOCAL lock_timeout = %s;", (LEGACY_SWAP_LOCK_TIMEOUT,))
+        cur.execute("ALTER TABLE telemetry RENAME TO telemetry_legacy;")
+        for name in TELEMETRY_INDEXES:
+            cur.execute(f"ALTER INDEX {name} RENAME TO {name}_legacy;")
+        create_partitioned_parent(cur)
+        cur.execute(
+            "ALTER TABLE telemetry ATTACH PARTITION telemetry_legacy FOR VALUES FROM (MINVALUE) TO (%s);",
+            (boundary,)
+        )
+        cur.execute(f"ALTER TABLE telemetry_legacy DROP CONSTRAINT {_LEGACY_BOUND};")
+        cur.execute('ALTER TABLE telemetry_legacy ALTER COLUMN "payloadJson" DROP NOT NULL;')
+        for name, columns in TELEMETRY_INDEXES.items():
+            cur.execute(f"CREATE INDEX {name} ON ONLY telemetry {columns};")
+            cur.execute(f"ALTER INDEX {name} ATTACH PARTITION {name}_legacy;")
+        # New (empty) partitions get the parent's indexes as they are created
+        ensure_partitions(cur)
+        ensure_default_partition(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+
+
+def _convert_legacy_telemetry(cur):
+    """
+    Turn a legacy (unpartitioned) telemetry table into the first partition of the
+    partitioned layout. No-op on databases that are already partitioned.
+
+    Only the final swap takes ACCESS EXCLUSIVE, and it does no table scans or index
+    builds. The bound CHECK is validated, and the dedup hashes are copied, while
+    ingest keeps writing. Ingest already records the hashes of new rows in
+    telemetry_dedup. On a large table, run this step by hand
+    (python -m services.api.migrations) before deploying.
+    """
+    if _relkind(cur, "telemetry") != "r":
+        return
+
+    for name, columns in TELEMETRY_INDEXES.items():
+        create_index_concurrently(cur, name, "telemetry", columns)
+    boundary = _add_legacy_bound(cur)
+    copied = _backfill_legacy_dedup(cur)
+    logger.info(f"[DB] Copied {copied} legacy telemetry hashes to telemetry_dedup")
+
+    for attempt in range(1, LEGACY_SWAP_ATTEMPTS + 1):
+        try:
+            _swap_legacy_telemetry(cur, boundary)
+            break
+        except psycopg2.errors.LockNotAvailable:
+            if attempt == LEGACY_SWAP_ATTEMPTS:
+                raise
+            logger.warning(f"[DB] telemetry is busy; retrying the legacy swap ({attempt}/{LEGACY_SWAP_ATTEMPTS})")
+            time.sleep(MIGRATION_LOCK_POLL)
+
+    logger.info("[DB] telemetry converted to a partitioned table (legacy rows in telemetry_legacy)")
+
+
+# MIGRATIONS
+# (version, description, fn(cur), concurrent) - append only; never renumber or edit an applied step.
+# Version 0 is the schema that run_migrations() used to re-create on every boot.
+MIGRATIONS = [
+    (0, "baseline schema", _baseline_schema, False),
+    (1, "telemetry by device and time", lambda cur: create_index_concurrently(
+        cur, "idx_telemetry_device_time", "telemetry", TELEMETRY_INDEXES["idx_telemetry_device_time"]), True),
+    (2, "actuator_event by device and time", lambda cur: create_index_concurrently(
+        cur, "idx_actuator_event_device_time", "actuator_event", '("deviceId", "ingestTime" DESC, id DESC)'), True),
+    (3, "device_mode rows with auto mode on", lambda cur: create_index_concurrently(
+        cur, "idx_device_mode_auto", "device_mode", '("deviceId", "userId")', where='"autoMode" = TRUE'), True),
+    (4, "ml_prediction_log by device and time", lambda cur: create_index_concurrently(
+        cur, "idx_ml_prediction_log_device_time", "ml_prediction_log", '("deviceId", "predictTime" DESC)'), True),
+    (5, "notifications by user and time", lambda cur: create_index_concurrently(
+        cur, "idx_notif_user_time", "notifications", '("userId", "createdAt" DESC)'), True),
+    (6, "telemetry_rollup_dirty for late readings", _rollup_dirty_table, False),
+    (7, "telemetry by ingest time (BRIN)", lambda cur: create_index_concurrently(
+        cur, "idx_telemetry_ingest_time", "telemetry", TELEMETRY_INDEXES["idx_telemetry_ingest_time"]), True),
+    # Runs in autocommit mode: each phase commits on its own (see _convert_legacy_telemetry)
+    (8, "convert legacy telemetry to partitions", _convert_legacy_telemetry, True),
+]
+
+
+# RUNNER
+def _applied_versions(cur):
+    """Recorded versions (one query); empty on a database that predates schema_migrations."""
+    try:
+        cur.execute("SELECT version FROM schema_migrations;")
+    except psycopg2.errors.UndefinedTable:
+        return set()
+    return {r[0] for r in cur.fetchall()}
+
+
+def _record(cur, version, description):
+    cur.execute("""
+        INSERT INTO schema_migrations (version, description) VALUES (%s, %s)
+        ON CONFLICT (version) DO NOTHING;
+    """, (version, description))
+
+
+def _apply(conn, cur, version, description, fn, concurrent):
+    logger.info(f"[DB] Migration {version}: {description}")
+    if concurrent:
+        fn(cur)
+        _record(cur, version, description)
+        return
+
+    conn.autocommit = False
+    try:
+        fn(cur)
+        _record(cur, version, description)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+
+
+def apply_migrations():
+    """Apply pending MIGRATIONS in version order. Returns the versions applied."""
+    conn = get_connection()
+    conn.autocommit = True
+    cur = conn.cursor()
+    applied = []
+    locked = False
+
+    try:
+        # Fast path: schema already current -> no lock, no catalog lookups, no DDL
+        done = _applied_versions(cur)
+        if all(m[0] in done for m in MIGRATIONS):
+            logger.info(f"[DB] Schema is current (version {max(done)})")
+            return applied
+
+        # Serialise API workers starting at the same time. Poll instead of blocking in
+        # pg_advisory_lock: a waiting statement holds a snapshot, and CREATE INDEX
+        # CONCURRENTLY in the other worker would wait on it.
+        while True:
+            cur.execute("SELECT pg_try_advisory_lock(hashtext('schema_migrations'));")
+            if cur.fetchone()[0]:
+                locked = True
+                break
+            time.sleep(MIGRATION_LOCK_POLL)
+
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                description TEXT NOT NULL,
+                "appliedAt" TIMESTAMPTZ DEFAULT NOW()
+            );
+        """)
+        # Another worker may have applied steps while we waited for the lock
+        done = _applied_versions(cur)
+
+        for version, description, fn, concurrent in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if version in done:
+                continue
+            _apply(conn, cur, version, description, fn, concurrent)
+            applied.append(version)
+
+        logger.info("[DB] Migrations executed.")
+        return applied
+
+    finally:
+        if locked:
+            cur.execute("SELECT pg_advisory_unlock(hashtext('schema_migrations'));")
+        cur.close()
+        conn.autocommit = False
+        release_connection(conn)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    init_pool()
+    print(f"Applied: {apply_migrations() or 'nothing (schema is current)'}")
@@ -1,14 +1,19 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from services.ml.predictor import predict_from_dict
-from typing import Optional
-from services.api.database import get_connection, release_connection
-import time
-import json
+from services.ml.predictor import (
+    predict_from_dict, predict_batch, cache_stats, model_info, reload_if_changed, InvalidFeaturesError
+)
+from typing import List, Optional
+from services.api.prediction_logger import prediction_logger
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
 
 ml_router = APIRouter()
 
 class TelemetryPayload(BaseModel):
+    deviceId: Optional[str] = None  # only used to attribute the prediction log row
     ppm: Optional[float] = 0.0
     ph: Optional[float] = 0.0
     tempC: Optional[float] = 0.0
@@ -16,6 +21,9 @@ class TelemetryPayload(BaseModel):
     waterTemp: Optional[float] = 0.0
     waterLevel: Optional[float] = 0.0
 
+class BatchTelemetryPayload(BaseModel):
+    items: List[TelemetryPayload]
+
 DEFAULT_CLAMPS = {
     "phUp": (0, 300),
     "phDown": (0, 300),
@@ -23,32 +31,70 @@ DEFAULT_CLAMPS = {
     "refill": (0, 600)
 }
 
+def log_prediction(device_id: str, payload: dict, result: dict):
+    """Queue a prediction for ml_prediction_log (buffered, batched, sampled). Never raises."""
+    prediction_logger.log(device_id, payload, result)
+
 @ml_router.post("/predict")
 def ml_predict(payload: TelemetryPayload):
     data = payload.dict()
+    device_id = data.pop("deviceId", None)
     try:
         result = predict_from_dict(data, clamp_limits=DEFAULT_CLAMPS)
+    except InvalidFeaturesError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"[ML Service] Prediction error: {type(e).__name__}: {str(e)}")
-        import traceback
         logger.error(f"[ML Service] Traceback:\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
 
-    # log prediction
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-        ts = int(time.time()*1000)
-        cur.execute("""
-            INSERT INTO ml_prediction_log ("deviceId", "predictTime", "payloadJson", "predictJson")
-            VALUES (%s, %s, %s, %s);
-        """, ("__unknown__", ts, json.dumps(data), json.dumps(result)))
-        conn.commit()
-        cur.close()
-        release_connection(conn)
-    except Exception:
-        pass
+    log_prediction(device_id, data, result)
 
     return result
+
+
+MAX_BATCH_SIZE = 5000
+
+@ml_router.post("/predict/batch")
+def ml_predict_batch(payload: BatchTelemetryPayload):
+    if len(payload.items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch too large: max {MAX_BATCH_SIZE} items")
+
+    data = [item.dict() for item in payload.items]
+    device_ids = [d.pop("deviceId", None) for d in data]
+    try:
+        results = predict_batch(data, clamp_limits=DEFAULT_CLAMPS)
+    except InvalidFeaturesError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        logger.error(f"[ML Service] Batch prediction error: {type(e).__name__}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # queued for the background writer (one multi-row insert per flush)
+    prediction_logger.log_many(zip(device_ids, data, results))
+
+    return {"count": len(results), "items": results}
+
+
+@ml_router.get("/log/stats")
+def ml_log_stats():
+    """Prediction log buffer: pending rows, flushes, drops and sampling."""
+    return prediction_logger.stats()
+
+
+@ml_router.get("/cache/stats")
+def ml_cache_stats():
+    """Prediction cache: size, hits, misses, hit rate, evictions."""
+    return cache_stats()
+
+
+@ml_router.get("/model")
+def ml_model():
+    """Served model version, last load time/duration and last reload error."""
+    return model_info()
+
+
+@ml_router.post("/model/reload")
+def ml_model_reload():
+    """Check the registry now instead of waiting for the watcher."""
+    return {"reloaded": reload_if_changed(), **model_info()}
@@ -0,0 +1,161 @@
+"""
+Buffered writer for ml_prediction_log.
+
+log() only appends to an in-memory buffer, so prediction latency no longer
+includes a DB round trip and commit. A background thread writes the buffer with
+one multi-row INSERT when ML_LOG_BATCH_SIZE rows are waiting or every
+ML_LOG_FLUSH_INTERVAL seconds, whichever comes first.
+
+- ML_LOG_SAMPLE_RATE (0..1) keeps that fraction of predictions (1 = log all)
+- at most ML_LOG_MAX_PENDING rows are buffered; beyond that new rows are dropped
+  and counted, so a slow or unavailable database cannot grow memory unbounded
+- a failed flush is logged and its rows are counted as dropped (never raises)
+- stop() (API shutdown) flushes what is left
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from psycopg2.extras import execute_values
+from services.api.database import connection
+
+logger = logging.getLogger(__name__)
+
+ML_LOG_SAMPLE_RATE = float(os.getenv("ML_LOG_SAMPLE_RATE", "1.0"))
+ML_LOG_BATCH_SIZE = int(os.getenv("ML_LOG_BATCH_SIZE", "500"))
+ML_LOG_FLUSH_INTERVAL = float(os.getenv("ML_LOG_FLUSH_INTERVAL", "2.0"))  # seconds
+ML_LOG_MAX_PENDING = int(os.getenv("ML_LOG_MAX_PENDING", "50000"))
+
+UNKNOWN_DEVICE = "__unknown__"
+
+_INSERT_SQL = """
+    INSERT INTO ml_prediction_log ("deviceId", "predictTime", "payloadJson", "predictJson")
+    VALUES %s;
+"""
+
+
+class PredictionLogger:
+    def __init__(self, sample_rate, batch_size, flush_interval, max_pending):
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._rows = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._stats = {"logged": 0, "sampledOut": 0, "dropped": 0, "written": 0,
+                       "flushes": 0, "flushErrors": 0, "lastFlushMs": None}
+
+    def log(self, device_id, payload, result):
+        """Queue one prediction. Never blocks on the database and never raises."""
+        self.log_many([(device_id, payload, result)])
+
+    def log_many(self, items):
+        """Queue (device_id, payload, result) tuples, applying the sample rate to each."""
+        items = list(items)
+        ts = int(time.time() * 1000)
+        rows = []
+        for device_id, payload, result in items:
+            if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+                continue
+            try:
+                rows.append((device_id or UNKNOWN_DEVICE, ts, json.dumps(payload), json.dumps(result)))
+            except (TypeError, ValueError) as e:
+                logger.warning(f"[ML LOG] Unserialisable prediction for {device_id}: {e}")
+
+        with self._cond:
+            self._stats["sampledOut"] += len(items) - len(rows)
+            room = max(0, self.max_pending - len(self._rows))
+            if len(rows) > room:
+                self._stats["dropped"] += len(rows) - room
+                rows = rows[:room]
+            if not rows:
+                return
+            self._rows.extend(rows)
+            self._stats["logged"] += len(rows)
+            self._ensure_thread()
+            if len(self._rows) >= self.batch_size:
+                self._cond.notify()
+
+    def _ensure_thread(self):
+        # caller holds self._cond
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="ml-log-writer", daemon=True)
+            self._thread.start()
+
+    def _take(self):
+        with self._cond:
+            rows, self._rows = self._rows, []
+        return rows
+
+    def _write(self, rows):
+        started = time.perf_counter()
+        try:
+            with connection() as conn:
+                cur = conn.cursor()
+                try:
+                    execute_values(cur, _INSERT_SQL, rows, page_size=len(rows))
+                    conn.commit()
+                finally:
+                    cur.close()
+        except Exception as e:
+            logger.error(f"[ML LOG] Failed to write {len(rows)} predictions: {e}")
+            with self._cond:
+                self._stats["flushErrors"] += 1
+                self._stats["dropped"] += len(rows)
+            return
+
+        with self._cond:
+            self._stats["flushes"] += 1
+            self._stats["written"] += len(rows)
+            self._stats["lastFlushMs"] = round((time.perf_counter() - started) * 1000, 2)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._rows) < self.batch_size and not self._stopping:
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            rows = self._take()
+            while rows:
+                # Write in batch_size chunks so a backlog never becomes one huge statement
+                self._write(rows[:self.batch_size])
+                rows = rows[self.batch_size:]
+            if stopping:
+                return
+
+    def flush(self):
+        """Write everything buffered now (in the calling thread)."""
+        rows = self._take()
+        for i in range(0, len(rows), self.batch_size):
+            self._write(rows[i:i + self.batch_size])
+
+    def stop(self, timeout=5.0):
+        """Stop the writer thread after a final flush."""
+        with self._cond:
+            thread = self._thread
+            self._stopping = True
+            self._cond.notify()
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "sampleRate": self.sample_rate,
+                "batchSize": self.batch_size,
+                "flushInterval": self.flush_interval,
+                "pending": len(self._rows),
+                **self._stats,
+            }
+
+
+prediction_logger = PredictionLogger(
+    ML_LOG_SAMPLE_RATE, ML_LOG_BATCH_SIZE, ML_LOG_FLUSH_INTERVAL, ML_LOG_MAX_PENDING
+)
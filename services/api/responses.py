@@ -0,0 +1,138 @@
+"""
+Response helpers for large payloads.
+
+FastJSONResponse renders with orjson when it is installed (falls back to the
+standard json module otherwise). Routes that build big lists return it
+directly, which also skips FastAPI's per-item jsonable_encoder pass.
+
+stream_query() serves a query as NDJSON, CSV or a JSON array through a psycopg2
+server-side (named) cursor, so only STREAM_BATCH_ROWS rows are in memory at a time.
+"""
+import csv
+import io
+import json
+import os
+import uuid
+import psycopg2
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from services.api.database import get_connection, release_connection
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+STREAM_BATCH_ROWS = int(os.getenv("STREAM_BATCH_ROWS", "2000"))
+STREAM_FORMATS = ("ndjson", "csv")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def check_format(fmt: str):
+    """Validate a ?format= value: "json" or one of STREAM_FORMATS."""
+    fmt = (fmt or "json").lower()
+    if fmt != "json" and fmt not in STREAM_FORMATS:
+        raise HTTPException(400, f"Invalid format: use json, {', '.join(STREAM_FORMATS)}")
+    return fmt
+
+
+def _batches(cur, first):
+    if first:
+        yield first
+    while True:
+        rows = cur.fetchmany(STREAM_BATCH_ROWS)
+        if not rows:
+            return
+        yield rows
+
+
+def _ndjson_chunks(batches, columns):
+    for rows in batches:
+        yield b"".join(dumps(dict(zip(columns, r))) + b"\n" for r in rows)
+
+
+def _json_array_chunks(batches, columns):
+    yield b"["
+    sep = b""
+    for rows in batches:
+        yield sep + b",".join(dumps(dict(zip(columns, r))) for r in rows)
+        sep = b","
+    yield b"]"
+
+
+def _csv_chunks(batches, columns):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def _close(conn, cur):
+    try:
+        if cur is not None:
+            cur.close()
+        conn.rollback()
+    except Exception:
+        pass
+    release_connection(conn)
+
+
+def stream_query(query, params, columns, fmt, filename):
+    """
+    StreamingResponse for `query` in `fmt` ("ndjson", "csv" or "json" for one array).
+    The connection is taken and the query run (up to its first batch) before the
+    response starts, so pool exhaustion still answers 503 and SQL errors 500 instead
+    of a truncated 200. The connection is released when the body finishes or is closed.
+    """
+    conn = get_connection()
+    cur = None
+    try:
+        cur = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cur.itersize = STREAM_BATCH_ROWS
+        cur.execute(query, params)
+        first = cur.fetchmany(STREAM_BATCH_ROWS)
+    except psycopg2.Error as e:
+        _close(conn, cur)
+        raise HTTPException(500, str(e))
+    except BaseException:
+        _close(conn, cur)
+        raise
+
+    chunks = {"csv": _csv_chunks, "json": _json_array_chunks}.get(fmt, _ndjson_chunks)
+
+    def generate():
+        try:
+            yield b""  # primed below: a started generator runs finally even if never iterated again
+            yield from chunks(_batches(cur, first), columns)
+        finally:
+            _close(conn, cur)
+
+    body = generate()
+    next(body)
+
+    if fmt == "csv":
+        media_type = "text/csv"
+        headers = {"Content-Disposition": f'attachment; filename="{filename}.csv"'}
+    elif fmt == "json":
+        media_type = "application/json"
+        headers = {}
+    else:
+        media_type = "application/x-ndjson"
+        headers = {}
+    return StreamingResponse(body, media_type=media_type, headers=headers)
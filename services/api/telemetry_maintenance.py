@@ -0,0 +1,665 @@
+"""
+Telemetry storage lifecycle.
+
+telemetry is range-partitioned on "ingestTime" (epoch ms) into one partition per
+UTC day (telemetry_pYYYYMMDD) plus telemetry_default for readings outside any
+day partition (e.g. old backfills). Queries that filter on "ingestTime" only
+touch the matching partitions, and retention (opt-in, TELEMETRY_RETENTION_DAYS)
+is a DROP of whole partitions instead of a DELETE over the heap.
+
+A partitioned table cannot carry a UNIQUE("payloadHash") that spans partitions,
+so deduplication moves to telemetry_dedup (one row per hash, pruned with the
+same retention).
+
+Raw readings are also rolled up into telemetry_rollup_1m and telemetry_rollup_1h
+(samples, min/max/avg per sensor per device). Rollups advance from a stored
+watermark and re-scan a short window behind it for readings still in flight.
+Readings that arrive later than that (bulk backfills with ts, delayed forwards)
+are recorded by mark_late_readings() in telemetry_rollup_dirty at ingest; each
+pass re-aggregates those (deviceId, minute) buckets and their hours.
+
+ensure_telemetry_storage() is part of the baseline migration and creates the
+layout on a fresh database. A legacy (unpartitioned) telemetry table is converted
+by a later, separate migration step (migrations._convert_legacy_telemetry) that
+attaches it as the first partition without holding locks for long. run_maintenance() creates
+upcoming partitions, refreshes rollups and applies retention; the API runs it
+every TELEMETRY_MAINTENANCE_INTERVAL seconds.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from datetime import datetime, timezone
+from psycopg2.extras import execute_values
+from services.api.telemetry_store import SENSOR_FIELDS
+
+logger = logging.getLogger(__name__)
+
+DAY_MS = 24 * 60 * 60 * 1000
+MINUTE_MS = 60 * 1000
+HOUR_MS = 60 * MINUTE_MS
+
+# Raw telemetry kept this many days; opt-in, 0 = keep forever (the legacy partition is never dropped)
+TELEMETRY_RETENTION_DAYS = int(os.getenv("TELEMETRY_RETENTION_DAYS", "0"))
+# Rollups are far smaller; 1h rollups are kept forever by default
+ROLLUP_1M_RETENTION_DAYS = int(os.getenv("ROLLUP_1M_RETENTION_DAYS", "90"))
+ROLLUP_1H_RETENTION_DAYS = int(os.getenv("ROLLUP_1H_RETENTION_DAYS", "0"))
+# Day partitions created ahead of time
+TELEMETRY_PARTITIONS_AHEAD = int(os.getenv("TELEMETRY_PARTITIONS_AHEAD", "3"))
+TELEMETRY_MAINTENANCE_INTERVAL = int(os.getenv("TELEMETRY_MAINTENANCE_INTERVAL", "60"))  # seconds
+# Rollups re-scan this far behind their watermark to pick up late readings
+ROLLUP_LATE_MS = int(os.getenv("ROLLUP_LATE_MS", str(5 * MINUTE_MS)))
+# Upper bound of raw time processed per rollup statement (keeps transactions short while catching up)
+ROLLUP_CHUNK_MS = int(os.getenv("ROLLUP_CHUNK_MS", str(6 * HOUR_MS)))
+ROLLUP_MAX_CHUNKS = int(os.getenv("ROLLUP_MAX_CHUNKS", "24"))
+# Readings older than this when inserted fall outside the rescan window and are marked dirty
+ROLLUP_DIRTY_AFTER_MS = ROLLUP_LATE_MS // 2
+# Dirty (deviceId, minute) buckets re-aggregated per pass
+ROLLUP_DIRTY_BATCH = int(os.getenv("ROLLUP_DIRTY_BATCH", "50000"))
+# Rows per DELETE when pruning non-partitioned tables
+PRUNE_BATCH = 10000
+
+# Advisory lock key so only one API worker runs maintenance at a time
+_MAINTENANCE_LOCK_KEY = 0x74656C65  # "tele"
+
+_PARTITION_RE = re.compile(r"^telemetry_p(\d{8})$")
+_UPPER_BOUND_RE = re.compile(r"TO \('?(-?\d+)'?\)")
+
+_last_run = {"at": None, "seconds": None, "created": [], "dropped": [], "error": None}
+
+
+def _day_start(ms):
+    return ms - ms % DAY_MS
+
+
+def _partition_name(day_start_ms):
+    return "telemetry_p" + datetime.fromtimestamp(day_start_ms / 1000, tz=timezone.utc).strftime("%Y%m%d")
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _rollup_columns(kind):
+    # kind: "Min" | "Max" | "Avg" -> ['"ppmMin"', ...]
+    return [f'"{s}{kind}"' for s in SENSOR_FIELDS]
+
+
+# SCHEMA
+def _relkind(cur, name):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (name,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def create_partitioned_parent(cur):
+    cur.execute("""
+        CREATE TABLE telemetry (
+            "rowId" TEXT NOT NULL,
+            "deviceId" TEXT NOT NULL,
+            "ingestTime" BIGINT NOT NULL,
+            "payloadJson" JSONB,
+            ppm FLOAT,
+            ph FLOAT,
+            "tempC" FLOAT,
+            humidity FLOAT,
+            "waterTemp" FLOAT,
+            "waterLevel" FLOAT,
+            "payloadHash" TEXT
+        ) PARTITION BY RANGE ("ingestTime");
+    """)
+
+
+def ensure_telemetry_storage(cur):
+    """
+    Create the partitioned telemetry layout plus dedup/rollup tables.
+    Runs inside the caller's migration transaction. A legacy (unpartitioned)
+    telemetry table is left as it is here; its conversion is its own migration step.
+    """
+    kind = _relkind(cur, "telemetry")
+
+    if kind is None:
+        create_partitioned_parent(cur)
+        logger.info("[DB] telemetry created as a partitioned table")
+
+    # Typed columns are authoritative; the JSON copy is optional (TELEMETRY_STORE_JSON).
+    # A legacy heap gets this in the conversion's swap (here it would hold ACCESS EXCLUSIVE
+    # for the rest of the baseline transaction)
+    if kind != "r":
+        cur.execute('ALTER TABLE telemetry ALTER COLUMN "payloadJson" DROP NOT NULL;')
+
+    # idx_telemetry_device_time is built concurrently by a later migration step
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS telemetry_dedup (
+            "payloadHash" TEXT PRIMARY KEY,
+            "ingestTime" BIGINT NOT NULL
+        );
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_telemetry_dedup_time ON telemetry_dedup ("ingestTime");
+    """)
+
+    for table in ("telemetry_rollup_1m", "telemetry_rollup_1h"):
+        sensor_cols = ",\n".join(
+            f'"{s}Min" FLOAT, "{s}Max" FLOAT, "{s}Avg" FLOAT' for s in SENSOR_FIELDS
+        )
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                "deviceId" TEXT NOT NULL,
+                "bucketStart" BIGINT NOT NULL,
+                samples INT NOT NULL,
+                {sensor_cols},
+                PRIMARY KEY ("deviceId", "bucketStart")
+            );
+        """)
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table} ("bucketStart");
+        """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS telemetry_rollup_state (
+            name TEXT PRIMARY KEY,
+            watermark BIGINT NOT NULL
+        );
+    """)
+
+    if kind != "r":
+        ensure_partitions(cur)
+        ensure_default_partition(cur)
+
+
+def ensure_default_partition(cur):
+    # Created after the day partitions: creating a day partition has to scan the default one
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS telemetry_default PARTITION OF telemetry DEFAULT;
+    """)
+
+
+# PARTITIONS
+def _partitions(cur):
+    """Return [(name, upperBound or None)] for every attached partition of telemetry."""
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'telemetry'::regclass;
+    """)
+    result = []
+    for name, bound in cur.fetchall():
+        m = _UPPER_BOUND_RE.search(bound or "")
+        result.append((name, int(m.group(1)) if m else None))
+    return result
+
+
+def ensure_partitions(cur, now_ms=None):
+    """Create day partitions from today through TELEMETRY_PARTITIONS_AHEAD days ahead."""
+    now_ms = now_ms or _now_ms()
+    existing = _partitions(cur)
+    names = {name for name, _ in existing}
+    # Nothing below the highest bounded partition may be re-created (legacy covers MINVALUE..)
+    covered_to = max((upper for _, upper in existing if upper is not None), default=None)
+    has_default = "telemetry_default" in names
+
+    created = []
+    for offset in range(TELEMETRY_PARTITIONS_AHEAD + 1):
+        start = _day_start(now_ms) + offset * DAY_MS
+        end = start + DAY_MS
+        name = _partition_name(start)
+        if name in names or (covered_to is not None and start < covered_to):
+            continue
+
+        if has_default:
+            # Rows that landed in the default partition for this day must move with it
+            cur.execute("""
+                SELECT 1 FROM telemetry_default
+                WHERE "ingestTime" >= %s AND "ingestTime" < %s LIMIT 1;
+            """, (start, end))
+            if cur.fetchone():
+                cur.execute("CREATE TEMP TABLE IF NOT EXISTS _telemetry_moved (LIKE telemetry) ON COMMIT DROP;")
+                cur.execute("""
+                    WITH moved AS (
+                        DELETE FROM telemetry_default
+                        WHERE "ingestTime" >= %s AND "ingestTime" < %s
+                        RETURNING *
+                    )
+                    INSERT INTO _telemetry_moved SELECT * FROM moved;
+                """, (start, end))
+                cur.execute(f"CREATE TABLE {name} PARTITION OF telemetry FOR VALUES FROM (%s) TO (%s);", (start, end))
+                cur.execute("INSERT INTO telemetry SELECT * FROM _telemetry_moved;")
+                cur.execute("TRUNCATE _telemetry_moved;")
+                created.append(name)
+                continue
+
+        cur.execute(f"CREATE TABLE {name} PARTITION OF telemetry FOR VALUES FROM (%s) TO (%s);", (start, end))
+        created.append(name)
+
+    if created:
+        logger.info(f"[MAINTENANCE] Created partitions: {', '.join(created)}")
+    return created
+
+
+# RETENTION
+def _prune(cur, table, column, cutoff):
+    """Batched DELETE of rows older than cutoff from a non-partitioned table."""
+    total = 0
+    while True:
+        cur.execute(f"""
+            DELETE FROM {table} WHERE ctid IN (
+                SELECT ctid FROM {table} WHERE {column} < %s LIMIT %s
+            );
+        """, (cutoff, PRUNE_BATCH))
+        total += cur.rowcount
+        if cur.rowcount < PRUNE_BATCH:
+            return total
+
+
+def apply_retention(cur, now_ms=None):
+    """
+    Drop day partitions that lie entirely before the retention cutoff, and prune
+    dedup, default-partition and rollup rows. telemetry_legacy (pre-partitioning
+    history) is left alone; drop it by hand once it is no longer needed.
+    """
+    now_ms = now_ms or _now_ms()
+    dropped = []
+
+    if TELEMETRY_RETENTION_DAYS > 0:
+        cutoff = _day_start(now_ms) - TELEMETRY_RETENTION_DAYS * DAY_MS
+
+        for name, upper in _partitions(cur):
+            if name == "telemetry_default" or upper is None or upper > cutoff:
+                continue
+            if not _PARTITION_RE.match(name):
+                continue
+            cur.execute(f"ALTER TABLE telemetry DETACH PARTITION {name};")
+            cur.execute(f"DROP TABLE {name};")
+            dropped.append(name)
+
+        _prune(cur, "telemetry_default", '"ingestTime"', cutoff)
+        _prune(cur, "telemetry_dedup", '"ingestTime"', cutoff)
+
+    if ROLLUP_1M_RETENTION_DAYS > 0:
+        _prune(cur, "telemetry_rollup_1m", '"bucketStart"', now_ms - ROLLUP_1M_RETENTION_DAYS * DAY_MS)
+    if ROLLUP_1H_RETENTION_DAYS > 0:
+        _prune(cur, "telemetry_rollup_1h", '"bucketStart"', now_ms - ROLLUP_1H_RETENTION_DAYS * DAY_MS)
+
+    if dropped:
+        logger.info(f"[MAINTENANCE] Dropped expired partitions: {', '.join(dropped)}")
+    return dropped
+
+
+# ROLLUPS
+def _get_watermark(cur, name):
+    cur.execute("SELECT watermark FROM telemetry_rollup_state WHERE name = %s;", (name,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _set_watermark(cur, name, value):
+    cur.execute("""
+        INSERT INTO telemetry_rollup_state (name, watermark) VALUES (%s, %s)
+        ON CONFLICT (name) DO UPDATE SET watermark = EXCLUDED.watermark;
+    """, (name, value))
+
+
+def _upsert_clause():
+    cols = ["samples"] + _rollup_columns("Min") + _rollup_columns("Max") + _rollup_columns("Avg")
+    return ",\n".join(f"{c} = EXCLUDED.{c}" for c in cols)
+
+
+def _raw_aggregates(prefix=""):
+    return ",\n".join(f'MIN({prefix}"{s}"), MAX({prefix}"{s}"), AVG({prefix}"{s}")' for s in SENSOR_FIELDS)
+
+
+def _rollup_aggregates(prefix=""):
+    # Sample-weighted average; a sensor missing from a bucket has a NULL Avg and no weight
+    return ",\n".join(
+        f'MIN({prefix}"{s}Min"), MAX({prefix}"{s}Max"), '
+        f'SUM({prefix}"{s}Avg" * {prefix}samples) / '
+        f'NULLIF(SUM(CASE WHEN {prefix}"{s}Avg" IS NOT NULL THEN {prefix}samples END), 0)'
+        for s in SENSOR_FIELDS
+    )
+
+
+def _rollup_raw_1m(cur, start, end):
+    aggregates = _raw_aggregates()
+    columns = ", ".join(f'"{s}Min", "{s}Max", "{s}Avg"' for s in SENSOR_FIELDS)
+    cur.execute(f"""
+        INSERT INTO telemetry_rollup_1m ("deviceId", "bucketStart", samples, {columns})
+        SELECT "deviceId", "ingestTime" - "ingestTime" %% {MINUTE_MS}, COUNT(*),
+               {aggregates}
+        FROM telemetry
+        WHERE "ingestTime" >= %s AND "ingestTime" < %s
+        GROUP BY 1, 2
+        ON CONFLICT ("deviceId", "bucketStart") DO UPDATE SET
+            {_upsert_clause()};
+    """, (start, end))
+
+
+def _rollup_1m_1h(cur, start, end):
+    aggregates = _rollup_aggregates()
+    columns = ", ".join(f'"{s}Min", "{s}Max", "{s}Avg"' for s in SENSOR_FIELDS)
+    cur.execute(f"""
+        INSERT INTO telemetry_rollup_1h ("deviceId", "bucketStart", samples, {columns})
+        SELECT "deviceId", "bucketStart" - "bucketStart" %% {HOUR_MS}, SUM(samples),
+               {aggregates}
+        FROM telemetry_rollup_1m
+        WHERE "bucketStart" >= %s AND "bucketStart" < %s
+        GROUP BY 1, 2
+        ON CONFLICT ("deviceId", "bucketStart") DO UPDATE SET
+            {_upsert_clause()};
+    """, (start, end))
+
+
+def _advance(cur, name, bucket_ms, target, initial_fn, rollup_fn):
+    """
+    Run rollup_fn over [watermark - ROLLUP_LATE_MS, target) in ROLLUP_CHUNK_MS
+    pieces (at most ROLLUP_MAX_CHUNKS per call) and move the watermark forward.
+    initial_fn() gives the starting point the first time a rollup runs.
+    """
+    target -= target % bucket_ms
+    watermark = _get_watermark(cur, name)
+    if watermark is None:
+        initial = initial_fn()
+        if initial is None:
+            initial = target
+        watermark = initial - initial % bucket_ms
+
+    start = max(0, watermark - ROLLUP_LATE_MS)
+    start -= start % bucket_ms
+    chunks = 0
+    while start < target and chunks < ROLLUP_MAX_CHUNKS:
+        end = min(target, start + ROLLUP_CHUNK_MS)
+        rollup_fn(cur, start, end)
+        start = end
+        chunks += 1
+
+    if start > watermark:
+        _set_watermark(cur, name, start)
+    return start
+
+
+# LATE READINGS
+def mark_late_readings(cur, readings, now_ms=None):
+    """
+    Record the 1m buckets of (deviceId, ingestTime) readings that are too old for the
+    rollup rescan window, in the caller's ingest transaction. Returns the bucket count.
+    """
+    now_ms = now_ms or _now_ms()
+    late = {
+        (device_id, ingest_time - ingest_time % MINUTE_MS)
+        for device_id, ingest_time in readings
+        if ingest_time < now_ms - ROLLUP_DIRTY_AFTER_MS
+    }
+    if late:
+        # Sorted so concurrent ingest transactions lock rows in the same order
+        execute_values(cur, """
+            INSERT INTO telemetry_rollup_dirty ("deviceId", "bucketStart")
+            VALUES %s
+            ON CONFLICT DO NOTHING;
+        """, sorted(late))
+    return len(late)
+
+
+def _reroll_dirty(cur):
+    """
+    Re-aggregate up to ROLLUP_DIRTY_BATCH dirty minutes into telemetry_rollup_1m and
+    their hours into telemetry_rollup_1h. Claiming (DELETE) and re-aggregating share the
+    maintenance transaction, so readers see either the old marks or the new rollups.
+    """
+    cur.execute("""
+        DELETE FROM telemetry_rollup_dirty
+        WHERE ("deviceId", "bucketStart") IN (
+            SELECT "deviceId", "bucketStart" FROM telemetry_rollup_dirty
+            ORDER BY "bucketStart"
+            LIMIT %s
+        )
+        RETURNING "deviceId", "bucketStart";
+    """, (ROLLUP_DIRTY_BATCH,))
+    minutes = cur.fetchall()
+    if not minutes:
+        return 0
+
+    columns = ", ".join(f'"{s}Min", "{s}Max", "{s}Avg"' for s in SENSOR_FIELDS)
+    cur.execute(f"""
+        INSERT INTO telemetry_rollup_1m ("deviceId", "bucketStart", samples, {columns})
+        SELECT d."deviceId", d."bucketStart", COUNT(*),
+               {_raw_aggregates("t.")}
+        FROM unnest(%s::text[], %s::bigint[]) AS d ("deviceId", "bucketStart")
+        JOIN telemetry t
+          ON t."deviceId" = d."deviceId"
+         AND t."ingestTime" >= d."bucketStart" AND t."ingestTime" < d."bucketStart" + {MINUTE_MS}
+        GROUP BY 1, 2
+        ON CONFLICT ("deviceId", "bucketStart") DO UPDATE SET
+            {_upsert_clause()};
+    """, ([m[0] for m in minutes], [m[1] for m in minutes]))
+
+    hours = sorted({(device_id, bucket - bucket % HOUR_MS) for device_id, bucket in minutes})
+    cur.execute(f"""
+        INSERT INTO telemetry_rollup_1h ("deviceId", "bucketStart", samples, {columns})
+        SELECT h."deviceId", h."bucketStart", SUM(r.samples),
+               {_rollup_aggregates("r.")}
+        FROM unnest(%s::text[], %s::bigint[]) AS h ("deviceId", "bucketStart")
+        JOIN telemetry_rollup_1m r
+          ON r."deviceId" = h."deviceId"
+         AND r."bucketStart" >= h."bucketStart" AND r."bucketStart" < h."bucketStart" + {HOUR_MS}
+        GROUP BY 1, 2
+        ON CONFLICT ("deviceId", "bucketStart") DO UPDATE SET
+            {_upsert_clause()};
+    """, ([h[0] for h in hours], [h[1] for h in hours]))
+
+    logger.info(f"[MAINTENANCE] Re-rolled {len(minutes)} late minute buckets ({len(hours)} hours)")
+    return len(minutes)
+
+
+def _min_value(cur, table, column, lower):
+    cur.execute(f'SELECT MIN({column}) FROM {table} WHERE {column} >= %s;', (lower,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def refresh_rollups(cur, now_ms=None):
+    """
+    Bring 1m rollups up to the last complete minute, re-roll buckets that received late
+    readings, then bring 1h rollups up to the 1m watermark.
+    """
+    now_ms = now_ms or _now_ms()
+    cutoff = _day_start(now_ms) - TELEMETRY_RETENTION_DAYS * DAY_MS if TELEMETRY_RETENTION_DAYS > 0 else 0
+
+    wm_1m = _advance(
+        cur, "1m", MINUTE_MS, now_ms,
+        lambda: _min_value(cur, "telemetry", '"ingestTime"', cutoff),
+        _rollup_raw_1m
+    )
+    _reroll_dirty(cur)
+    wm_1h = _advance(
+        cur, "1h", HOUR_MS, wm_1m,
+        lambda: _min_value(cur, "telemetry_rollup_1m", '"bucketStart"', 0),
+        _rollup_1m_1h
+    )
+    return wm_1m, wm_1h
+
+
+# READS
+def _ceil(ms, granularity):
+    return -(-ms // granularity) * granularity
+
+
+def _watermarks(cur):
+    cur.execute("SELECT name, watermark FROM telemetry_rollup_state;")
+    return dict(cur.fetchall())
+
+
+def _dirty_hours(cur, device_id, start, end):
+    """Sorted hour starts in [start, end) with late readings not yet re-rolled."""
+    cur.execute(f"""
+        SELECT DISTINCT "bucketStart" - "bucketStart" %% {HOUR_MS}
+        FROM telemetry_rollup_dirty
+        WHERE "deviceId" = %s AND "bucketStart" >= %s AND "bucketStart" < %s
+        ORDER BY 1;
+    """, (device_id, start - start % HOUR_MS, end))
+    return [r[0] for r in cur.fetchall()]
+
+
+def read_buckets(cur, device_id, start, end, bucket_ms, limit):
+    """
+    Aggregate a device's readings into bucket_ms buckets over [start, end), newest first.
+    Returns rows of (bucketStart, samples, mins, maxs, avgs) with one value per sensor
+    in SENSOR_FIELDS order.
+
+    Time covered by complete rollups is read from them (1h, then 1m, when bucket_ms is a
+    multiple of the rollup size); only the rest, typically the last minute or two, is
+    aggregated from raw telemetry. Hours with late readings that the next maintenance
+    pass has not re-rolled yet are also read raw, so they match raw history.
+    """
+    watermarks = _watermarks(cur)
+    layers = [
+        ("telemetry_rollup_1h", HOUR_MS, watermarks.get("1h")),
+        ("telemetry_rollup_1m", MINUTE_MS, watermarks.get("1m")),
+    ]
+
+    segments = []  # (source table or None for raw, lo, hi)
+    uncovered = []
+    lo = start
+    for hour in _dirty_hours(cur, device_id, start, end):
+        seg_lo, seg_hi = max(hour, start), min(hour + HOUR_MS, end)
+        segments.append((None, seg_lo, seg_hi))
+        if lo < seg_lo:
+            uncovered.append((lo, seg_lo))
+        lo = max(lo, seg_hi)
+    if lo < end:
+        uncovered.append((lo, end))
+
+    for table, granularity, watermark in layers:
+        if watermark is None or bucket_ms % granularity:
+            continue
+        remaining = []
+        for lo, hi in uncovered:
+            seg_lo, seg_hi = _ceil(lo, granularity), min(hi, watermark)
+            if seg_lo < seg_hi:
+                segments.append((table, seg_lo, seg_hi))
+                if lo < seg_lo:
+                    remaining.append((lo, seg_lo))
+                if seg_hi < hi:
+                    remaining.append((seg_hi, hi))
+            else:
+                remaining.append((lo, hi))
+        uncovered = remaining
+    segments.extend((None, lo, hi) for lo, hi in uncovered)
+
+    rollup_cols = ", ".join(f'"{s}Min", "{s}Max", "{s}Avg"' for s in SENSOR_FIELDS)
+    raw_cols = ", ".join(f'MIN("{s}"), MAX("{s}"), AVG("{s}")' for s in SENSOR_FIELDS)
+    parts, params = [], []
+    for table, lo, hi in segments:
+        if table is None:
+            parts.append(f"""
+                SELECT "ingestTime" - "ingestTime" %% {int(bucket_ms)} AS t, COUNT(*) AS samples, {raw_cols}
+                FROM telemetry
+                WHERE "deviceId" = %s AND "ingestTime" >= %s AND "ingestTime" < %s
+                GROUP BY 1
+            """)
+        else:
+            parts.append(f"""
+                SELECT "bucketStart" AS t, samples, {rollup_cols}
+                FROM {table}
+                WHERE "deviceId" = %s AND "bucketStart" >= %s AND "bucketStart" < %s
+            """)
+        params += [device_id, lo, hi]
+
+    mins = ", ".join(f'MIN("{s}Min")' for s in SENSOR_FIELDS)
+    maxs = ", ".join(f'MAX("{s}Max")' for s in SENSOR_FIELDS)
+    avgs = ", ".join(
+        f'SUM("{s}Avg" * samples) / NULLIF(SUM(CASE WHEN "{s}Avg" IS NOT NULL THEN samples END), 0)'
+        for s in SENSOR_FIELDS
+    )
+    src_cols = ", ".join(f'"{s}Min", "{s}Max", "{s}Avg"' for s in SENSOR_FIELDS)
+    cur.execute(f"""
+        SELECT t - t %% {int(bucket_ms)} AS bucket, SUM(samples), {mins}, {maxs}, {avgs}
+        FROM (
+            {" UNION ALL ".join(parts)}
+        ) AS src (t, samples, {src_cols})
+        GROUP BY 1
+        ORDER BY 1 DESC
+        LIMIT %s;
+    """, (*params, limit))
+
+    n = len(SENSOR_FIELDS)
+    return [
+        (r[0], int(r[1]), r[2:2 + n], r[2 + n:2 + 2 * n], r[2 + 2 * n:2 + 3 * n])
+        for r in cur.fetchall()
+    ]
+
+
+# JOB
+def run_maintenance(conn):
+    """
+    One maintenance pass on the given connection. Each step is its own
+    transaction and is skipped if another worker is running the same step.
+    """
+    started = time.monotonic()
+    cur = conn.cursor()
+    created, dropped = [], []
+    error = None
+
+    steps = (
+        ("partitions", lambda: created.extend(ensure_partitions(cur))),
+        ("rollups", lambda: refresh_rollups(cur)),
+        ("retention", lambda: dropped.extend(apply_retention(cur))),
+    )
+
+    try:
+        for step, fn in steps:
+            try:
+                cur.execute("SELECT pg_try_advisory_xact_lock(%s);", (_MAINTENANCE_LOCK_KEY,))
+                if not cur.fetchone()[0]:
+                    conn.rollback()
+                    continue
+                fn()
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                error = f"{step}: {e}"
+                logger.error(f"[MAINTENANCE] {step} failed: {e}")
+    finally:
+        cur.close()
+
+    _last_run.update({
+        "at": _now_ms(),
+        "seconds": round(time.monotonic() - started, 3),
+        "created": created,
+        "dropped": dropped,
+        "error": error,
+    })
+    return dict(_last_run)
+
+
+def maintenance_stats():
+    return {
+        "interval": TELEMETRY_MAINTENANCE_INTERVAL,
+        "retentionDays": TELEMETRY_RETENTION_DAYS,
+        "rollup1mRetentionDays": ROLLUP_1M_RETENTION_DAYS,
+        "rollup1hRetentionDays": ROLLUP_1H_RETENTION_DAYS,
+        "lastRun": dict(_last_run),
+    }
+
+
+async def maintenance_loop():
+    """Background task: run_maintenance every TELEMETRY_MAINTENANCE_INTERVAL seconds."""
+    from services.api.database import connection
+
+    def run_once():
+        with connection() as conn:
+            return run_maintenance(conn)
+
+    logger.info(f"[MAINTENANCE] Telemetry maintenance started (interval: {TELEMETRY_MAINTENANCE_INTERVAL}s)")
+    try:
+        while True:
+            try:
+                await asyncio.to_thread(run_once)
+            except Exception as e:
+                logger.error(f"[MAINTENANCE] Pass failed: {e}")
+            await asyncio.sleep(TELEMETRY_MAINTENANCE_INTERVAL)
+    except asyncio.CancelledError:
+        logger.info("[MAINTENANCE] Telemetry maintenance stopped")
+        raise
@@ -0,0 +1,155 @@
+"""
+Latest-telemetry projection.
+
+telemetry_latest holds one row per device and is upserted together with every
+new telemetry row, so "latest reading" lookups are a primary-key read instead
+of an ORDER BY "ingestTime" DESC LIMIT 1 over the whole history.
+A small in-process cache sits in front of it.
+
+The typed sensor columns of telemetry are the source of truth for all readers.
+The "payloadJson" copy is only written when TELEMETRY_STORE_JSON is enabled.
+"""
+import json
+import os
+import time
+from threading import Lock
+from psycopg2.extras import execute_values
+
+SENSOR_FIELDS = ["ppm", "ph", "tempC", "humidity", "waterTemp", "waterLevel"]
+
+# Seconds a cached latest value is trusted (bounds staleness across API workers)
+LATEST_CACHE_TTL = float(os.getenv("LATEST_CACHE_TTL", "10"))
+
+# Also keep the raw payload as JSONB next to the typed columns (set "false" for smaller rows)
+TELEMETRY_STORE_JSON = os.getenv("TELEMETRY_STORE_JSON", "true").lower() == "true"
+
+_cache = {}  # deviceId -> (cachedAt, ingestTime, values)
+_cache_lock = Lock()
+
+
+def payload_json(payload_dict):
+    """Value for telemetry."payloadJson": the serialized payload, or NULL when JSON storage is off."""
+    return json.dumps(payload_dict) if TELEMETRY_STORE_JSON else None
+
+
+_UPSERT_LATEST_SQL = """
+    INSERT INTO telemetry_latest (
+        "deviceId", "ingestTime",
+        ppm, ph, "tempC", humidity, "waterTemp", "waterLevel"
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT ("deviceId") DO UPDATE SET
+        "ingestTime" = EXCLUDED."ingestTime",
+        ppm = EXCLUDED.ppm,
+        ph = EXCLUDED.ph,
+        "tempC" = EXCLUDED."tempC",
+        humidity = EXCLUDED.humidity,
+        "waterTemp" = EXCLUDED."waterTemp",
+        "waterLevel" = EXCLUDED."waterLevel"
+    WHERE telemetry_latest."ingestTime" <= EXCLUDED."ingestTime";
+"""
+
+_SELECT_LATEST_SQL = """
+    SELECT "ingestTime", ppm, ph, "tempC", humidity, "waterTemp", "waterLevel"
+    FROM telemetry_latest
+    WHERE "deviceId" = %s;
+"""
+
+
+def upsert_latest(cur, device_id, ingest_time, values):
+    """Advance the projection row for a device. Older readings never overwrite newer ones."""
+    cur.execute(_UPSERT_LATEST_SQL, (device_id, ingest_time, *[values.get(k) for k in SENSOR_FIELDS]))
+
+
+async def upsert_latest_async(cur, device_id, ingest_time, values):
+    """upsert_latest for an async (psycopg 3) cursor."""
+    await cur.execute(_UPSERT_LATEST_SQL, (device_id, ingest_time, *[values.get(k) for k in SENSOR_FIELDS]))
+
+
+def upsert_latest_many(cur, latest_by_device):
+    """
+    Multi-row variant of upsert_latest.
+    latest_by_device: {deviceId: (ingestTime, values)} with at most one reading per device.
+    """
+    if not latest_by_device:
+        return
+
+    execute_values(cur, """
+        INSERT INTO telemetry_latest (
+            "deviceId", "ingestTime",
+            ppm, ph, "tempC", humidity, "waterTemp", "waterLevel"
+        )
+        VALUES %s
+        ON CONFLICT ("deviceId") DO UPDATE SET
+            "ingestTime" = EXCLUDED."ingestTime",
+            ppm = EXCLUDED.ppm,
+            ph = EXCLUDED.ph,
+            "tempC" = EXCLUDED."tempC",
+            humidity = EXCLUDED.humidity,
+            "waterTemp" = EXCLUDED."waterTemp",
+            "waterLevel" = EXCLUDED."waterLevel"
+        WHERE telemetry_latest."ingestTime" <= EXCLUDED."ingestTime";
+    """, [
+        (device_id, ingest_time, *[values.get(k) for k in SENSOR_FIELDS])
+        for device_id, (ingest_time, values) in latest_by_device.items()
+    ])
+
+
+def remember_latest(device_id, ingest_time, values):
+    """Update the in-process cache. Call only after the upsert has been committed."""
+    with _cache_lock:
+        current = _cache.get(device_id)
+        if current and current[1] > ingest_time:
+            return
+        _cache[device_id] = (time.monotonic(), ingest_time, {k: values.get(k) for k in SENSOR_FIELDS})
+
+
+def forget_latest(device_ids):
+    """Drop cached values (e.g. after a backfill whose timestamps may be older than the projection)."""
+    with _cache_lock:
+        for device_id in device_ids:
+            _cache.pop(device_id, None)
+
+
+def _cached_latest(device_id):
+    with _cache_lock:
+        cached = _cache.get(device_id)
+    if cached and time.monotonic() - cached[0] < LATEST_CACHE_TTL:
+        return cached[1], dict(cached[2])
+    return None
+
+
+def _store_latest_row(device_id, row):
+    values = dict(zip(SENSOR_FIELDS, row[1:]))
+    with _cache_lock:
+        _cache[device_id] = (time.monotonic(), row[0], values)
+    return row[0], dict(values)
+
+
+def fetch_latest(cur, device_id):
+    """
+    Return (ingestTime, {sensor: value}) for the newest reading of a device,
+    or None if the device has no telemetry yet.
+    """
+    cached = _cached_latest(device_id)
+    if cached:
+        return cached
+
+    cur.execute(_SELECT_LATEST_SQL, (device_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return _store_latest_row(device_id, row)
+
+
+async def fetch_latest_async(cur, device_id):
+    """fetch_latest for an async (psycopg 3) cursor."""
+    cached = _cached_latest(device_id)
+    if cached:
+        return cached
+
+    await cur.execute(_SELECT_LATEST_SQL, (device_id,))
+    row = await cur.fetchone()
+    if not row:
+        return None
+    return _store_latest_row(device_id, row)
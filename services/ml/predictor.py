@@ -1,8 +1,11 @@
 import os
+import re
+import time
 import joblib
 import numpy as np
 import logging
-from threading import Lock
+from collections import OrderedDict, namedtuple
+from threading import Event, Lock, Thread
 import json
 import warnings
 
@@ -24,93 +27,343 @@ MODEL_REGISTRY = os.path.join(_CURRENT_DIR, "model_registry")
 
 _TELEMETRY_FEATURES = ["ppm", "ph", "tempC", "humidity", "waterTemp", "waterLevel"]
 _TARGETS = ["phUp", "phDown", "nutrientAdd", "refill"]
+# Sensor resolution per feature; prediction cache keys are quantized to this
+# (the model itself always sees the unrounded input)
+_FEATURE_RESOLUTION = np.array([1.0, 0.01, 0.1, 0.1, 0.1, 0.1])
+
+# Prediction cache: raw model output per (model version, quantized features).
+# Auto mode re-predicts every kit each cycle, usually on unchanged telemetry.
+PREDICT_CACHE_SIZE = int(os.getenv("PREDICT_CACHE_SIZE", "10000"))  # 0 disables
+PREDICT_CACHE_TTL = float(os.getenv("PREDICT_CACHE_TTL", "300"))  # seconds
+# Registry poll interval for hot reload (0 disables the watcher)
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "10"))  # seconds
+# A model.pkl modified more recently than this is assumed to be still being written
+MODEL_SETTLE_SECONDS = float(os.getenv("MODEL_SETTLE_SECONDS", "2"))
+
+# Everything a prediction needs, swapped as one object so a request never mixes
+# the model of one version with the scaler of another. signature identifies the
+# files on disk (version + model.pkl mtime) and is also the prediction cache key.
+_Bundle = namedtuple("_Bundle", "model scaler meta version signature")
+
+_bundle = None
+_lock = Lock()  # serialises loads; predictions never take it once a bundle exists
+_load_state = {"loadedAt": None, "loadSeconds": None, "reloads": 0, "lastError": None, "failedSignature": None}
+
+_watcher = None
+_watcher_stop = Event()
+
+
+class InvalidFeaturesError(ValueError):
+    """Telemetry that cannot be fed to the model (NaN or infinite values)."""
+
+_cache = OrderedDict()  # (signature, features) -> (raw output row, expiresAt)
+_cache_lock = Lock()
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+
+# MODEL LOADING
+def _version_sort_key(name):
+    # Natural order: v9 < v10, v20251215T203622Z < v20260101T000000Z
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def _resolve_latest():
+    """(version, version_dir) the registry currently points at."""
+    latest_marker = os.path.join(MODEL_REGISTRY, "LATEST")
+
+    # Check if LATEST file exists
+    if os.path.exists(latest_marker):
+        with open(latest_marker, "r") as f:
+            version = f.read().strip()
+        return version, os.path.join(MODEL_REGISTRY, version)
+
+    # Otherwise the highest versioned subdirectory (by name; mtimes change on copy/restore)
+    candidates = [
+        d for d in os.listdir(MODEL_REGISTRY)
+        if d.startswith("v") and os.path.isfile(os.path.join(MODEL_REGISTRY, d, "model.pkl"))
+    ]
+    if candidates:
+        version = max(candidates, key=_version_sort_key)
+        return version, os.path.join(MODEL_REGISTRY, version)
+
+    # Fallback to direct model files
+    if os.path.exists(os.path.join(MODEL_REGISTRY, "model.pkl")):
+        return "direct", MODEL_REGISTRY
+
+    raise RuntimeError("No model found in registry.")
+
+
+def _signature(version, version_dir):
+    return version, os.path.getmtime(os.path.join(version_dir, "model.pkl"))
+
+
+def _load_bundle(version, version_dir):
+    """Load and warm a bundle without touching the one being served."""
+    signature = _signature(version, version_dir)
+    model_path = os.path.join(version_dir, "model.pkl")
+    scaler_path = os.path.join(version_dir, "scaler.pkl")
+    meta_path = os.path.join(version_dir, "metadata.json")
+
+    model = joblib.load(model_path)
+
+    # Suppress verbose output once at load instead of redirecting stdout per call
+    if hasattr(model, 'verbose'):
+        model.verbose = 0
+    if hasattr(model, 'estimators_'):
+        for estimator in model.estimators_:
+            if hasattr(estimator, 'verbose'):
+                estimator.verbose = 0
+
+    scaler = joblib.load(scaler_path) if os.path.exists(scaler_path) else None
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+    else:
+        meta = {"version": version}
+
+    bundle = _Bundle(model, scaler, meta, meta.get("version", version), signature)
+
+    # Warm-up: the first predict() pays for lazy allocations; do it here, not on a request
+    _infer(bundle, np.zeros((1, len(_TELEMETRY_FEATURES))))
+    return bundle
+
+
+def _swap(bundle, started):
+    global _bundle
+    previous = _bundle
+    _bundle = bundle  # single reference assignment: in-flight predictions keep the old bundle
+    clear_cache()
+    _load_state.update(
+        loadedAt=time.time(),
+        loadSeconds=round(time.monotonic() - started, 3),
+        reloads=_load_state["reloads"] + (previous is not None),
+        lastError=None,
+        failedSignature=None,
+    )
+    if previous is None:
+        logger.info(f"Loaded model {bundle.version}")
+    else:
+        logger.info(f"Hot-swapped model {previous.version} -> {bundle.version} "
+                    f"(loaded in {_load_state['loadSeconds']}s)")
 
-_model = None
-_scaler = None
-_model_meta = None
-_lock = Lock()
 
 def _load_latest():
-    global _model, _scaler, _model_meta
+    """Blocking first load (only when no bundle is being served yet)."""
     with _lock:
-        if _model is not None and _scaler is not None:
+        if _bundle is not None:
             return
+        started = time.monotonic()
+        _swap(_load_bundle(*_resolve_latest()), started)
+
+
+def reload_if_changed():
+    """
+    Load the registry's current version if it differs from the served one.
+    Returns True when a new bundle was swapped in. A version that failed to load
+    is not retried until its files change, and each failure (load or registry) is
+    logged once rather than on every watcher poll.
+    """
+    with _lock:
+        try:
+            version, version_dir = _resolve_latest()
+            signature = _signature(version, version_dir)
+        except (OSError, RuntimeError) as e:
+            failure = ("registry", str(e))
+            if failure != _load_state["failedSignature"]:
+                _load_state.update(lastError=f"registry: {e}", failedSignature=failure)
+                logger.warning(f"Model registry check failed: {e}")
+            return False
+
+        if _load_state["failedSignature"] not in (None, signature):
+            _load_state.update(lastError=None, failedSignature=None)  # the registry changed since
+
+        if (_bundle is not None and signature == _bundle.signature) or signature == _load_state["failedSignature"]:
+            return False
+        if _bundle is not None and time.time() - signature[1] < MODEL_SETTLE_SECONDS:
+            return False  # picked up on a later poll once the files stop changing
+
+        started = time.monotonic()
+        try:
+            bundle = _load_bundle(version, version_dir)
+        except Exception as e:
+            _load_state.update(lastError=f"{version}: {type(e).__name__}: {e}", failedSignature=signature)
+            logger.error(f"Failed to load model {version}, keeping "
+                         f"{_bundle.version if _bundle else 'none'}: {e}")
+            return False
+
+        _swap(bundle, started)
+        return True
 
-        latest_marker = os.path.join(MODEL_REGISTRY, "LATEST")
-        version_dir = None
-        version = "direct"
-        
-        # Check if LATEST file exists
-        if os.path.exists(latest_marker):
-            with open(latest_marker, "r") as f:
-                version = f.read().strip()
-            version_dir = os.path.join(MODEL_REGISTRY, version)
-        else:
-            # Look for versioned subdirectories
-            candidates = [
-                os.path.join(MODEL_REGISTRY, d)
-                for d in os.listdir(MODEL_REGISTRY)
-                if os.path.isdir(os.path.join(MODEL_REGISTRY, d)) and d.startswith("v")
-            ]
-            if candidates:
-                version_dir = sorted(candidates, key=os.path.getmtime)[-1]
-                version = os.path.basename(version_dir)
+
+def _watch():
+    while not _watcher_stop.wait(MODEL_WATCH_INTERVAL):
+        reload_if_changed()
+
+
+def start_watcher():
+    """Load the model in the background now and hot-reload registry changes (idempotent)."""
+    global _watcher
+    if _watcher is not None and _watcher.is_alive():
+        return
+    _watcher_stop.clear()
+
+    def run():
+        reload_if_changed()
+        if MODEL_WATCH_INTERVAL > 0:
+            _watch()
+
+    _watcher = Thread(target=run, name="model-watcher", daemon=True)
+    _watcher.start()
+
+
+def stop_watcher():
+    _watcher_stop.set()
+
+
+def model_info():
+    bundle = _bundle
+    return {
+        "version": bundle.version if bundle else None,
+        "watchInterval": MODEL_WATCH_INTERVAL,
+        **{k: v for k, v in _load_state.items() if k != "failedSignature"},
+    }
+
+
+# PREDICTION CACHE
+def clear_cache():
+    """Drop every cached prediction (called whenever a model is swapped in)."""
+    with _cache_lock:
+        _cache.clear()
+        _cache_stats["invalidations"] += 1
+
+
+def cache_stats():
+    with _cache_lock:
+        lookups = _cache_stats["hits"] + _cache_stats["misses"]
+        return {
+            "size": len(_cache),
+            "maxSize": PREDICT_CACHE_SIZE,
+            "ttl": PREDICT_CACHE_TTL,
+            "hitRate": round(_cache_stats["hits"] / lookups, 4) if lookups else None,
+            **_cache_stats,
+        }
+
+
+def _cache_get(keys, now):
+    """Cached output rows for keys (None where missing or expired)."""
+    found = []
+    with _cache_lock:
+        for key in keys:
+            entry = _cache.get(key)
+            if entry is None or entry[1] <= now:
+                found.append(None)
             else:
-                # Fallback to direct model files
-                direct_model = os.path.join(MODEL_REGISTRY, "model.pkl")
-                if os.path.exists(direct_model):
-                    version_dir = MODEL_REGISTRY
-                    version = "direct"
-                    logger.info("Using model files directly from model_registry/")
-                else:
-                    raise RuntimeError("No model found in registry.")
-
-        model_path = os.path.join(version_dir, "model.pkl")
-        scaler_path = os.path.join(version_dir, "scaler.pkl")
-        meta_path = os.path.join(version_dir, "metadata.json")
-
-        _model = joblib.load(model_path)
-        
-        # Suppress verbose output for all estimators
-        if hasattr(_model, 'estimators_'):
-            for estimator in _model.estimators_:
-                if hasattr(estimator, 'verbose'):
-                    estimator.verbose = 0
-        
-        _scaler = joblib.load(scaler_path) if os.path.exists(scaler_path) else None
-        _model_meta = json.load(open(meta_path)) if os.path.exists(meta_path) else {"version": version}
-
-        logger.info(f"Loaded model {version}")
+                _cache.move_to_end(key)
+                found.append(entry[0])
+        hits = sum(r is not None for r in found)
+        _cache_stats["hits"] += hits
+        _cache_stats["misses"] += len(keys) - hits
+    return found
 
-def predict_from_dict(payload: dict, clamp_limits=None):
-    if _model is None or _scaler is None:
+
+def _cache_put(keys, rows, now):
+    with _cache_lock:
+        for key, row in zip(keys, rows):
+            _cache[key] = (row, now + PREDICT_CACHE_TTL)
+            _cache.move_to_end(key)
+        while len(_cache) > PREDICT_CACHE_SIZE:
+            _cache.popitem(last=False)
+            _cache_stats["evictions"] += 1
+
+
+def _feature_matrix(payloads):
+    """
+    Build an (n, 6) float matrix from telemetry dicts; missing or unparsable values
+    become 0.0. Raises InvalidFeaturesError for NaN or infinite values.
+    """
+    X = np.zeros((len(payloads), len(_TELEMETRY_FEATURES)), dtype=float)
+    for i, payload in enumerate(payloads):
+        for j, k in enumerate(_TELEMETRY_FEATURES):
+            v = payload.get(k, 0.0)
+            try:
+                X[i, j] = float(v)
+            except (TypeError, ValueError):
+                X[i, j] = 0.0
+
+    bad = ~np.isfinite(X)
+    if bad.any():
+        i, j = np.argwhere(bad)[0]
+        where = f"item {i}: " if len(payloads) > 1 else ""
+        raise InvalidFeaturesError(f"{where}{_TELEMETRY_FEATURES[j]} must be a finite number")
+    return X
+
+
+def _infer(bundle, X):
+    Xs = bundle.scaler.transform(X) if bundle.scaler else X
+    return np.asarray(bundle.model.predict(Xs), dtype=float).reshape(len(X), -1)
+
+
+def _infer_cached(bundle, X):
+    """
+    Raw model output for X (finite values only), serving rows whose features match
+    a cached row at sensor resolution from the cache.
+    """
+    if PREDICT_CACHE_SIZE <= 0:
+        return _infer(bundle, X)
+
+    now = time.monotonic()
+    steps = np.rint(X / _FEATURE_RESOLUTION).astype(np.int64)
+    keys = [(bundle.signature, tuple(r)) for r in steps.tolist()]
+    rows = _cache_get(keys, now)
+
+    # One inference per distinct missing key (a batch often repeats the same reading)
+    missing = {}
+    for i, r in enumerate(rows):
+        if r is None:
+            missing.setdefault(keys[i], i)
+    if missing:
+        Y_missing = _infer(bundle, X[list(missing.values())])
+        fresh = dict(zip(missing, (row.copy() for row in Y_missing)))
+        _cache_put(list(fresh), list(fresh.values()), now)
+        rows = [fresh[k] if r is None else r for k, r in zip(keys, rows)]
+
+    return np.vstack(rows)
+
+
+def predict_batch(payloads, clamp_limits=None):
+    """
+    Predict actuator durations for many telemetry dicts at once.
+    Scales and runs the forest once over the rows not already in the prediction cache.
+    """
+    if _bundle is None:
         _load_latest()
+    bundle = _bundle  # read once: a concurrent hot swap cannot change it mid-request
 
-    x = []
-    for k in _TELEMETRY_FEATURES:
-        v = payload.get(k, 0.0)
-        try:
-            x.append(float(v))
-        except:
-            x.append(0.0)
+    if not payloads:
+        return []
 
-    X = np.array(x).reshape(1, -1)
-    Xs = _scaler.transform(X) if _scaler else X
+    version = bundle.version
+    X = _feature_matrix(payloads)
+    Y = _infer_cached(bundle, X)
 
-    # Suppress verbose output during prediction
-    import sys
-    from contextlib import redirect_stdout
-    with open(os.devnull, 'w') as devnull:
-        with redirect_stdout(devnull):
-            y_pred = _model.predict(Xs).flatten().tolist()
+    # Pad missing target columns with zeros so every row has all targets
+    if Y.shape[1] < len(_TARGETS):
+        Y = np.hstack([Y, np.zeros((Y.shape[0], len(_TARGETS) - Y.shape[1]))])
 
-    out = {}
     for i, t in enumerate(_TARGETS):
-        val = float(y_pred[i]) if i < len(y_pred) else 0.0
         if clamp_limits and t in clamp_limits:
             lo, hi = clamp_limits[t]
-            val = max(lo, min(hi, val))
-        out[t] = int(round(val))
+            Y[:, i] = np.clip(Y[:, i], lo, hi)
 
-    out["model_version"] = _model_meta.get("version")
-    return out
+    Y = np.rint(Y[:, :len(_TARGETS)]).astype(int)
+
+    results = []
+    for row in Y.tolist():
+        out = dict(zip(_TARGETS, row))
+        out["model_version"] = version
+        results.append(out)
+    return results
+
+
+def predict_from_dict(payload: dict, clamp_limits=None):
+    return predict_batch([payload], clamp_limits=clamp_limits)[0]
@@ -1,5 +1,9 @@
 import csv, json, time, os, signal, sys, random
+import heapq
 import ssl
+import zlib
+from array import array
+import numpy as np
 import requests
 from dotenv import load_dotenv
 from paho.mqtt import client as mqtt
@@ -30,34 +34,144 @@ RETAIN = False
 KIT_ID = os.getenv("KIT_ID")      # None = multi mode
 IS_MULTI = KIT_ID is None
 
-def pick(row, *keys, default=0.0):
-    for k in keys:
-        if k in row and row[k] not in ("", None):
+# Replay: "random" picks a random recorded row per sensor update,
+# "sequential" walks the recording in order (per kit, per sensor)
+REPLAY_MODE = os.getenv("REPLAY_MODE", "random").lower()
+REPLAY_CACHE = os.getenv("REPLAY_CACHE", "true").lower() == "true"  # memory-mapped .npy next to the CSV
+
+# "classic": one MQTT client per kit, polled every 0.2s
+# "fleet": all kits over PUBLISHER_CONNECTIONS clients, driven by a due-time heap
+PUBLISHER_MODE = os.getenv("PUBLISHER_MODE", "classic").lower()
+PUBLISHER_CONNECTIONS = max(1, int(os.getenv("PUBLISHER_CONNECTIONS", "1")))
+FLEET_MAX_INFLIGHT = int(os.getenv("FLEET_MAX_INFLIGHT", "1000"))
+FLEET_STATS_INTERVAL = float(os.getenv("FLEET_STATS_INTERVAL", "10"))  # seconds
+REFRESH_INTERVAL = 3  # seconds between new-kit checks
+# Re-ask for this much history on each check so kits committed late are not missed
+DISCOVERY_OVERLAP_MS = int(os.getenv("DISCOVERY_OVERLAP_MS", "10000"))
+
+# Publish interval per sensor (seconds)
+INTERVALS = {
+    "tempC": 5,
+    "humidity": 5,
+    "waterLevel": 10,
+    "waterTemp": 15,
+    "ppm": 20,
+    "ph": 30,
+}
+
+# CSV column aliases per sensor
+SENSOR_KEYS = {
+    "ppm": ("TDS", "tds"),
+    "ph": ("pH", "ph"),
+    "tempC": ("DHT_temp", "dht_temp", "tempC", "temperature"),
+    "humidity": ("DHT_humidity", "dht_humidity", "humidity"),
+    "waterTemp": ("water_temp", "waterTemp"),
+    "waterLevel": ("water_level", "waterLevel"),
+}
+
+def _first_float(row, idxs, default=0.0):
+    # First non-empty alias column wins; an unparsable value gives default
+    for i in idxs:
+        if i < len(row) and row[i] != "":
             try:
-                return float(row[k])
-            except:
+                return float(row[i])
+            except ValueError:
                 return default
     return default
 
-def read_csv_rows(path):
-    with open(path, newline='', encoding='utf-8') as f:
-        rows = list(csv.DictReader(f))
-        if not rows:
+
+class ReplaySource:
+    """
+    Recorded sensor values parsed once into one contiguous float64 column per
+    sensor (shape: sensors x rows). With caching enabled the matrix is saved as
+    <csv>.npy and memory-mapped on later runs, so large recordings never live
+    in memory as Python dicts.
+    """
+
+    SENSORS = list(SENSOR_KEYS)
+
+    def __init__(self, path, use_cache=True, mode="random"):
+        self.mode = mode
+        self.data = self._load(path, use_cache)
+        self.n_rows = self.data.shape[1]
+        self.col = {s: i for i, s in enumerate(self.SENSORS)}
+        self._cursor = {}  # (kit, sensor) -> next row for sequential replay
+
+    @classmethod
+    def _load(cls, path, use_cache):
+        cache_path = os.path.splitext(path)[0] + ".npy"
+
+        if use_cache and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            return np.load(cache_path, mmap_mode="r")
+
+        data = cls._parse_csv(path)
+
+        if use_cache:
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, data)
+            os.replace(tmp_path, cache_path)
+            return np.load(cache_path, mmap_mode="r")
+
+        return data
+
+    @classmethod
+    def _parse_csv(cls, path):
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if not header:
+                raise ValueError("CSV kosong atau header salah.")
+
+            # Resolve column aliases once instead of per value
+            index = {name: i for i, name in enumerate(header)}
+            sources = [[index[k] for k in SENSOR_KEYS[s] if k in index] for s in cls.SENSORS]
+            columns = [array('d') for _ in cls.SENSORS]
+
+            for row in reader:
+                for column, idxs in zip(columns, sources):
+                    column.append(_first_float(row, idxs))
+
+        if not len(columns[0]):
             raise ValueError("CSV kosong atau header salah.")
-        return rows
 
-def fetch_device_ids():
+        return np.vstack([np.frombuffer(c, dtype=np.float64) for c in columns])
+
+    def sample(self, kit, sensor):
+        """Next replay value of a sensor for a kit."""
+        if self.mode == "sequential":
+            key = (kit, sensor)
+            row = self._cursor.get(key)
+            if row is None:
+                # Each kit starts at its own offset so kits don't replay identical streams
+                row = zlib.crc32(kit.encode()) % self.n_rows
+            self._cursor[key] = (row + 1) % self.n_rows
+        else:
+            row = random.randrange(self.n_rows)
+
+        return float(self.data[self.col[sensor], row])
+
+def fetch_device_ids(since=None):
+    """
+    Return (device_ids, cursor). With a cursor from a previous call only kits
+    created since then are fetched; pass the returned cursor to the next call.
+    """
+    params = {}
+    if since is not None:
+        params["since"] = max(0, since - DISCOVERY_OVERLAP_MS)
+
     try:
-        res = requests.get(BACKEND_URL, timeout=5)
+        res = requests.get(BACKEND_URL, params=params, timeout=5)
         if res.status_code == 200:
             data = res.json()
-            return [item["id"] for item in data]
+            cursor = res.headers.get("X-Kits-Cursor")
+            return [item["id"] for item in data], int(cursor) if cursor else since
         else:
             print("[ERR] Failed fetch /kits:", res.status_code, res.text)
-            return []
+            return [], since
     except Exception as e:
         print("[ERR] Cannot reach backend:", e)
-        return []
+        return [], since
 
 def create_client(client_id):
     c = mqtt.Client(
@@ -77,48 +191,116 @@ def create_client(client_id):
     c.loop_start()
     return c
 
-def build_payload(row):
-    return {
-        "tempC": pick(row, "DHT_temp", "dht_temp", "tempC", "temperature"),
-        "humidity": pick(row, "DHT_humidity", "dht_humidity", "humidity"),
-        "waterLevel": pick(row, "water_level", "waterLevel"),
-        "waterTemp": pick(row, "water_temp", "waterTemp"),
-        "ppm": pick(row, "TDS", "tds"),
-        "ph": pick(row, "pH", "ph"),
-    }
+def run_fleet(source, device_ids, cursor=None):
+    """
+    Publish for every kit over a small pool of shared connections.
+    Each (kit, sensor) pair sits in a heap keyed by its next due time, so a
+    tick only touches what is due instead of scanning every kit and sensor.
+    """
+    clients = [
+        create_client(f"pub-fleet-{os.getpid()}-{i}")
+        for i in range(PUBLISHER_CONNECTIONS)
+    ]
+    for c in clients:
+        c.max_inflight_messages_set(FLEET_MAX_INFLIGHT)
+        c.max_queued_messages_set(0)  # unbounded client-side queue
+
+    heap = []          # (dueTime, kit, sensor)
+    kit_client = {}    # kit -> shard client
+
+    def add_kit(kit, now):
+        kit_client[kit] = clients[zlib.crc32(kit.encode()) % len(clients)]
+        # Spread first publishes over one interval so kits don't fire in lockstep
+        for sensor, interval in INTERVALS.items():
+            heapq.heappush(heap, (now + random.uniform(0, interval), kit, sensor))
+
+    start = time.time()
+    for kit in device_ids:
+        add_kit(kit, start)
+
+    print(f"[MODE] FLEET → {len(device_ids)} kits over {len(clients)} connection(s)")
+    print("[OK] Publisher berjalan...\n")
+
+    published = 0
+    last_stats = time.monotonic()
+    last_stats_count = 0
+    last_refresh = start
+
+    try:
+        while RUNNING:
+            now = time.time()
+
+            if IS_MULTI and (now - last_refresh >= REFRESH_INTERVAL):
+                new_ids, cursor = fetch_device_ids(cursor)
+                for new_kit in new_ids:
+                    if new_kit not in kit_client:
+                        add_kit(new_kit, now)
+                        print(f"[NEW] Started publishing to {new_kit}")
+                last_refresh = now
+
+            # Pop everything due and group sensors per kit into one message
+            batch = {}
+            while heap and heap[0][0] <= now:
+                due, kit, sensor = heapq.heappop(heap)
+                batch.setdefault(kit, {})[sensor] = source.sample(kit, sensor)
+
+                next_due = due + INTERVALS[sensor]
+                if next_due <= now:
+                    # Fell behind by a whole interval: skip ahead rather than burst
+                    next_due = now + INTERVALS[sensor]
+                heapq.heappush(heap, (next_due, kit, sensor))
+
+            for kit, partial_payload in batch.items():
+                kit_client[kit].publish(
+                    f"kit/{kit}/telemetry", json.dumps(partial_payload), qos=QOS, retain=RETAIN
+                )
+            published += len(batch)
+
+            mono = time.monotonic()
+            if mono - last_stats >= FLEET_STATS_INTERVAL:
+                rate = (published - last_stats_count) / (mono - last_stats)
+                print(f"[STATS] kits={len(kit_client)} published={published} rate={rate:.1f} msg/s")
+                last_stats, last_stats_count = mono, published
+
+            # Sleep until the next sensor is due (capped so signals stay responsive)
+            wait = heap[0][0] - time.time() if heap else 0.5
+            time.sleep(min(max(wait, 0.0), 0.5))
+
+    finally:
+        print("\n[STOP] Publisher berhenti.\n")
+        for c in clients:
+            c.loop_stop()
+            c.disconnect()
 
 def main():
     try:
-        rows = read_csv_rows(CSV_PATH)
+        source = ReplaySource(CSV_PATH, use_cache=REPLAY_CACHE, mode=REPLAY_MODE)
     except Exception as e:
         print("[ERR] Gagal baca CSV:", e)
         sys.exit(1)
 
     if IS_MULTI:
-        device_ids = fetch_device_ids()
+        device_ids, cursor = fetch_device_ids()
+        device_ids = set(device_ids)
         if not device_ids:
             print("[ERR] Tidak ada deviceId di backend.")
             sys.exit(1)
         print("[MODE] MULTI-KIT")
         print("[DEVICES]", device_ids)
     else:
-        device_ids = [KIT_ID]
+        device_ids = {KIT_ID}
+        cursor = None
         print("[MODE] SINGLE-KIT →", KIT_ID)
 
+    if PUBLISHER_MODE == "fleet":
+        run_fleet(source, device_ids, cursor)
+        return
+
     clients = {kit: create_client(f"pub-{kit}") for kit in device_ids}
 
     print("[OK] Publisher berjalan...\n")
 
     try:
-        INTERVALS = {
-            "tempC": 5,
-            "humidity": 5,
-            "waterLevel": 10,
-            "waterTemp": 15,
-            "ppm": 20,
-            "ph": 30,
-        }
-
         # state per kit
         device_state = {
             kit: {s: 0.0 for s in INTERVALS.keys()}
@@ -132,33 +314,25 @@ def main():
             for kit in device_ids
         }
 
-        # randow row each kit
-        device_row_idx = {
-            kit: random.randint(0, len(rows) - 1)
-            for kit in device_ids
-        }
-
         # Track last refresh time for auto-refresh
         last_refresh = time.time()
-        REFRESH_INTERVAL = 3  # seconds
 
         while RUNNING:
             now = time.time()
 
             # Auto-refresh: check for new kits every 3 seconds
             if IS_MULTI and (now - last_refresh >= REFRESH_INTERVAL):
-                new_ids = fetch_device_ids()
+                new_ids, cursor = fetch_device_ids(cursor)
                 for new_kit in new_ids:
                     if new_kit not in device_ids:
                         print(f"\n[NEW] Detected new kit: {new_kit}")
                         # Add to device list
-                        device_ids.append(new_kit)
+                        device_ids.add(new_kit)
                         # Create MQTT client
                         clients[new_kit] = create_client(f"pub-{new_kit}")
                         # Initialize state
                         device_state[new_kit] = {s: 0.0 for s in INTERVALS.keys()}
                         device_timer[new_kit] = {s: now - INTERVALS[s] for s in INTERVALS.keys()}
-                        device_row_idx[new_kit] = random.randint(0, len(rows) - 1)
                         print(f"[NEW] Started publishing to {new_kit}\n")
                 last_refresh = now
 
@@ -172,21 +346,8 @@ def main():
                     elapsed = now - device_timer[kit][sensor]
                     
                     if elapsed >= INTERVALS[sensor]:
-                        # Pick a random row for THIS sensor update
-                        row = rows[random.randint(0, len(rows) - 1)]
-                        
-                        if sensor == "ppm":
-                            value = pick(row, "TDS", "tds")
-                        elif sensor == "ph":
-                            value = pick(row, "pH", "ph")
-                        elif sensor == "tempC":
-                            value = pick(row, "DHT_temp", "dht_temp", "tempC")
-                        elif sensor == "humidity":
-                            value = pick(row, "DHT_humidity", "humidity")
-                        elif sensor == "waterTemp":
-                            value = pick(row, "water_temp")
-                        elif sensor == "waterLevel":
-                            value = pick(row, "water_level")
+                        # Pick the next replay value for THIS sensor update
+                        value = source.sample(kit, sensor)
                         
                         # Update state and add to partial payload
                         device_state[kit][sensor] = value
@@ -2,12 +2,17 @@ import json
 import time
 import signal
 import os
+import re
 import ssl
+import random
+import logging
 import requests
 from dotenv import load_dotenv
 from paho.mqtt import client as mqtt
 from threading import Lock, Thread
+from queue import Queue, Empty, Full
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # Load .env file from same directory
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
@@ -42,6 +47,23 @@ MQTT_PASSWORD = os.getenv("MQTT_PASSWORD", "")
 USE_TLS = os.getenv("MQTT_USE_TLS", "true").lower() == "true"
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000/telemetry")
+BACKEND_BULK_URL = os.getenv("BACKEND_BULK_URL", BACKEND_URL.rstrip("/") + "/bulk")
+
+# Forwarding stage: on_message only enqueues, workers batch-POST to the backend
+FORWARD_QUEUE_SIZE = int(os.getenv("FORWARD_QUEUE_SIZE", "10000"))
+FORWARD_WORKERS = int(os.getenv("FORWARD_WORKERS", "2"))
+FORWARD_FLUSH_WINDOW = float(os.getenv("FORWARD_FLUSH_WINDOW", "1.0"))  # seconds
+FORWARD_MAX_BATCH = int(os.getenv("FORWARD_MAX_BATCH", "500"))
+FORWARD_TIMEOUT = float(os.getenv("FORWARD_TIMEOUT", "5"))
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", "30"))  # seconds between [STATS] lines
+
+# Output mode: "pretty" prints every message for local debugging,
+# "production" emits level-gated JSON log lines and no per-message pretty-printing
+LOG_MODE = os.getenv("LOG_MODE", "pretty").lower()
+PRETTY = LOG_MODE != "production"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))  # share of per-message events logged
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 = no HTTP metrics endpoint
 
 KIT_ID = os.getenv("KIT_ID")
 IS_MULTI = KIT_ID is None
@@ -55,15 +77,156 @@ QOS = 1
 
 CLIENT_ID = f"csv-subscriber-{KIT_ID}"
 
-STATE = {}   # per-device state
-state_lock = Lock()
-
-# Track which sensors have updated since last backend send
-sensor_updated = {}  # per-device: {sensor: bool}
 REQUIRED_SENSORS = ["ppm", "ph", "tempC", "humidity", "waterTemp", "waterLevel"]
+SENSOR_BIT = {s: 1 << i for i, s in enumerate(REQUIRED_SENSORS)}
+ALL_SENSORS_MASK = (1 << len(REQUIRED_SENSORS)) - 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, event plus any extra={"fields": {...}}."""
+
+    def format(self, record):
+        out = {"ts": round(record.created, 3), "level": record.levelname, "event": record.getMessage()}
+        out.update(getattr(record, "fields", {}))
+        return json.dumps(out, separators=(",", ":"))
+
+
+log = logging.getLogger("subscriber")
+if not PRETTY:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(JsonFormatter())
+    log.addHandler(_log_handler)
+    log.setLevel(LOG_LEVEL)
+    log.propagate = False
+
+
+def sampled():
+    return random.random() < LOG_SAMPLE_RATE
+
+
+class Metrics:
+    """Counters plus a snapshot-latency histogram, safe to update from any thread."""
+
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = Lock()
+        self.counters = {"messages": 0, "parseFailures": 0, "snapshotsReady": 0}
+        self.latency_counts = [0] * (len(self.LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.messages_per_sec = 0.0
+        self._rate_mark = (time.monotonic(), 0)
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def observe_latency(self, seconds):
+        i = 0
+        while i < len(self.LATENCY_BUCKETS) and seconds > self.LATENCY_BUCKETS[i]:
+            i += 1
+        with self._lock:
+            self.latency_counts[i] += 1
+            self.latency_sum += seconds
+
+    def tick(self):
+        """Recompute messages/s since the previous tick."""
+        now = time.monotonic()
+        with self._lock:
+            last_time, last_count = self._rate_mark
+            count = self.counters["messages"]
+            if now > last_time:
+                self.messages_per_sec = (count - last_count) / (now - last_time)
+            self._rate_mark = (now, count)
+
+    def snapshot(self):
+        with self._lock:
+            out = dict(self.counters)
+            out["messagesPerSec"] = round(self.messages_per_sec, 2)
+            count = sum(self.latency_counts)
+            out["snapshotLatencyCount"] = count
+            out["snapshotLatencyAvg"] = round(self.latency_sum / count, 4) if count else 0.0
+            out["snapshotLatencyBuckets"] = list(self.latency_counts)
+            out["snapshotLatencySum"] = self.latency_sum
+        return out
 
-print(f"{Colors.BLUE}[INIT]{Colors.RESET} KIT_ID: {KIT_ID}")
-print(f"{Colors.BLUE}[INIT]{Colors.RESET} SUBSCRIBING: {TOPIC}")
+
+metrics = Metrics()
+
+_GAUGES = {"depth", "maxDepth", "messagesPerSec"}
+
+
+def _metric_name(key):
+    return "subscriber_" + re.sub(r"(?<!^)(?=[A-Z])", "_", key).lower()
+
+
+def collect_stats():
+    stats = metrics.snapshot()
+    stats.update({f"forward{k[0].upper()}{k[1:]}" if k not in _GAUGES else k: v
+                  for k, v in forwarder.snapshot_stats().items()})
+    return stats
+
+
+def render_prometheus(stats):
+    """Prometheus text exposition of collect_stats()."""
+    lines = []
+    for key, value in stats.items():
+        if key.startswith("snapshotLatency"):
+            continue
+        name = _metric_name(key)
+        if key in _GAUGES:
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        else:
+            lines.append(f"# TYPE {name}_total counter")
+            lines.append(f"{name}_total {value}")
+
+    name = "subscriber_snapshot_latency_seconds"
+    lines.append(f"# TYPE {name} histogram")
+    cumulative = 0
+    buckets = stats["snapshotLatencyBuckets"]
+    for le, n in zip(Metrics.LATENCY_BUCKETS, buckets):
+        cumulative += n
+        lines.append(f'{name}_bucket{{le="{le}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{le="+Inf"}} {cumulative + buckets[-1]}')
+    lines.append(f"{name}_sum {stats['snapshotLatencySum']}")
+    lines.append(f"{name}_count {stats['snapshotLatencyCount']}")
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(port):
+    """Serve /metrics (Prometheus text) and /metrics.json on a background thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = render_prometheus(collect_stats()).encode()
+                content_type = "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body = json.dumps(collect_stats()).encode()
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+if PRETTY:
+    print(f"{Colors.BLUE}[INIT]{Colors.RESET} KIT_ID: {KIT_ID}")
+    print(f"{Colors.BLUE}[INIT]{Colors.RESET} SUBSCRIBING: {TOPIC}")
+else:
+    log.info("init", extra={"fields": {"kitId": KIT_ID, "topic": TOPIC}})
 
 def safe_float(x, default=None):
     try:
@@ -78,39 +241,269 @@ def safe_float(x, default=None):
 def pretty_json(obj):
     return json.dumps(obj, indent=2, ensure_ascii=False)
 
-def send_snapshot(kit_id):
+
+class DeviceState:
+    """
+    Compact per-device record: one float slot per sensor plus a bitmask of
+    sensors updated since the last snapshot was sent.
+    """
+    __slots__ = ("ppm", "ph", "tempC", "humidity", "waterTemp", "waterLevel", "updated")
+
+    def __init__(self):
+        self.ppm = 0.0
+        self.ph = 0.0
+        self.tempC = 0.0
+        self.humidity = 0.0
+        self.waterTemp = 0.0
+        self.waterLevel = 0.0
+        self.updated = 0
+
+    def apply(self, data):
+        for key, value in data.items():
+            bit = SENSOR_BIT.get(key)
+            if bit is not None:
+                setattr(self, key, safe_float(value, getattr(self, key)))
+                self.updated |= bit
+
+    def is_ready(self):
+        return self.updated == ALL_SENSORS_MASK
+
+    def pending(self):
+        return [s for s in REQUIRED_SENSORS if not self.updated & SENSOR_BIT[s]]
+
+    def to_dict(self):
+        return {s: getattr(self, s) for s in REQUIRED_SENSORS}
+
+
+DEVICES = {}   # per-device state: kit_id -> DeviceState
+state_lock = Lock()
+
+class SnapshotForwarder:
+    """
+    Bounded queue between the MQTT network thread and the backend.
+    Workers drain it, keep only the newest snapshot per device within
+    FORWARD_FLUSH_WINDOW, and POST each batch to /telemetry/bulk over a
+    persistent session. submit() never blocks; when the queue is full the
+    snapshot is dropped and counted.
+    """
+
+    def __init__(self, url, queue_size, workers, flush_window, max_batch, timeout, metrics=None):
+        self.url = url
+        self.metrics = metrics
+        self.workers = workers
+        self.flush_window = flush_window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.queue = Queue(maxsize=queue_size)
+        self.stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "sent": 0,
+            "duplicates": 0,
+            "failedBatches": 0,
+            "maxDepth": 0,
+        }
+        self._stats_lock = Lock()
+        self._stopping = False
+        self._threads = []
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def start(self):
+        for i in range(self.workers):
+            t = Thread(target=self._worker, name=f"forwarder-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=5.0):
+        """Let workers drain what is already queued, then exit."""
+        self._stopping = True
+        for t in self._threads:
+            t.join(timeout)
+
+    def submit(self, kit_id, snapshot):
+        try:
+            self.queue.put_nowait((kit_id, int(time.time() * 1000), snapshot, time.monotonic()))
+        except Full:
+            self._count("dropped")
+            return False
+
+        depth = self.queue.qsize()
+        with self._stats_lock:
+            self.stats["enqueued"] += 1
+            if depth > self.stats["maxDepth"]:
+                self.stats["maxDepth"] = depth
+        return True
+
+    def snapshot_stats(self):
+        with self._stats_lock:
+            out = dict(self.stats)
+        out["depth"] = self.queue.qsize()
+        return out
+
+    def _worker(self):
+        session = requests.Session()
+        try:
+            while not (self._stopping and self.queue.empty()):
+                try:
+                    kit_id, *item = self.queue.get(timeout=0.5)
+                except Empty:
+                    continue
+
+                # Coalesce per device until the flush window closes or the batch is full
+                batch = {kit_id: item}
+                deadline = time.monotonic() + self.flush_window
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        kit_id, *item = self.queue.get(timeout=remaining)
+                    except Empty:
+                        break
+                    if kit_id in batch:
+                        self._count("coalesced")
+                    batch[kit_id] = item
+
+                self._post(session, batch)
+        finally:
+            session.close()
+
+    def _post(self, session, batch):
+        records = [
+            {"deviceId": kit_id, "ts": ts, "payload": payload}
+            for kit_id, (ts, payload, _) in batch.items()
+        ]
+
+        try:
+            r = session.post(self.url, json=records, timeout=self.timeout)
+            if r.status_code == 200:
+                body = r.json()
+                self._count("sent", len(records))
+                self._count("duplicates", body.get("duplicates", 0))
+
+                if self.metrics:
+                    done = time.monotonic()
+                    for _, _, enqueued_at in batch.values():
+                        self.metrics.observe_latency(done - enqueued_at)
+
+                if PRETTY:
+                    print(f"{Colors.GREEN}[RESP]{Colors.RESET} Sent {len(records)} snapshots | "
+                          f"inserted={body.get('inserted')} duplicates={body.get('duplicates')} invalid={body.get('invalid')}")
+                else:
+                    log.debug("batch_sent", extra={"fields": {
+                        "records": len(records),
+                        "inserted": body.get("inserted"),
+                        "duplicates": body.get("duplicates"),
+                        "invalid": body.get("invalid"),
+                    }})
+            else:
+                self._count("failedBatches")
+                if PRETTY:
+                    print(f"{Colors.RED}[ERR]{Colors.RESET} Backend Status: {r.status_code} | {r.text}")
+                else:
+                    log.warning("batch_failed", extra={"fields": {"status": r.status_code, "records": len(records)}})
+        except Exception as e:
+            self._count("failedBatches")
+            if PRETTY:
+                print(f"{Colors.RED}[ERR]{Colors.RESET} Backend error:", e)
+            else:
+                log.warning("batch_error", extra={"fields": {"error": str(e), "records": len(records)}})
+
+
+forwarder = SnapshotForwarder(
+    BACKEND_BULK_URL,
+    queue_size=FORWARD_QUEUE_SIZE,
+    workers=FORWARD_WORKERS,
+    flush_window=FORWARD_FLUSH_WINDOW,
+    max_batch=FORWARD_MAX_BATCH,
+    timeout=FORWARD_TIMEOUT,
+    metrics=metrics,
+)
+
+
+def send_snapshot(kit_id, snapshot):
+    """Hand a complete device snapshot to the forwarder. Never blocks."""
+    queued = forwarder.submit(kit_id, snapshot)
+
+    if not PRETTY:
+        return
+
+    if queued:
+        print(f"{Colors.WHITE}[SEND]{Colors.RESET} Queued snapshot for {kit_id} (depth={forwarder.queue.qsize()})")
+    else:
+        print(f"{Colors.YELLOW}[DROP]{Colors.RESET} Forward queue full, snapshot for {kit_id} dropped")
+
+
+def update_state(kit_id, data):
+    """
+    Merge a partial reading into the device state.
+    Returns the full state once every sensor has updated (and resets the
+    bitmask), otherwise None.
+    """
     with state_lock:
-        payload = STATE.get(kit_id, {})
+        # ensure this device has its own state
+        rec = DEVICES.get(kit_id)
+        if rec is None:
+            rec = DEVICES[kit_id] = DeviceState()
 
-    print(f"\n{Colors.BOLD}{Colors.WHITE}[SEND]{Colors.RESET} Sending Snapshot to Backend...")
-    print(f"{Colors.WHITE}POST /telemetry?deviceId={kit_id}{Colors.RESET}")
-    print(f"{Colors.WHITE}{pretty_json(payload)}{Colors.RESET}")
+        # Update state with new data from MQTT and mark sensors as updated
+        rec.apply(data)
 
-    try:
-        r = requests.post(
-            f"{BACKEND_URL}?deviceId={kit_id}",
-            json=payload,
-            timeout=5
-        )
-        print(f"{Colors.GREEN}[RESP]{Colors.RESET} Backend Status: {r.status_code} | {r.text}")
-    except Exception as e:
-        print(f"{Colors.RED}[ERR]{Colors.RESET} Backend error:", e)
+        # Check if all sensors have been updated at least once
+        if rec.is_ready():
+            rec.updated = 0
+            return rec.to_dict()
+
+    return None
 
 
 def on_connect(client, userdata, flags, reason_code, properties):
-    print(f"{Colors.GREEN}[MQTT]{Colors.RESET} Connected → {TOPIC}")
+    if PRETTY:
+        print(f"{Colors.GREEN}[MQTT]{Colors.RESET} Connected → {TOPIC}")
+    else:
+        log.info("connected", extra={"fields": {"topic": TOPIC}})
     client.subscribe(TOPIC, qos=QOS)
 
-def on_message(client, userdata, msg):
+
+def print_message(topic, kit_id, data, snapshot):
+    """Human-readable dump of one message (pretty mode only)."""
     t = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     print(f"\n{Colors.DIM}{Colors.MAGENTA}{'=' * 50}{Colors.RESET}")
     print(f"{Colors.CYAN}[RECV]{Colors.RESET} MQTT MESSAGE RECEIVED")
     print(f"{Colors.CYAN}[TIME]{Colors.RESET} {t}")
-    print(f"{Colors.CYAN}[TOPIC]{Colors.RESET} {msg.topic}")
+    print(f"{Colors.CYAN}[TOPIC]{Colors.RESET} {topic}")
+    print(f"{Colors.CYAN}[DEVICE]{Colors.RESET} {kit_id}")
+    print(f"{Colors.DIM}{Colors.MAGENTA}{'=' * 50}{Colors.RESET}\n")
+
+    print("Payload:")
+    print(pretty_json(data))
+    print()
+
+    with state_lock:
+        rec = DEVICES[kit_id]
+        state = rec.to_dict()
+        pending = rec.pending()
+
+    print("Updated State:")
+    print(pretty_json(snapshot if snapshot is not None else state))
+    print()
+
+    if snapshot is not None:
+        print(f"{Colors.GREEN}[OK]{Colors.RESET} All sensors updated, queueing for backend...")
+    else:
+        print(f"{Colors.YELLOW}[WAIT]{Colors.RESET} Pending: {', '.join(pending)}")
+
+
+def on_message(client, userdata, msg):
+    metrics.inc("messages")
 
     try:
-        data = json.loads(msg.payload.decode())
+        data = json.loads(msg.payload)
 
         # detect deviceId from topic
         if IS_MULTI:
@@ -118,53 +511,28 @@ def on_message(client, userdata, msg):
         else:
             kit_id = KIT_ID
 
-        print(f"{Colors.CYAN}[DEVICE]{Colors.RESET} {kit_id}")
-        print(f"{Colors.DIM}{Colors.MAGENTA}{'=' * 50}{Colors.RESET}\n")
-
-        print("Payload:")
-        print(pretty_json(data))
-        print()
-
-        # ensure this device has its own state
-        with state_lock:
-            if kit_id not in STATE:
-                STATE[kit_id] = {
-                    "ppm": 0.0,
-                    "ph": 0.0,
-                    "tempC": 0.0,
-                    "humidity": 0.0,
-                    "waterTemp": 0.0,
-                    "waterLevel": 0.0,
-                }
-                sensor_updated[kit_id] = {s: False for s in REQUIRED_SENSORS}
-
-            # Update state with new data from MQTT and mark sensors as updated
-            for key in data:
-                if key in STATE[kit_id]:
-                    STATE[kit_id][key] = safe_float(data[key], STATE[kit_id][key])
-                    sensor_updated[kit_id][key] = True  # Mark this sensor as updated
-
-        print("Updated State:")
-        print(pretty_json(STATE[kit_id]))
-        print()
-
-        # Check if all sensors have been updated at least once
-        all_updated = all(sensor_updated[kit_id].values())
-        
-        if all_updated:
-            print(f"{Colors.GREEN}[OK]{Colors.RESET} All sensors updated, sending to backend...")
-            send_snapshot(kit_id)
-            # Reset the tracking
-            sensor_updated[kit_id] = {s: False for s in REQUIRED_SENSORS}
-        else:
-            pending = [s for s, updated in sensor_updated[kit_id].items() if not updated]
-            print(f"{Colors.YELLOW}[WAIT]{Colors.RESET} Pending: {', '.join(pending)}")
-
-        print(f"{Colors.DIM}{Colors.MAGENTA}{'=' * 50}{Colors.RESET}")
+        snapshot = update_state(kit_id, data)
 
     except Exception as e:
-        print(f"{Colors.RED}[ERR]{Colors.RESET} Failed to parse MQTT:", e)
-        print(f"{Colors.RED}[RAW]{Colors.RESET}", msg.payload)
+        metrics.inc("parseFailures")
+        if PRETTY:
+            print(f"{Colors.RED}[ERR]{Colors.RESET} Failed to parse MQTT:", e)
+            print(f"{Colors.RED}[RAW]{Colors.RESET}", msg.payload)
+            print(f"{Colors.DIM}{Colors.MAGENTA}{'=' * 50}{Colors.RESET}")
+        elif sampled():
+            log.warning("parse_failed", extra={"fields": {"topic": msg.topic, "error": str(e)}})
+        return
+
+    if PRETTY:
+        print_message(msg.topic, kit_id, data, snapshot)
+    elif log.isEnabledFor(logging.DEBUG) and sampled():
+        log.debug("message", extra={"fields": {"device": kit_id, "keys": list(data), "ready": snapshot is not None}})
+
+    if snapshot is not None:
+        metrics.inc("snapshotsReady")
+        send_snapshot(kit_id, snapshot)
+
+    if PRETTY:
         print(f"{Colors.DIM}{Colors.MAGENTA}{'=' * 50}{Colors.RESET}")
 
 def main():
@@ -184,18 +552,45 @@ def main():
     client.on_connect = on_connect
     client.on_message = on_message
 
+    forwarder.start()
+
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+
     client.loop_start()
     client.connect(BROKER, PORT)
 
-    print(f"{Colors.BLUE}[INFO]{Colors.RESET} Subscriber running...\n")
+    if PRETTY:
+        print(f"{Colors.BLUE}[INFO]{Colors.RESET} Subscriber running...\n")
+    else:
+        log.info("running", extra={"fields": {"metricsPort": METRICS_PORT or None}})
+
+    last_stats = time.monotonic()
 
     try:
         while RUNNING:
             time.sleep(0.1)
+
+            if time.monotonic() - last_stats >= STATS_INTERVAL:
+                last_stats = time.monotonic()
+                metrics.tick()
+                st = collect_stats()
+                if PRETTY:
+                    print(f"{Colors.BLUE}[STATS]{Colors.RESET} msg/s={st['messagesPerSec']} parseFailures={st['parseFailures']} "
+                          f"depth={st['depth']} maxDepth={st['maxDepth']} dropped={st['forwardDropped']} "
+                          f"coalesced={st['forwardCoalesced']} sent={st['forwardSent']} "
+                          f"failedBatches={st['forwardFailedBatches']} latencyAvg={st['snapshotLatencyAvg']}s")
+                else:
+                    st.pop("snapshotLatencyBuckets")
+                    log.info("stats", extra={"fields": st})
     finally:
-        print(f"\n{Colors.YELLOW}[STOP]{Colors.RESET} Subscriber berhenti.")
+        if PRETTY:
+            print(f"\n{Colors.YELLOW}[STOP]{Colors.RESET} Subscriber berhenti.")
+        else:
+            log.info("stopped")
         client.loop_stop()
         client.disconnect()
+        forwarder.stop()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,78 @@
+import math
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services.ml import predictor
+from services.api import ml_service
+
+
+class EchoModel:
+    """Returns the first four features unchanged and records every input it sees."""
+
+    def __init__(self):
+        self.seen = []
+
+    def predict(self, X):
+        self.seen.append(np.array(X))
+        return np.array(X)[:, :4] * 100
+
+
+@pytest.fixture
+def model(monkeypatch):
+    m = EchoModel()
+    bundle = predictor._Bundle(m, None, {}, "test", ("test", 0.0))
+    monkeypatch.setattr(predictor, "_bundle", bundle)
+    predictor.clear_cache()
+    yield m
+    predictor.clear_cache()
+
+
+@pytest.mark.parametrize("cache_size", [0, 100])
+def test_model_sees_unrounded_input(model, monkeypatch, cache_size):
+    monkeypatch.setattr(predictor, "PREDICT_CACHE_SIZE", cache_size)
+    out = predictor.predict_from_dict({"ppm": 700.4, "ph": 6.004})
+    assert model.seen[-1][0, 0] == 700.4
+    assert model.seen[-1][0, 1] == 6.004
+    assert out["phDown"] == round(600.4)
+
+
+def test_cache_key_is_quantized(model):
+    predictor.predict_from_dict({"ppm": 700.4, "ph": 6.004})
+    predictor.predict_from_dict({"ppm": 700.3, "ph": 6.001})
+    assert len(model.seen) == 1
+
+
+@pytest.mark.parametrize("bad", [math.nan, math.inf, -math.inf])
+def test_non_finite_features_are_rejected(model, bad):
+    with pytest.raises(predictor.InvalidFeaturesError, match="ph"):
+        predictor.predict_from_dict({"ppm": 700, "ph": bad})
+    assert model.seen == []
+    assert predictor.cache_stats()["size"] == 0
+
+
+def test_non_finite_request_does_not_share_cache_entry(model):
+    with pytest.raises(predictor.InvalidFeaturesError):
+        predictor.predict_from_dict({"ph": math.nan})
+    with pytest.raises(predictor.InvalidFeaturesError):
+        predictor.predict_from_dict({"ph": math.inf})
+    assert model.seen == []
+
+
+def test_api_returns_422_for_non_finite(model):
+    app = FastAPI()
+    app.include_router(ml_service.ml_router)
+    client = TestClient(app)
+
+    r = client.post("/predict", content='{"ppm": 700, "ph": NaN}',
+                    headers={"Content-Type": "application/json"})
+    assert r.status_code == 422
+    assert "ph" in r.json()["detail"]
+
+    r = client.post("/predict/batch", content='{"items": [{"ph": 6.0}, {"tempC": Infinity}]}',
+                    headers={"Content-Type": "application/json"})
+    assert r.status_code == 422
+    assert "item 1: tempC" in r.json()["detail"]
+    assert model.seen == []